@@ -3,12 +3,17 @@ import sys
 import os
 import subprocess
 import glob
+import argparse
 
 import click
 
 from charcoal.version import version
 
 
+# fraction of the available memory to let snakemake schedule jobs in.
+MEM_FRACTION = 0.9
+
+
 def get_snakefile_path(name):
     thisdir = os.path.dirname(__file__)
     snakefile = os.path.join(thisdir, name)
@@ -21,8 +26,77 @@ def get_package_configfile(filename):
     return configfile
 
 
+def _read_cgroup_file(filename):
+    "Read the first line of a cgroup control file, or None."
+    try:
+        with open(filename, 'rt') as fp:
+            return fp.readline().strip()
+    except OSError:
+        return None
+
+
+def detect_cores():
+    "Number of cores available to this process, incl. cgroup CPU quotas."
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:                # not on Linux
+        cores = os.cpu_count() or 1
+
+    # cgroup v2, then v1, CPU quota
+    quota = _read_cgroup_file('/sys/fs/cgroup/cpu.max')
+    if quota:
+        quota, _, period = quota.partition(' ')
+    else:
+        quota = _read_cgroup_file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period = _read_cgroup_file('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    try:
+        quota, period = int(quota), int(period)
+        if quota > 0 and period > 0:
+            cores = min(cores, max(1, -(-quota // period)))
+    except (TypeError, ValueError):       # no quota ('max' or missing)
+        pass
+
+    return max(1, cores)
+
+
+def detect_mem_mb():
+    """
+    Memory available for jobs, in MB, incl. cgroup limits; None if it
+    can't be determined.
+    """
+    mem = None
+    try:
+        with open('/proc/meminfo', 'rt') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    mem = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+
+    if mem is None:
+        try:
+            mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    # cgroup v2, then v1, memory limit
+    for filename in ('/sys/fs/cgroup/memory.max',
+                     '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        limit = _read_cgroup_file(filename)
+        try:
+            mem = min(mem, int(limit))
+            break
+        except (TypeError, ValueError):   # no limit ('max' or missing)
+            pass
+
+    # leave some headroom for snakemake itself & the OS.
+    return max(1, int(mem * MEM_FRACTION / 1024**2))
+
+
 def run_snakemake(configfile, no_use_conda=False, verbose=False,
-                  snakefile_name='Snakefile', outdir=None, extra_args=[]):
+                  snakefile_name='Snakefile', outdir=None, extra_args=[],
+                  cores=None, mem_mb=None):
     if configfile:
         if not os.path.exists(configfile) or not os.path.isfile(configfile):
             print(f"Error: config file '{configfile}' does not exist!",
@@ -43,9 +117,18 @@ def run_snakemake(configfile, no_use_conda=False, verbose=False,
     if outdir:
         cmd += ["--config", f"output_dir={outdir}"]
 
-    # snakemake sometimes seems to want a default -j; set it to 1 for now.
-    # can overridden later on command line.
-    cmd += ["-j", "1"]
+    # use all of the available cores & memory by default; rules declare
+    # their threads and mem_mb, so snakemake can pack jobs w/o
+    # overcommitting. can be overridden later on command line.
+    # (--resources takes several values, so it must come before -j.)
+    if mem_mb is None:
+        mem_mb = detect_mem_mb()
+    if mem_mb:
+        cmd += ["--resources", f"mem_mb={mem_mb}"]
+
+    if cores is None:
+        cores = detect_cores()
+    cmd += ["-j", str(cores)]
 
     # add rest of snakemake arguments
     cmd += list(extra_args)
@@ -84,9 +167,14 @@ def cli():
 @click.option('--no-use-conda', is_flag=True, default=False)
 @click.option('--verbose', is_flag=True)
 @click.option('--outdir', nargs=1)
+@click.option('--cores', type=int,
+              help='maximum cores to use (default: all available)')
+@click.option('--mem-mb', type=int,
+              help='maximum memory in MB to use (default: 90% of available)')
 @click.option("-h", "--help", nargs=0)
 @click.argument('snakemake_args', nargs=-1)
-def run(configfile, snakemake_args, no_use_conda, verbose, outdir, help):
+def run(configfile, snakemake_args, no_use_conda, verbose, outdir, cores,
+        mem_mb, help):
     "execute charcoal workflow (using snakemake underneath)"
     targets = [ arg for arg in snakemake_args if not arg.startswith('-') ]
     if help or not targets:
@@ -98,6 +186,9 @@ Usage:
 
    charcoal run <conf file> <target> [ <target 2>... ] [ <snakemake args> ]
 
+By default all available cores and 90% of the available memory are used;
+limit these with --cores and --mem-mb.
+
 Recommended targets:
 
  * stage1 - produce summary of genome taxonomies and potential contamination
@@ -108,6 +199,7 @@ Recommended targets:
 Debug and config targets:
  * check - verify the basic config
  * showconf - show configuration
+ * benchmark_summary - summarize time & memory by rule, from the jobs run so far
 
 Please see https://github.com/dib-lab/charcoal for quickstart docs.
 
@@ -116,14 +208,15 @@ Please post questions at https://github.com/dib-lab/charcoal/issues!
         sys.exit(0)
     run_snakemake(configfile, snakefile_name='Snakefile',
                   no_use_conda=no_use_conda, verbose=verbose,
-                  outdir=outdir, extra_args=snakemake_args)
+                  outdir=outdir, extra_args=snakemake_args,
+                  cores=cores, mem_mb=mem_mb)
 
 # download databases using a special Snakefile
 @click.command()
 def download_db():
     "download the necessary databases"
     run_snakemake(None, snakefile_name='Snakefile.download_db',
-                  no_use_conda=True)
+                  no_use_conda=True, cores=1)
 
 # 'check' command
 @click.command()
@@ -208,12 +301,25 @@ genome_dir: {genome_dir}
 provided_lineages: {lineages}
 """)
 
+# 'perf-report' command
+@click.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--top', type=int, default=10,
+              help='number of phases & genomes to show')
+@click.option('--json', 'json_out', help='save the aggregated metrics as JSON')
+def perf_report(paths, top, json_out):
+    "summarize timing & memory metrics from a run (e.g. its output_dir)"
+    from . import perf_report
+    args = argparse.Namespace(paths=list(paths), top=top, json=json_out)
+    sys.exit(perf_report.main(args))
+
 cli.add_command(run)
 cli.add_command(check)
 cli.add_command(showconf)
 cli.add_command(info)
 cli.add_command(init)
 cli.add_command(download_db)
+cli.add_command(perf_report)
 
 def main():
     cli()
@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+"""
+An offline index of NCBI assemblies, by accession.
+
+genbank_genomes resolves each accession w/three requests to NCBI: the
+FTP directory listing for the genome URL, the assembly report for the
+taxid, and the taxonomy page for the name. All of this is in NCBI's
+'assembly_summary_genbank.txt' & 'assembly_summary_refseq.txt' files
+(from https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/). Here we
+load those once into an SQLite file, and look accessions up in it.
+
+Accessions may be given w/o a version, e.g. 'GCA_001593925'; the latest
+version in the summaries is used.
+"""
+import sys
+import argparse
+import gzip
+import os
+import sqlite3
+import tempfile
+
+from . import metrics
+from .taxonomy_cache import file_stat
+
+
+_SCHEMA = """
+CREATE TABLE accessions (acc TEXT PRIMARY KEY, base TEXT NOT NULL,
+                         version INTEGER NOT NULL, taxid TEXT,
+                         organism_name TEXT, ftp_path TEXT NOT NULL);
+CREATE TABLE _sources (filename TEXT PRIMARY KEY, size INTEGER,
+                       mtime INTEGER, n_rows INTEGER);
+"""
+
+_INDEXES = """
+CREATE INDEX accessions_base ON accessions (base, version);
+"""
+
+# columns we need from the assembly summary.
+SUMMARY_COLUMNS = ('assembly_accession', 'taxid', 'organism_name',
+                   'ftp_path')
+
+
+def split_accession(accession):
+    "Split 'GCA_001593925.1' into ('GCA_001593925', 1); version may be None."
+    accession = accession.strip()
+    base, dot, version = accession.partition('.')
+    if dot and version.isdigit():
+        return base, int(version)
+    return accession, None
+
+
+def _open_text(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf-8')
+    return open(filename, 'rt', encoding='utf-8')
+
+
+def iter_assembly_summary(filename):
+    """
+    Yield (acc, taxid, organism_name, ftp_path) for the assemblies in an
+    NCBI assembly summary file. Assemblies w/o an FTP path are skipped.
+    """
+    idx = None
+    with _open_text(filename) as fp:
+        for line in fp:
+            line = line.rstrip('\r\n')
+            if line.startswith('#'):
+                # the column names are in a comment line.
+                columns = line.lstrip('#').strip().split('\t')
+                if 'assembly_accession' in columns:
+                    missing = set(SUMMARY_COLUMNS) - set(columns)
+                    if missing:
+                        raise ValueError(f"no column(s) {', '.join(sorted(missing))} in '{filename}'")
+                    idx = [ columns.index(name) for name in SUMMARY_COLUMNS ]
+                continue
+            if not line:
+                continue
+            if idx is None:
+                raise ValueError(f"no assembly summary header in '{filename}'")
+
+            fields = line.split('\t')
+            acc, taxid, name, ftp_path = [ fields[i] if i < len(fields) else ''
+                                           for i in idx ]
+            if not ftp_path or ftp_path == 'na':
+                continue
+            yield acc, taxid, name, ftp_path
+
+
+def build_accession_index(summary_files, index_filename):
+    """
+    Load NCBI assembly summary files into an SQLite index, saved to
+    'index_filename'; returns the number of assemblies.
+
+    The index is built in a temporary file and renamed into place, so
+    concurrent readers never see a partial index.
+    """
+    dirname = os.path.dirname(os.path.abspath(index_filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmpname)
+        try:
+            conn.executescript(_SCHEMA)
+            for filename in summary_files:
+                size, mtime = file_stat(filename)
+                before = conn.total_changes
+
+                def rows():
+                    for acc, taxid, name, ftp_path in iter_assembly_summary(filename):
+                        base, version = split_accession(acc)
+                        yield acc, base, version or 0, taxid, name, ftp_path
+
+                conn.executemany('INSERT OR REPLACE INTO accessions VALUES (?, ?, ?, ?, ?, ?)', rows())
+                conn.execute('INSERT OR REPLACE INTO _sources VALUES (?, ?, ?, ?)',
+                             (filename, size, mtime,
+                              conn.total_changes - before))
+            conn.executescript(_INDEXES)
+            conn.commit()
+            n, = conn.execute('SELECT COUNT(*) FROM accessions').fetchone()
+        finally:
+            conn.close()
+
+        os.chmod(tmpname, 0o644)          # mkstemp files are private
+        os.replace(tmpname, index_filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+    return n
+
+
+def genome_urls(ftp_path):
+    "The genome & assembly report URLs for an assembly's FTP path."
+    url = ftp_path.rstrip('/')
+    if url.startswith('ftp://'):
+        url = 'https://' + url[len('ftp://'):]
+    full_name = url.split('/')[-1]
+    return (f"{url}/{full_name}_genomic.fna.gz",
+            f"{url}/{full_name}_assembly_report.txt")
+
+
+class AccessionIndex:
+    """
+    A read-only index of NCBI assemblies in an SQLite file.
+
+    'get' returns the genome info for an accession, as a dictionary
+    like the rows of the genbank_genomes info CSV, plus 'taxid'.
+    """
+    def __init__(self, filename):
+        if not os.path.exists(filename):
+            raise ValueError(f"no accession index '{filename}'")
+        self.filename = filename
+        self.conn = sqlite3.connect(f'file:{filename}?mode=ro', uri=True)
+        try:
+            self.conn.execute('SELECT acc FROM accessions LIMIT 1')
+        except sqlite3.DatabaseError:
+            self.conn.close()
+            raise ValueError(f"'{filename}' is not a charcoal accession index")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        n, = self.conn.execute('SELECT COUNT(*) FROM accessions').fetchone()
+        return n
+
+    def get(self, accession):
+        "Return the info for 'accession', or None if it's not indexed."
+        base, version = split_accession(accession)
+        if version is not None:
+            c = self.conn.execute('SELECT acc, taxid, organism_name, ftp_path FROM accessions WHERE acc=?', (accession.strip(),))
+        else:
+            c = self.conn.execute('SELECT acc, taxid, organism_name, ftp_path FROM accessions WHERE base=? ORDER BY version DESC LIMIT 1', (base,))
+        row = c.fetchone()
+        if row is None:
+            return None
+
+        acc, taxid, name, ftp_path = row
+        genome_url, assembly_report_url = genome_urls(ftp_path)
+        return dict(acc=acc, genome_url=genome_url,
+                    assembly_report_url=assembly_report_url,
+                    ncbi_tax_name=name, taxid=taxid)
+
+    def __contains__(self, accession):
+        return self.get(accession) is not None
+
+
+@metrics.record('accession_index', output='output')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('index_summaries'):
+        n = build_accession_index(args.summary_files, args.output)
+        metrics.count('assemblies', n)
+    print(f"indexed {n} assemblies from {len(args.summary_files)} summary files into '{args.output}'.")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('summary_files', nargs='+',
+                   help="NCBI assembly summary files, e.g. 'assembly_summary_genbank.txt'; may be gzipped")
+    p.add_argument('-o', '--output', required=True,
+                   help='accession index (SQLite) to create')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -21,6 +21,8 @@ from matplotlib.collections import PatchCollection
 import screed
 from interval import interval
 
+from .genome_cache import find_genome
+
 
 global_debug = False
 
@@ -106,6 +108,14 @@ def load_contig_sizes(genomefile, init_d=None):
     return all_sizes
 
 
+def load_target_pairs(accs, genome_dir="genbank_genomes", genome_cache=None):
+    """
+    Find the genome files for target accessions, in 'genome_dir' or the
+    shared genome cache; returns a list of (acc, filename).
+    """
+    return [ (acc, find_genome(acc, genome_dir, genome_cache)) for acc in accs ]
+
+
 class AlignmentContainer:
     """
     Build or load, then store a set of alignments between a
@@ -177,6 +187,34 @@ class AlignmentContainer:
 
         self.results = results
 
+    def load_mashmap(self, prefix, combined=False, contigs_to_acc=None):
+        """
+        Load saved mashmap results for all the targets: from the pairwise
+        '{prefix}.x.{acc}.mashmap.align' files, or, if 'combined', from
+        one '{prefix}.mashmap.align' of the query against all targets,
+        split up by target contig.
+        """
+        if not combined:
+            results = {}
+            for t_acc in self.t_acc_list:
+                filename = f"{prefix}.x.{t_acc}.mashmap.align"
+                results[t_acc] = self._read_mashmap(filename)
+            self.results = results
+            return
+
+        if contigs_to_acc is None:
+            contigs_to_acc = {}
+            for t_acc, targetfile in zip(self.t_acc_list, self.targetfiles):
+                for name in load_contig_sizes(targetfile):
+                    contigs_to_acc[name] = t_acc
+
+        results = { t_acc: [] for t_acc in self.t_acc_list }
+        for region in self._read_mashmap(f"{prefix}.mashmap.align"):
+            t_acc = contigs_to_acc.get(region.target)
+            if t_acc in results:          # ignore other targets
+                results[t_acc].append(region)
+        self.results = results
+
     def run_nucmer(self):
         "Run all the things, save the results."
         results = {}
@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+"""
+Benchmark gather_matches against gather_matches_by_best_containment.
+
+For each genome, build an LCA database from all of the (non-identical)
+signatures in the databases, then gather the entire genome and each
+contig with both implementations, checking that the results are the same.
+"""
+import sys
+import argparse
+import os.path
+import time
+
+import screed
+
+import sourmash
+
+from . import utils
+from . import metrics
+from .version import version
+from .taxonomy_cache import load_taxonomy
+from .taxonomy_index import build_taxonomy_index
+
+
+def time_gather(gather_fn, mhs, lca_db, lin_db):
+    "Gather each of 'mhs'; return (elapsed seconds, results)."
+    start = time.perf_counter()
+    results = [ list(gather_fn(mh, lca_db, lin_db)) for mh in mhs ]
+    return time.perf_counter() - start, results
+
+
+def bench_genome(genome, databases, tax_assign, taxonomy, template_mh):
+    "Benchmark both gather implementations on one genome."
+    # sketch the entire genome, & each contig.
+    entire_mh = template_mh.copy_and_clear()
+    contig_mhs = []
+    for record in screed.open(genome):
+        mh = template_mh.copy_and_clear()
+        mh.add_sequence(record.sequence, force=True)
+        contig_mhs.append(mh)
+        entire_mh += mh
+
+    prepared = utils.load_matches_into_lca_database(databases, None,
+                                                    entire_mh, tax_assign,
+                                                    taxonomy)
+    if prepared.lca_db is None:
+        return None
+
+    mhs = [entire_mh] + contig_mhs
+    old_time, old_results = time_gather(utils.gather_matches_by_best_containment,
+                                        mhs, prepared.lca_db, prepared.lin_db)
+    new_time, new_results = time_gather(utils.gather_matches,
+                                        mhs, prepared.lca_db, prepared.lin_db)
+
+    assert old_results == new_results, genome
+    n_matches = sum([ len(x) for x in new_results ])
+
+    return len(contig_mhs), n_matches, old_time, new_time
+
+
+@metrics.record('bench_gather')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('load_taxonomy'):
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        taxonomy = build_taxonomy_index(tax_assign)
+    print(f'loaded {len(tax_assign)} tax assignments.')
+
+    with metrics.phase('load_databases'):
+        databases = utils.load_databases(args.databases)
+
+    # use the first signature as a template for sketching genomes.
+    template_mh = None
+    for ss in utils.iter_matching_signatures(databases, None):
+        template_mh = ss.minhash.copy_and_clear()
+        break
+    assert template_mh is not None, "no signatures in databases?!"
+
+    rows = []
+    for genome in args.genomes:
+        print(f'\nbenchmarking {genome}')
+        with metrics.genome(os.path.basename(genome)):
+            x = bench_genome(genome, databases, tax_assign, taxonomy,
+                             template_mh)
+        if x is None:
+            print('no non-identical matches for this genome; skipping.')
+            continue
+        rows.append((os.path.basename(genome),) + x)
+
+    print('')
+    print(f"{'genome':<45} {'contigs':>7} {'matches':>7} {'before':>8} {'after':>8} {'speedup':>7}")
+    total_old = total_new = 0.0
+    for (name, n_contigs, n_matches, old_time, new_time) in rows:
+        print(f'{name:<45} {n_contigs:>7} {n_matches:>7} {old_time:>7.3f}s {new_time:>7.3f}s {old_time / new_time:>6.1f}x')
+        total_old += old_time
+        total_new += new_time
+
+    if rows:
+        print(f"{'total':<61} {total_old:>7.3f}s {total_new:>7.3f}s {total_old / total_new:>6.1f}x")
+    print('\nall gather results identical.')
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('genomes', nargs='+', help='genome files')
+    p.add_argument('--databases', help='sourmash databases', required=True,
+                   nargs='+')
+    p.add_argument('--lineages-csv', help='lineage spreadsheet', required=True)
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+"""
+Summarize the snakemake benchmark files from a charcoal run, by rule.
+
+Every rule in the Snakefile saves a snakemake benchmark TSV under
+'{output_dir}/benchmarks/', as '{rule}.tsv' or '{rule}/{wildcards}.tsv'.
+These cover the external programs (sourmash prefetch, mashmap,
+papermill...) that the in-process metrics can't; see perf_report for
+those.
+
+Reports jobs, total/mean/max seconds, CPU seconds and max RSS for each
+rule, slowest first, and optionally saves the table as CSV.
+"""
+import sys
+import argparse
+import csv
+import os
+
+
+BENCHMARK_SUFFIX = '.tsv'
+
+SUMMARY_FIELDS = ['rule', 'jobs', 'total_s', 'mean_s', 'max_s', 'cpu_s',
+                  'max_rss_mb', 'slowest']
+
+
+def _float(value):
+    "Parse a benchmark value; snakemake writes '-' for 'not measured'."
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def find_benchmark_files(benchmark_dir):
+    "Yield (rule, job, filename) for the benchmark files in a directory."
+    for dirpath, dirnames, files in os.walk(benchmark_dir):
+        dirnames.sort()
+        for name in sorted(files):
+            if not name.endswith(BENCHMARK_SUFFIX):
+                continue
+            job = name[:-len(BENCHMARK_SUFFIX)]
+            relpath = os.path.relpath(dirpath, benchmark_dir)
+            if relpath == '.':
+                rule = job
+            else:
+                rule = relpath.split(os.sep)[0]
+            yield rule, job, os.path.join(dirpath, name)
+
+
+def load_benchmark(filename):
+    """
+    Load a benchmark file; returns a list of (seconds, cpu_s, max_rss_mb),
+    one for each repeat.
+    """
+    records = []
+    with open(filename, 'rt', newline='') as fp:
+        for row in csv.DictReader(fp, delimiter='\t'):
+            seconds = _float(row.get('s'))
+            if seconds is None:
+                continue
+            records.append((seconds, _float(row.get('cpu_time')),
+                            _float(row.get('max_rss'))))
+    return records
+
+
+def summarize(benchmark_dir):
+    "Summarize the benchmarks in 'benchmark_dir' by rule; slowest first."
+    rules = {}
+    for rule, job, filename in find_benchmark_files(benchmark_dir):
+        try:
+            records = load_benchmark(filename)
+        except (OSError, csv.Error) as exc:
+            print(f"skipping '{filename}': {exc}", file=sys.stderr)
+            continue
+
+        r = rules.setdefault(rule, dict(rule=rule, jobs=0, total_s=0.0,
+                                        max_s=0.0, cpu_s=0.0, max_rss_mb=None,
+                                        slowest=''))
+        for seconds, cpu_s, max_rss in records:
+            r['jobs'] += 1
+            r['total_s'] += seconds
+            r['cpu_s'] += cpu_s or 0
+            if seconds >= r['max_s']:
+                r['max_s'] = seconds
+                r['slowest'] = job
+            if max_rss is not None:
+                r['max_rss_mb'] = max(r['max_rss_mb'] or 0, max_rss)
+
+    summary = []
+    for r in rules.values():
+        if not r['jobs']:
+            continue
+        r['mean_s'] = r['total_s'] / r['jobs']
+        summary.append(r)
+
+    summary.sort(key=lambda r: -r['total_s'])
+    return summary
+
+
+def format_summary(summary):
+    "Format the summary as a text table; returns a list of lines."
+    total = sum( r['total_s'] for r in summary )
+
+    lines = [f"{'rule':<40} {'jobs':>5} {'total s':>9} {'':>6} {'mean s':>8} {'max s':>8} {'cpu s':>9} {'max MB':>7}  slowest job"]
+    for r in summary:
+        pct = f"{100 * r['total_s'] / total:5.1f}%" if total else '    -'
+        rss = '-' if r['max_rss_mb'] is None else f"{r['max_rss_mb']:.0f}"
+        lines.append(f"{r['rule']:<40} {r['jobs']:>5} {r['total_s']:>9.2f} {pct} {r['mean_s']:>8.2f} {r['max_s']:>8.2f} {r['cpu_s']:>9.2f} {rss:>7}  {r['slowest']}")
+    lines.append(f"{'total':<40} {sum( r['jobs'] for r in summary ):>5} {total:>9.2f}")
+
+    return lines
+
+
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    if not os.path.isdir(args.benchmark_dir):
+        print(f"no benchmarks directory '{args.benchmark_dir}'",
+              file=sys.stderr)
+        return -1
+
+    summary = summarize(args.benchmark_dir)
+    print('\n'.join(format_summary(summary)))
+
+    if args.output:
+        with open(args.output, 'wt', newline='') as fp:
+            w = csv.DictWriter(fp, SUMMARY_FIELDS)
+            w.writeheader()
+            for r in summary:
+                row = dict(r)
+                for k in ('total_s', 'mean_s', 'max_s', 'cpu_s'):
+                    row[k] = f'{row[k]:.2f}'
+                w.writerow(row)
+        print(f"\nsaved summary of {len(summary)} rules to '{args.output}'")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('benchmark_dir', help='directory of snakemake benchmarks')
+    p.add_argument('-o', '--output', help='save the summary as CSV')
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,70 @@
+"""
+Helpers shared by charcoal's binary file formats.
+
+The taxonomy cache, contigs taxonomy, contig sketches, and CSV index
+files all have the same shape: a fixed header, then sections of
+little-endian arrays and UTF-8 string data, each padded to 8 bytes.
+Strings are stored as a table of (n + 1) uint64 offsets and their
+concatenated data.
+"""
+import os
+import struct
+import tempfile
+
+
+def pad(n):
+    "Round 'n' up to a multiple of 8."
+    return (n + 7) & ~7
+
+
+def strings_table(strings):
+    "Encode strings as (uint64 offsets, data)."
+    offsets = [0]
+    data = []
+    total = 0
+    for s in strings:
+        b = s.encode('utf-8')
+        data.append(b)
+        total += len(b)
+        offsets.append(total)
+
+    return struct.pack(f'<{len(offsets)}Q', *offsets), b''.join(data)
+
+
+def write_sections(filename, header, sections):
+    """
+    Write 'header' and 'sections' (bytes) to 'filename', each padded
+    to 8 bytes.
+
+    The file is written to a temporary file and renamed into place, so
+    concurrent readers never see a partial file.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for section in [header] + list(sections):
+                fp.write(section)
+                fp.write(b'\0' * (pad(len(section)) - len(section)))
+        os.chmod(tmpname, 0o644)          # mkstemp files are private
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+class SortedStrings:
+    """
+    Sequence view of a strings table of sorted, encoded strings, for
+    bisect. Items are bytes.
+    """
+    def __init__(self, buf, offsets, n):
+        self.buf = buf
+        self.offsets = offsets
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return bytes(self.buf[self.offsets[i]:self.offsets[i + 1]])
@@ -3,7 +3,6 @@ Clean a genome based on hit list & contigs taxonomy.
 """
 import sys
 import argparse
-import gzip
 import os.path
 
 import screed
@@ -11,9 +10,14 @@ import screed
 import sourmash
 
 from . import utils
+from . import metrics
 from .version import version
+from .contigs_tax import find_contigs_tax
+from .fasta_writer import FastaWriter
+from .fasta_index import RawFasta, OFFSETS_SUFFIX
+from .results_db import load_hit_list
 from .utils import (summarize_at_rank, load_contigs_gather_json,
-                    is_contig_contaminated, CSV_DictHelper, make_lineage)
+                    is_contig_contaminated, make_lineage)
 
 
 def yield_names_in_records(d):
@@ -22,12 +26,36 @@ def yield_names_in_records(d):
         yield r
 
 
-def main(args):
-    "Main entry point for scripting. Use cmdline for command line entry."
+def open_records(genome, raw_copy, offsets=None):
+    """
+    Open the contigs in a genome: either as raw records, which are copied
+    to the output w/o parsing, or as screed records. Returns (records,
+    raw_fasta); 'raw_fasta' is None for screed records. Raw record
+    offsets are saved to 'offsets', if given.
+    """
+    if raw_copy:
+        raw_fasta = RawFasta(genome, offsets)
+        return raw_fasta, raw_fasta
+    return screed.open(genome), None
+
+
+def record_length(record, raw_fasta):
+    if raw_fasta is not None:
+        return record.length
+    return len(record.sequence)
 
-    genome_name = os.path.basename(args.genome)
 
-    hit_list = CSV_DictHelper(args.hit_list, 'genome')
+def write_record(fp, record, raw_fasta):
+    if raw_fasta is not None:
+        raw_fasta.copy_record(record, fp)
+    else:
+        fp.write_record(record.name, record.sequence)
+
+
+def clean_genome(genome, hit_list, contigs_json, clean, dirty, do_nothing,
+                 threads=1, level=None, raw_copy=False, offsets=None):
+    "Clean one genome, using a loaded hit list."
+    genome_name = os.path.basename(genome)
 
     try:
         row = hit_list[genome_name]
@@ -35,7 +63,7 @@ def main(args):
         override_filter_at = row['override_filter_at']
         lineage = row['lineage']
     except KeyError:
-        print(f'genome {genome_name} not found in hit list spreadsheet {args.hit_list}; exiting')
+        print(f'genome {genome_name} not found in hit list spreadsheet {hit_list.filename}; exiting')
         return -1
 
     filter_rank = filter_at
@@ -51,33 +79,34 @@ def main(args):
     lineage = make_lineage(lineage)
 
     # load contigs JSON file
-    contigs_d = load_contigs_gather_json(args.contigs_json)
+    with metrics.phase('load_contigs_tax'):
+        contigs_d = load_contigs_gather_json(contigs_json)
     print(f'loaded {len(contigs_d)} contig assignments.')
+    metrics.count('contigs', len(contigs_d))
 
-    # open gzip/whatever files as needed for output
-    xopen = open
-    if args.clean.endswith('.gz'):
-        xopen = gzip.open
-    clean_fp = xopen(args.clean, 'wt')
-
-    xopen = open
-    if args.clean.endswith('.gz'):
-        xopen = gzip.open
-    dirty_fp = xopen(args.dirty, 'wt')
+    # open BGZF/zstd/whatever files as needed for output
+    clean_fp = FastaWriter(clean, threads, level)
+    dirty_fp = FastaWriter(dirty, threads, level)
 
     if filter_rank == 'none':
         dirty_fp.close()
 
         print(f'filter rank is {filter_rank}; not doing any cleaning.')
         total_bp = 0
-        if not args.do_nothing:
-            for record in screed.open(args.genome):
-                clean_fp.write(f'>{record.name}\n{record.sequence}\n')
-                total_bp += len(record.sequence)
-        else:
-            total_bp = sum([ x[0] for x in contigs_d.values() ])
-
-        print(f'wrote {total_bp} clean bp to {args.clean}')
+        with metrics.phase('write_contigs'):
+            if not do_nothing:
+                records, raw_fasta = open_records(genome, raw_copy, offsets)
+                for record in records:
+                    write_record(clean_fp, record, raw_fasta)
+                    total_bp += record_length(record, raw_fasta)
+                if raw_fasta is not None:
+                    raw_fasta.close()
+            else:
+                total_bp = sum([ x[0] for x in contigs_d.values() ])
+            clean_fp.close()
+            metrics.count('bp', total_bp)
+
+        print(f'wrote {total_bp} clean bp to {clean}')
         return 0
 
     print(f'filtering {genome_name} contigs at {filter_rank}')
@@ -86,46 +115,130 @@ def main(args):
     bp_dirty = 0
     bp_clean = 0
 
-    if not args.do_nothing:
-        screed_iter = screed.open(args.genome)
-    if args.do_nothing:
-        screed_iter = yield_names_in_records(contigs_d)
-
-    for record in screed_iter:
-        # note: if record.name is not in the contigs dictionary, that
-        # means that the code that output the hitlist did something
-        # wrong!
-        gather_info = contigs_d[record.name]
-
-        if is_contig_contaminated(lineage, gather_info.gather_tax,
-                                  filter_rank, 3): # @CTB configurable?!
-            if not args.do_nothing:
-                assert len(record.sequence) == gather_info.length
-                dirty_fp.write(f'>{record.name}\n{record.sequence}\n')
-            bp_dirty += gather_info.length
-        else:
-            if not args.do_nothing:
-                assert len(record.sequence) == gather_info.length
-                clean_fp.write(f'>{record.name}\n{record.sequence}\n')
-            bp_clean += gather_info.length
-
-    print(f'wrote {bp_clean} clean bp to {args.clean}')
-    print(f'wrote {bp_dirty} dirty bp to {args.dirty}')
+    raw_fasta = None
+    if not do_nothing:
+        records, raw_fasta = open_records(genome, raw_copy, offsets)
+    if do_nothing:
+        records = yield_names_in_records(contigs_d)
+
+    with metrics.phase('write_contigs'):
+        for record in records:
+            # note: if record.name is not in the contigs dictionary, that
+            # means that the code that output the hitlist did something
+            # wrong!
+            gather_info = contigs_d[record.name]
+
+            if is_contig_contaminated(lineage, gather_info.gather_tax,
+                                      filter_rank, 3): # @CTB configurable?!
+                if not do_nothing:
+                    assert record_length(record, raw_fasta) == gather_info.length
+                    write_record(dirty_fp, record, raw_fasta)
+                bp_dirty += gather_info.length
+            else:
+                if not do_nothing:
+                    assert record_length(record, raw_fasta) == gather_info.length
+                    write_record(clean_fp, record, raw_fasta)
+                bp_clean += gather_info.length
+
+        clean_fp.close()
+        dirty_fp.close()
+        if raw_fasta is not None:
+            raw_fasta.close()
+        metrics.count('bp', bp_clean + bp_dirty)
+        metrics.count('dirty_bp', bp_dirty)
+
+    print(f'wrote {bp_clean} clean bp to {clean}')
+    print(f'wrote {bp_dirty} dirty bp to {dirty}')
 
     return 0
 
 
+def _metrics_output(args):
+    "Name the metrics for a genome, or for a batch of genomes."
+    if not getattr(args, 'genome_list', None):
+        return args.clean
+    return os.path.join(args.output_directory, 'clean_genome')
+
+
+@metrics.record('clean_genome', output=_metrics_output)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('load_hit_list'):
+        hit_list = load_hit_list(args.hit_list,
+                                 getattr(args, 'results_db', None))
+    with hit_list:
+        threads = getattr(args, 'threads', 1)
+        level = getattr(args, 'compress_level', None)
+        raw_copy = getattr(args, 'raw_copy', False)
+
+        # batch mode: clean many genomes, with the hit list loaded once.
+        genome_list = getattr(args, 'genome_list', None)
+        if genome_list:
+            genome_names = utils.load_genome_list(genome_list)
+            print(f"loaded {len(genome_names)} genomes from '{genome_list}'")
+
+            output_dir = args.output_directory
+            for genome_name in genome_names:
+                print(f'\nworking on {genome_name}')
+                prefix = os.path.join(output_dir, genome_name)
+                contigs_json = find_contigs_tax(args.input_directory,
+                                                genome_name)
+                offsets = prefix + OFFSETS_SUFFIX
+                with metrics.genome(genome_name):
+                    status = clean_genome(os.path.join(args.genome_dir, genome_name),
+                                          hit_list, contigs_json,
+                                          prefix + '.clean.fa.gz',
+                                          prefix + '.dirty.fa.gz', args.do_nothing,
+                                          threads, level, raw_copy, offsets)
+                if status != 0:
+                    return status
+
+            return 0
+
+        with metrics.genome(os.path.basename(args.genome)):
+            return clean_genome(args.genome, hit_list, args.contigs_json,
+                                args.clean, args.dirty, args.do_nothing, threads,
+                                level, raw_copy, getattr(args, 'offsets', None))
+
+
 def cmdline(sys_args):
     "Command line entry point w/argparse action."
     p = argparse.ArgumentParser(sys_args)
-    p.add_argument('--genome', help='genome file', required=True)
+    p.add_argument('--genome', help='genome file')
     p.add_argument('--hit-list', help='hit list spreadsheet', required=True)
-    p.add_argument('--contigs-json', help='JSON-format contigs classification output by contigs_search', required=True)
-    p.add_argument('--clean', help='cleaned contigs', required=True)
-    p.add_argument('--dirty', help='dirty contigs', required=True)
+    p.add_argument('--results-db',
+                   help='look up the hit list in this results store instead')
+    p.add_argument('--contigs-json', help='contigs classification output by contigs_search (JSON or binary)')
+    p.add_argument('--clean', help='cleaned contigs')
+    p.add_argument('--dirty', help='dirty contigs')
     p.add_argument('-n', '--do-nothing', help='do not read or write FASTA')
+    p.add_argument('--threads', type=int, default=1,
+                   help='number of threads to use for compressing output')
+    p.add_argument('--compress-level', type=int,
+                   help='compression level (default: 6 for .gz, 3 for .zst)')
+    p.add_argument('--raw-copy', action='store_true',
+                   help='copy contigs to the output as-is, w/o parsing them')
+    p.add_argument('--offsets',
+                   help='save & reuse the record offsets for --raw-copy here')
+
+    # batch mode
+    p.add_argument('--genome-list',
+                   help='file of genome names to clean, in batch mode')
+    p.add_argument('--genome-dir', help='directory containing genomes')
+    p.add_argument('--input-directory',
+                   help='directory containing {genome}.contigs-tax.bin or .json')
+    p.add_argument('--output-directory',
+                   help='directory for {genome}.clean.fa.gz and {genome}.dirty.fa.gz')
+    metrics.add_argument(p)
     args = p.parse_args()
 
+    if args.genome_list:
+        if not (args.genome_dir and args.input_directory and \
+                args.output_directory):
+            p.error('--genome-list requires --genome-dir, --input-directory, and --output-directory')
+    elif not (args.genome and args.contigs_json and args.clean and args.dirty):
+        p.error('--genome, --contigs-json, --clean and --dirty are required')
+
     return main(args)
 
 
@@ -1,61 +1,175 @@
 #! /usr/bin/env python
 """
 Combine CSVs and sort by given field.
+
+The CSVs can be given on the command line, or listed (one per line) in
+a file with --file-list, which may be '-' for stdin; this avoids argv
+limits with many thousands of files.
+
+Rows are sorted in runs of at most --max-rows, which are saved to
+temporary files as needed and then merged, so memory use is bounded no
+matter how many rows there are. The output is the same as for a single
+in-memory sort: the sort is stable, and numeric fields sort numerically.
 """
 import sys
 import argparse
 import csv
+import heapq
+import os
+import tempfile
 
+from . import metrics
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument('--sort-by', default=None)
-    p.add_argument('--reverse', action='store_true')
-    p.add_argument('csvs', nargs='+')
-    args = p.parse_args()
 
-    first_csv = args.csvs[0]
-    csvs = args.csvs[1:]
+# rows to sort in memory at once.
+DEFAULT_MAX_ROWS = 100000
 
-    rows = []
-    with open(first_csv, 'rt') as fp:
-        r = csv.DictReader(fp)
-        rows.extend(list(r))
-        fieldnames = r.fieldnames
 
-    if args.sort_by:
-        sort_by = args.sort_by
+def load_file_list(filename):
+    "Load a list of filenames, one per line, from a file or '-' (stdin)."
+    if filename == '-':
+        lines = sys.stdin.readlines()
     else:
-        sort_by = fieldnames[0]
+        with open(filename, 'rt') as fp:
+            lines = fp.readlines()
+
+    return [ line.strip() for line in lines if line.strip() ]
 
+
+def make_key_fn(sort_by, first_row):
+    "Sort numerically if the value in the first row is a number."
     try:
-        float(rows[0][sort_by])
-        key_fn = lambda x: float(x[sort_by])
+        float(first_row[sort_by])
+        return lambda x: float(x[sort_by])
     except ValueError:
-        key_fn = lambda x: x[sort_by]
+        return lambda x: x[sort_by]
+
 
+def iter_rows(csvs):
+    """
+    Yield the fieldnames, and then every row in the CSVs. Exits with an
+    error if the CSVs don't all have the same fieldnames.
+    """
+    first_csv = csvs[0]
+    fieldnames = None
     for csvfile in csvs:
         with open(csvfile, 'rt') as fp:
             r = csv.DictReader(fp)
-            if r.fieldnames != fieldnames:
+            if fieldnames is None:
+                fieldnames = r.fieldnames
+                yield fieldnames
+            elif r.fieldnames != fieldnames:
                 diff = set(r.fieldnames) ^ set(fieldnames)
                 print(f"error! disjoint fieldnames b/t {first_csv} and {csvfile}: {str(diff)}", file=sys.stderr)
                 sys.exit(-1)
 
-            new_rows = list(r)
-            rows.extend(new_rows)
+            yield from r
+
+
+def save_run(rows, fieldnames, dirname):
+    "Save a sorted run of rows to a temporary CSV file."
+    fd, filename = tempfile.mkstemp(dir=dirname, suffix='.csv')
+    with os.fdopen(fd, 'wt', newline='') as fp:
+        w = csv.DictWriter(fp, fieldnames)
+        w.writeheader()
+        w.writerows(rows)
+    return filename
+
 
-    print(f'loaded {len(rows)} total. now sorting!', file=sys.stderr)
+def iter_run(filename):
+    "Yield the rows in a saved run."
+    with open(filename, 'rt', newline='') as fp:
+        yield from csv.DictReader(fp)
 
-    rows.sort(key=key_fn, reverse=args.reverse)
 
-    o = csv.DictWriter(sys.stdout, fieldnames)
-    o.writeheader()
+def sort_rows(rows, fieldnames, sort_by, reverse, max_rows, tmpdir):
+    """
+    Sort rows, in memory or by merging sorted runs saved in 'tmpdir';
+    yields the sorted rows.
+    """
+    key_fn = None
+    runs = []
+    buf = []
+    n_rows = 0
     for row in rows:
-        o.writerow(row)
+        if key_fn is None:
+            key_fn = make_key_fn(sort_by, row)
+
+        buf.append(row)
+        n_rows += 1
+        if len(buf) >= max_rows:
+            buf.sort(key=key_fn, reverse=reverse)
+            runs.append(save_run(buf, fieldnames, tmpdir))
+            buf = []
+
+    print(f'loaded {n_rows} total. now sorting!', file=sys.stderr)
+    metrics.count('rows', n_rows)
+
+    buf.sort(key=key_fn, reverse=reverse)
+    if not runs:
+        yield from buf
+        return
+
+    print(f'merging {len(runs) + 1} sorted runs.', file=sys.stderr)
+
+    # runs are in input order, and heapq.merge is stable, so ties come
+    # out in input order, just as with a single sort.
+    iters = [ iter_run(filename) for filename in runs ] + [ iter(buf) ]
+    yield from heapq.merge(*iters, key=key_fn, reverse=reverse)
+
+
+@metrics.record('combine_csvs')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    csvs = list(args.csvs)
+    if args.file_list:
+        csvs += load_file_list(args.file_list)
+    if not csvs:
+        print('error! no CSV files given.', file=sys.stderr)
+        return -1
+
+    rows = iter_rows(csvs)
+    fieldnames = next(rows)
+
+    if args.sort_by:
+        sort_by = args.sort_by
+    else:
+        sort_by = fieldnames[0]
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir, \
+         metrics.phase('sort'):
+        sorted_rows = sort_rows(rows, fieldnames, sort_by, args.reverse,
+                                args.max_rows, tmpdir)
+
+        o = csv.DictWriter(sys.stdout, fieldnames)
+        o.writeheader()
+        for row in sorted_rows:
+            o.writerow(row)
 
     return 0
 
 
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('--sort-by', default=None)
+    p.add_argument('--reverse', action='store_true')
+    p.add_argument('--file-list',
+                   help="file containing CSV filenames, one per line; '-' for stdin")
+    p.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS,
+                   help='maximum number of rows to sort in memory')
+    p.add_argument('--tmpdir', help='directory for temporary sorted runs')
+    p.add_argument('csvs', nargs='*')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    if args.max_rows < 1:
+        p.error('--max-rows must be at least 1')
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
 if __name__ == '__main__':
-    sys.exit(main())
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
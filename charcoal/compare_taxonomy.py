@@ -10,14 +10,18 @@ from collections import Counter
 import json
 
 import sourmash
-from sourmash.lca.command_index import load_taxonomy_assignments
-from sourmash.lca import LCA_Database, LineagePair
+from sourmash.lca import LineagePair
 
 from . import utils
-from .lineage_db import LineageDB
-from .utils import (gather_at_rank, get_ident, summarize_at_rank,
+from . import metrics
+from .taxonomy_cache import load_taxonomy
+from .contigs_tax import find_contigs_tax
+from .prepared_matches import load_prepared_matches, prepared_matches_for_args
+from .taxonomy_index import build_taxonomy_index
+from .utils import (gather_at_rank, summarize_at_rank,
                     pretty_print_lineage, load_contigs_gather_json,
-                    is_contig_contaminated, is_contig_clean)
+                    is_contig_contaminated, is_contig_clean,
+                    contaminated_ranks_mask)
 
 
 GATHER_MIN_MATCHES=3
@@ -29,7 +33,15 @@ def kb(bp):
     return int(bp/1000)
 
 
-def calculate_contam(genome_lin, contigs_d, rank, filter_names=None):
+def contig_lineage_ids(taxonomy, contigs_d):
+    "Convert each contig's gather results to [(lid, count), ...]."
+    return { name: utils.lineage_ids_for_taxlist(taxonomy,
+                                                 gather_info.gather_tax)
+             for name, gather_info in contigs_d.items() }
+
+
+def calculate_contam(genome_lin, contigs_d, rank, filter_names=None,
+                     taxonomy=None):
     "Calculate not-bad bp at each rank. Be conservative."
     good_names = dict()
     bad_names = dict()
@@ -39,7 +51,8 @@ def calculate_contam(genome_lin, contigs_d, rank, filter_names=None):
         if filter_names and contig_name in filter_names:
             continue
 
-        if is_contig_contaminated(genome_lin, contig_taxlist, rank, GATHER_MIN_MATCHES):
+        if is_contig_contaminated(genome_lin, contig_taxlist, rank,
+                                  GATHER_MIN_MATCHES, taxonomy):
             bad_names[contig_name] = gather_info
         else:
             good_names[contig_name] = gather_info
@@ -47,7 +60,7 @@ def calculate_contam(genome_lin, contigs_d, rank, filter_names=None):
     return (good_names, bad_names)
 
 
-def calculate_clean(genome_lin, contigs_d, rank):
+def calculate_clean(genome_lin, contigs_d, rank, taxonomy=None):
     "Calculate definitely-clean bp, as opposed to not-bad bp."
     good_names = dict()
     bad_names = dict()
@@ -55,7 +68,8 @@ def calculate_clean(genome_lin, contigs_d, rank):
     for contig_name, gather_info in contigs_d.items():
         contig_taxlist = gather_info.gather_tax
 
-        if not is_contig_contaminated(genome_lin, contig_taxlist, rank, GATHER_MIN_MATCHES):
+        if not is_contig_contaminated(genome_lin, contig_taxlist, rank,
+                                      GATHER_MIN_MATCHES, taxonomy):
             good_names[contig_name] = gather_info
         else:
             bad_names[contig_name] = gather_info
@@ -120,92 +134,26 @@ def choose_genome_lineage(guessed_genome_lineage, provided_lineage, match_rank,
     return genome_lineage, comment, needs_lineage
 
 
-def get_genome_taxonomy(matches_filename, database_list,
-                        genome_sig_filename, provided_lineage,
-                        tax_assign, match_rank, min_f_ident, min_f_major):
-    # load the matches from prefetch as a picklist
-    picklist = sourmash.picklist.SignaturePicklist('prefetch')
-    try:
-        picklist.load(matches_filename, picklist.column_name)
-    except ValueError:
-        with open(matches_filename, 'rt') as fp:
-            contents = fp.read()
-            if not len(contents): # empty is ok.
-                picklist = None
-            else:
-                raise
-
-    # load all of the matches in the database, as found by prefetch;
-    # select on them; and then aggregate into MultiIndex.
-    # CTB note: currently, this loads all the signatures into memory.
-    # Alternatively we could do something with LazyLoadedIndex maybe?
-
-    siglist = []
-    for filename in database_list:
-        db = sourmash.load_file_as_index(filename)
-        db = db.select(picklist=picklist)
-        siglist += list(db.signatures())
-
-    if not siglist:
-        comment = 'no matches for this genome.'
-        print(comment)
-        return None, comment, False, 0.0, 0.0
-
-    # construct a template minhash object that we can use to create new 'uns
-    empty_mh = siglist[0].minhash.copy_and_clear()
-    ksize = empty_mh.ksize
-    scaled = empty_mh.scaled
-    moltype = empty_mh.moltype
-
-    genome_sig = sourmash.load_one_signature(genome_sig_filename)
-    entire_mh = genome_sig.minhash
+def check_exact_matches(exact_siglist, provided_lineage):
+    """
+    Exact matches can only be removed if there's a provided lineage.
 
-    assert entire_mh.scaled == scaled
-
-    # Hack for examining members of our search database: remove exact matches.
-    new_siglist = []
-    for ss in siglist:
-        if entire_mh.similarity(ss.minhash) < 1.0:
-            new_siglist.append(ss)
+    Returns a comment if the genome cannot be analyzed, else "".
+    """
+    for ss in exact_siglist:
+        if provided_lineage and provided_lineage != 'NA':
+            print(f'found exact match: {ss.name}. removing.')
         else:
-            if provided_lineage and provided_lineage != 'NA':
-                print(f'found exact match: {ss.name}. removing.')
-            else:
-                print(f'found exact match: {ss.name}. but no provided lineage!')
-                comment = f'found exact match: {ss.name}. but no provided lineage! cannot analyze.'
-                return None, comment, True, 1.0, 1.0
+            print(f'found exact match: {ss.name}. but no provided lineage!')
+            comment = f'found exact match: {ss.name}. but no provided lineage! cannot analyze.'
+            return comment
 
-    # ...but leave exact matches in if they're the only matches, I guess!
-    if new_siglist:
-        siglist = new_siglist
-
-    # remove duplicate signatures in matches
-    # workaround for issue of duplicate sigs in SBT, see sourmash/#1171
-    new_siglist = []
-    seen_md5 = set()
-    for ss in siglist:
-        ss_md5 = ss.md5sum()
-        if not ss_md5 in seen_md5:
-            new_siglist.append(ss)
-            seen_md5.add(ss_md5)    
-        else:
-            print(f'removing a duplicate match: {ss.name}')
-    siglist = new_siglist
+    return ""
 
-    # create empty LCA database to populate...
-    lca_db = LCA_Database(ksize=ksize, scaled=scaled, moltype=moltype)
-    lin_db = LineageDB()
-
-    # ...with specific matches.
-    for ss in siglist:
-        ident = get_ident(ss)
-        lineage = tax_assign[ident]
-
-        lca_db.insert(ss, ident=ident)
-        lin_db.insert(ident, lineage)
-
-    print(f'loaded {len(siglist)} signatures & created LCA Database')
 
+def classify_genome(entire_mh, lca_db, lin_db, provided_lineage,
+                    match_rank, min_f_ident, min_f_major):
+    "Choose a genome lineage based on gather and/or provided lineage."
     # calculate lineage from majority vote on LCA
     guessed_genome_lineage, f_major, f_ident = \
          guess_tax_by_gather(entire_mh, lca_db, lin_db, match_rank, sys.stdout)
@@ -233,54 +181,74 @@ def get_genome_taxonomy(matches_filename, database_list,
 
     return genome_lineage, comment, needs_lineage, f_major, f_ident
 
-###
 
-def main(args):
-    "Main entry point for scripting. Use cmdline for command line entry."
-    match_rank = args.match_rank
+def get_genome_taxonomy(matches_filename, database_list,
+                        genome_sig_filename, provided_lineage,
+                        tax_assign, taxonomy, match_rank, min_f_ident,
+                        min_f_major, prepared_matches=None):
+    genome_sig = sourmash.load_one_signature(genome_sig_filename)
+    entire_mh = genome_sig.minhash
 
-    # load taxonomy assignments for all the things
-    tax_assign, _ = load_taxonomy_assignments(args.lineages_csv,
-                                              start_column=2)
-    print(f'loaded {len(tax_assign)} tax assignments.')
+    # load the matches from prefetch as a picklist, and then stream all
+    # of the matches in the database into an LCA database & lineage
+    # database, removing exact matches & duplicates along the way.
+    # (or load them from the prepared matches cache.)
+    with metrics.phase('load_matches'):
+        prepared = load_prepared_matches(database_list, matches_filename,
+                                         entire_mh, tax_assign, taxonomy,
+                                         prepared_matches)
+        metrics.count('matches', prepared.n_loaded)
+
+    if not prepared.n_loaded:
+        comment = 'no matches for this genome.'
+        print(comment)
+        return None, comment, False, 0.0, 0.0
 
-    # place to load in the genome from
-    dirname = args.input_directory
+    exact_siglist = prepared.exact_siglist
+    if prepared.empty_mh is not None:
+        assert entire_mh.scaled == prepared.empty_mh.scaled
+    else:
+        assert entire_mh.scaled == exact_siglist[0].minhash.scaled
 
-    genome_name = args.genome
-    print(f"working on {genome_name}")
+    comment = check_exact_matches(exact_siglist, provided_lineage)
+    if comment:
+        return None, comment, True, 1.0, 1.0
 
-    # load the provided lineages file
+    # ...but leave exact matches in if they're the only matches, I guess!
+    lca_db, lin_db = prepared.lca_db, prepared.lin_db
+    if lca_db is None:
+        siglist = utils.remove_duplicate_signatures(exact_siglist)
+        lca_db, lin_db = utils.build_lca_database(siglist, tax_assign,
+                                                  taxonomy)
+
+    with metrics.phase('classify_genome'):
+        return classify_genome(entire_mh, lca_db, lin_db, provided_lineage,
+                               match_rank, min_f_ident, min_f_major)
+
+
+def load_provided_lineages(filename):
+    "Load the provided lineages file into a dictionary."
     provided_lineages = {}
-    if args.provided_lineages:
-        with open(args.provided_lineages, 'rt') as fp:
+    if filename:
+        with open(filename, 'rt') as fp:
             r = csv.reader(fp)
             for row in r:
                 gname = row[0]
                 lin = row[1:]
                 provided_lineages[gname] = lin
 
-    print(f"loaded {len(provided_lineages)} provided lineages")
+    return provided_lineages
 
-    ### XXX CTB
-
-    detected_contam = {}
-
-    summary_d = {}
-    matches_filename = os.path.join(dirname, genome_name + '.matches.csv')
-    genome_sig = os.path.join(dirname, genome_name + '.sig')
-    lineage = provided_lineages.get(genome_name, '')
-    contigs_json = os.path.join(dirname, genome_name + '.contigs-tax.json')
 
-    x = get_genome_taxonomy(matches_filename,
-                            args.databases,
-                            genome_sig,
-                            lineage,
-                            tax_assign, match_rank,
-                            args.min_f_ident,
-                            args.min_f_major)
-    genome_lineage, comment, needs_lineage, f_major, f_ident = x
+def summarize_genome(genome_name, contigs_d, genome_lineage, comment,
+                     needs_lineage, f_major, f_ident, match_rank, taxonomy):
+    """
+    Summarize contamination in contigs_d at all ranks; 'taxonomy' is the
+    TaxonomyIndex for the contigs' gather results.
 
+    Returns a dictionary of summary values, and a list of detected
+    (source, target, count) contamination tuples.
+    """
     # did we get a lineage for this genome? if so, propose filtering at
     # default rank 'match_rank', otherwise ...do not filter.
     if genome_lineage and not comment:
@@ -289,9 +257,6 @@ def main(args):
         genome_lineage = []
         filter_at = 'none'
 
-    # load contigs tax
-    contigs_d = load_contigs_gather_json(contigs_json)
-
     print(f'examining {genome_name} for contamination')
 
     vals = {}
@@ -328,48 +293,61 @@ def main(args):
     vals['total_contigs_n'] = contigs_n
     vals['total_contigs_bp'] = contigs_bp
 
-    # track contigs that have been eliminated at various ranks
-    for rank in sourmash.lca.taxlist():
-        (good_names, bad_names) = calculate_contam(genome_lineage,
-                                                   contigs_d,
-                                                   rank)
-
-        bad_n = len(bad_names)
-        bad_bp = sum([ x.length for x in bad_names.values() ])
-
-        print(f'   {rank}: {len(bad_names)} contigs w/ {kb(bad_bp)}kb')
-        vals[f'bad_{rank}_bp'] = bad_bp
-        vals[f'bad_{rank}_n'] = bad_n
-
-        (good_names, bad_names) = calculate_clean(genome_lineage,
-                                                  contigs_d,
-                                                  rank)
-        good_n = len(good_names)
-        good_bp = sum([ x.length for x in good_names.values() ])
-        vals[f'good_{rank}_bp'] = good_bp
-        vals[f'good_{rank}_n'] = good_n
+    # convert lineages to lineage ids once, and find the ranks at which
+    # each contig is contaminated in a single pass over the contigs.
+    contig_lids = contig_lineage_ids(taxonomy, contigs_d)
+    genome_lid = utils.genome_lineage_id(taxonomy, genome_lineage)
 
-        assert bad_bp + good_bp == contigs_bp
-
-        # track contamination between source (genome) / target (contig)
-        x = []
-        for contig_name in bad_names:
-            contig_taxlist = contigs_d[contig_name].gather_tax
-            for hit, count in contig_taxlist:
-                if utils.is_lineage_match(genome_lineage, hit, rank):
-                    continue
-
-                # contam!
-                source_lin = utils.pop_to_rank(genome_lineage, rank)
-                target_lin = utils.pop_to_rank(hit, rank)
+    ranks = []
+    for rank in sourmash.lca.taxlist():
+        ranks.append(rank)
+        if rank == 'genus':
+            break
 
-                x.append((source_lin, target_lin, count))
+    bad_n = [0] * len(ranks)
+    bad_bp = [0] * len(ranks)
+    bad_masks = {}
+    match_masks = {}
+    for contig_name, gather_info in contigs_d.items():
+        mask = contaminated_ranks_mask(taxonomy, genome_lid,
+                                       contig_lids[contig_name],
+                                       GATHER_MIN_MATCHES, match_masks)
+        if mask:
+            bad_masks[contig_name] = mask
+            for i in range(len(ranks)):
+                if mask & (1 << i):
+                    bad_n[i] += 1
+                    bad_bp[i] += gather_info.length
 
-        detected_contam[genome_name] = x
+    # track contigs that have been eliminated at various ranks
+    for i, rank in enumerate(ranks):
+        print(f'   {rank}: {bad_n[i]} contigs w/ {kb(bad_bp[i])}kb')
+        vals[f'bad_{rank}_bp'] = bad_bp[i]
+        vals[f'bad_{rank}_n'] = bad_n[i]
+
+        # clean is the opposite of contaminated.
+        vals[f'good_{rank}_bp'] = contigs_bp - bad_bp[i]
+        vals[f'good_{rank}_n'] = contigs_n - bad_n[i]
+
+    # track contamination between source (genome) / target (contig), at
+    # the last rank.
+    contam = []
+    rank = ranks[-1]
+    bit = 1 << (len(ranks) - 1)
+    source_lin = utils.pop_to_rank(genome_lineage, rank, taxonomy)
+    for contig_name, mask in bad_masks.items():
+        if not mask & bit:
+            continue
 
+        contig_taxlist = contigs_d[contig_name].gather_tax
+        for (hit_lin, count), (hit, _) in zip(contig_taxlist,
+                                              contig_lids[contig_name]):
+            if taxonomy.is_match(genome_lid, hit, rank):
+                continue
 
-        if rank == 'genus':
-            break
+            # contam!
+            target_lin = utils.pop_to_rank(hit_lin, rank, taxonomy)
+            contam.append((source_lin, target_lin, count))
 
     vals['total_bad_bp'] = vals[f'bad_{match_rank}_bp']
     if vals['total_bad_bp'] == 0:
@@ -377,21 +355,19 @@ def main(args):
 
     print(f"   (total): {vals['bad_genus_n']} contigs w/ {kb(vals['bad_genus_bp'])}kb")
 
-    summary_d[genome_name] = vals
+    return vals, contam
 
-    # output a hit list CSV for this genome
-    fp = open(args.hit_list, 'wt')
+
+def write_hit_list(summary_items, filename):
+    "Output a hit list CSV for these genomes."
+    fp = open(filename, 'wt')
     hitlist_w = csv.writer(fp)
-    
+
     hitlist_w.writerow(['genome', 'filter_at', 'override_filter_at',
         'total_bad_bp', 'superkingdom_bad_bp', 'phylum_bad_bp',
         'class_bad_bp', 'order_bad_bp', 'family_bad_bp', 'genus_bad_bp',
         'f_ident', 'f_major', 'lineage', 'comment'])
 
-    summary_items = list(summary_d.items())
-    assert len(summary_items) == 1
-    #summary_items.sort(key=lambda x: -x[1]["total_bad_bp"])
-
     for genome_name, vals in summary_items:
         hitlist_w.writerow([genome_name,
                             vals['filter_at'], '',
@@ -409,8 +385,10 @@ def main(args):
 
     fp.close()
 
-    # output a single-line summary CSV with a lot more information!
-    fp = open(args.genome_summary, 'wt')
+
+def write_genome_summary(summary_items, filename):
+    "Output a summary CSV with a lot more information!"
+    fp = open(filename, 'wt')
 
     # build column list; put genome first
     vals = summary_items[0][1]
@@ -427,13 +405,128 @@ def main(args):
 
     fp.close()
 
-    ####
+###
+
+def compare_genome(genome_name, dirname, databases, tax_assign, taxonomy,
+                   provided_lineages, match_rank, min_f_ident, min_f_major,
+                   prepared_matches=None):
+    """
+    Compare taxonomy for contigs in one genome.
+
+    Returns a dictionary of summary values, and a list of detected
+    contamination.
+    """
+    print(f"working on {genome_name}")
+
+    matches_filename = os.path.join(dirname, genome_name + '.matches.csv')
+    genome_sig = os.path.join(dirname, genome_name + '.sig')
+    lineage = provided_lineages.get(genome_name, '')
+    contigs_json = find_contigs_tax(dirname, genome_name)
+
+    x = get_genome_taxonomy(matches_filename,
+                            databases,
+                            genome_sig,
+                            lineage,
+                            tax_assign, taxonomy, match_rank,
+                            min_f_ident,
+                            min_f_major,
+                            prepared_matches)
+    genome_lineage, comment, needs_lineage, f_major, f_ident = x
+
+    # load contigs tax
+    with metrics.phase('load_contigs_tax'):
+        contigs_d = load_contigs_gather_json(contigs_json)
+        metrics.count('contigs', len(contigs_d))
+
+    with metrics.phase('summarize_genome'):
+        return summarize_genome(genome_name, contigs_d, genome_lineage,
+                                comment, needs_lineage, f_major, f_ident,
+                                match_rank, taxonomy)
+
+
+def save_genome_outputs(genome_name, vals, contam, hit_list, genome_summary,
+                        contam_summary_json):
+    "Save hit list, genome summary, and contamination summary for a genome."
+    summary_items = [(genome_name, vals)]
+
+    with metrics.phase('write_outputs'):
+        # output a hit list CSV for this genome
+        write_hit_list(summary_items, hit_list)
+
+        # output a single-line summary CSV with a lot more information!
+        write_genome_summary(summary_items, genome_summary)
+
+        print(f"processed {genome_name}.")
+
+        print(f"saving contamination summary to {contam_summary_json}")
+        with open(contam_summary_json, 'wt') as fp:
+            utils.save_contamination_summary({ genome_name: contam }, fp)
+
+
+def _metrics_output(args):
+    "Name the metrics for a genome, or for a batch of genomes."
+    if not getattr(args, 'genome_list', None):
+        return args.hit_list
+    return os.path.join(args.output_directory or args.input_directory,
+                        'compare_taxonomy')
 
-    print(f"processed {genome_name}.")
 
-    print(f"saving contamination summary to {args.contam_summary_json}")
-    with open(args.contam_summary_json, 'wt') as fp:
-        utils.save_contamination_summary(detected_contam, fp)
+@metrics.record('compare_taxonomy', output=_metrics_output)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    match_rank = args.match_rank
+
+    with metrics.phase('load_taxonomy'):
+        # load taxonomy assignments for all the things
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        print(f'loaded {len(tax_assign)} tax assignments.')
+        taxonomy = build_taxonomy_index(tax_assign)
+
+        # load the provided lineages file
+        provided_lineages = load_provided_lineages(args.provided_lineages)
+        print(f"loaded {len(provided_lineages)} provided lineages")
+
+    # place to load in the genome from
+    dirname = args.input_directory
+
+    # open the databases once, for all genomes.
+    with metrics.phase('load_databases'):
+        databases = utils.load_databases(args.databases)
+
+    # batch mode: run on many genomes, with taxonomy & databases loaded.
+    genome_list = getattr(args, 'genome_list', None)
+    if genome_list:
+        genome_names = utils.load_genome_list(genome_list)
+        print(f"loaded {len(genome_names)} genomes from '{genome_list}'")
+
+        output_dir = args.output_directory or dirname
+        for genome_name in genome_names:
+            with metrics.genome(genome_name):
+                vals, contam = compare_genome(genome_name, dirname, databases,
+                                              tax_assign, taxonomy,
+                                              provided_lineages,
+                                              match_rank, args.min_f_ident,
+                                              args.min_f_major,
+                                              prepared_matches_for_args(args, genome_name))
+
+                prefix = os.path.join(output_dir, genome_name)
+                save_genome_outputs(genome_name, vals, contam,
+                                    prefix + '.hitlist_for_filtering.csv',
+                                    prefix + '.genome_summary.csv',
+                                    prefix + '.contam_summary.json')
+
+        return 0
+
+    genome_name = args.genome
+    with metrics.genome(genome_name):
+        vals, contam = compare_genome(genome_name, dirname, databases,
+                                      tax_assign, taxonomy, provided_lineages,
+                                      match_rank, args.min_f_ident,
+                                      args.min_f_major,
+                                      prepared_matches_for_args(args, genome_name))
+
+        save_genome_outputs(genome_name, vals, contam, args.hit_list,
+                            args.genome_summary, args.contam_summary_json)
 
     return 0
 
@@ -442,9 +535,9 @@ def cmdline(sys_args):
     "Command line entry point w/argparse action."
     p = argparse.ArgumentParser(sys_args)
     p.add_argument('--input-directory', required=True)
-    p.add_argument('--hit-list', required=True)
-    p.add_argument('--genome-summary', required=True)
-    p.add_argument('--contam-summary-json', required=True)   # @CTB remove?
+    p.add_argument('--hit-list')
+    p.add_argument('--genome-summary')
+    p.add_argument('--contam-summary-json')   # @CTB remove?
     p.add_argument('--lineages-csv', help='lineage spreadsheet', required=True)
     p.add_argument('--provided-lineages', help='provided lineages')
     p.add_argument('--min_f_ident', type=float, default=F_IDENT_THRESHOLD)
@@ -452,9 +545,23 @@ def cmdline(sys_args):
     p.add_argument('--match-rank', required=True)
     p.add_argument('--databases', help='sourmash databases', required=True,
                    nargs='+')
-    p.add_argument('genome')
+    p.add_argument('genome', nargs='?')
+    p.add_argument('--prepared-matches-dir',
+                   help='directory in which to cache prepared matches for each genome')
+
+    # batch mode
+    p.add_argument('--genome-list',
+                   help='file of genome names to run on, in batch mode')
+    p.add_argument('--output-directory',
+                   help='directory for per-genome outputs in batch mode (default: input directory)')
+    metrics.add_argument(p)
     args = p.parse_args()
 
+    if not args.genome_list:
+        if not (args.genome and args.hit_list and args.genome_summary and \
+                args.contam_summary_json):
+            p.error('genome, --hit-list, --genome-summary and --contam-summary-json are required')
+
     return main(args)
 
 
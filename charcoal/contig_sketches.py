@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+"""
+Per-contig sketches of a genome, in a compact binary file.
+
+Hashing a genome's contigs is the same work in every stage - computing
+the genome signature, classifying contigs, listing contaminants - so do
+it once: store each contig's name, length, and hashes. The whole-genome
+sketch is the union of the contig sketches.
+
+Layout (little-endian; each section is padded to 8 bytes):
+
+* header - see HEADER;
+* contig name offsets (n_contigs + 1 uint64) and UTF-8 names;
+* contig lengths (n_contigs uint64);
+* hash offsets (n_contigs + 1 uint64) and hashes (uint64, sorted within
+  each contig).
+"""
+import sys
+import argparse
+import struct
+from array import array
+from collections import namedtuple
+
+import screed
+
+import sourmash
+
+from .version import version
+from . import metrics
+from .binary_format import pad, strings_table, write_sections
+
+
+MAGIC = b'CHCTGSK1'
+
+# magic, moltype, ksize, seed, scaled, n_contigs.
+HEADER = struct.Struct('<8s8sQQQQ')
+
+MOLTYPES = ('DNA', 'protein', 'dayhoff', 'hp')
+
+
+def _uint64_array(values=()):
+    "An array of native uint64; the file format is little-endian."
+    assert sys.byteorder == 'little', 'big-endian systems are not supported'
+    a = array('Q', values)
+    assert a.itemsize == 8
+    return a
+
+
+# A contig to be classified: 'sequence' is set when read from FASTA,
+# 'hashes' when read from a contig sketches file.
+Contig = namedtuple('Contig', ['name', 'length', 'sequence', 'hashes'])
+
+
+def contig_minhash(contig, empty_mh):
+    "Build a MinHash like 'empty_mh' for a Contig."
+    mh = empty_mh.copy_and_clear()
+    if contig.hashes is not None:
+        # hashes above max_hash are ignored, so this also downsamples.
+        mh.add_many(contig.hashes)
+    else:
+        mh.add_sequence(contig.sequence, force=True)
+    return mh
+
+
+def make_template_minhash(ksize, scaled, moltype):
+    """
+    Make an empty MinHash with the same parameters as 'sourmash compute'.
+
+    Note that for protein moltypes, the k-mer size is given in nucleotides.
+    """
+    if moltype not in MOLTYPES:
+        raise ValueError(f"unknown moltype '{moltype}'")
+
+    if moltype == 'DNA':
+        return sourmash.MinHash(n=0, ksize=ksize, scaled=scaled)
+
+    if ksize % 3 != 0:
+        raise ValueError(f"ksize {ksize} must be divisible by 3 for {moltype}")
+
+    return sourmash.MinHash(n=0, ksize=ksize // 3, scaled=scaled,
+                            is_protein=(moltype == 'protein'),
+                            dayhoff=(moltype == 'dayhoff'),
+                            hp=(moltype == 'hp'))
+
+
+class ContigSketches:
+    """
+    Contig names, lengths and hashes for a genome.
+
+    Hashes for contig 'i' are hashes[hash_offsets[i]:hash_offsets[i+1]].
+    """
+    def __init__(self, template_mh, names, lengths, hash_offsets, hashes):
+        self.template_mh = template_mh.copy_and_clear()
+        self.names = names
+        self.lengths = lengths
+        self.hash_offsets = hash_offsets
+        self.hashes = hashes
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def scaled(self):
+        return self.template_mh.scaled
+
+    def contig_hashes(self, i):
+        return self.hashes[self.hash_offsets[i]:self.hash_offsets[i + 1]]
+
+    def contigs(self):
+        "Yield a Contig for each contig, in file order."
+        for i, name in enumerate(self.names):
+            yield Contig(name, self.lengths[i], None, self.contig_hashes(i))
+
+    def genome_minhash(self):
+        "The sketch of the entire genome: the union of the contig sketches."
+        mh = self.template_mh.copy_and_clear()
+        mh.add_many(self.hashes)
+        return mh
+
+    def is_compatible(self, empty_mh):
+        """
+        Can these hashes be used for 'empty_mh'? Parameters must match, and
+        the sketches must be at the same or a finer scaled.
+        """
+        mh = self.template_mh
+        return mh.ksize == empty_mh.ksize and \
+            mh.moltype == empty_mh.moltype and \
+            mh.seed == empty_mh.seed and \
+            mh.scaled <= empty_mh.scaled
+
+    @classmethod
+    def from_fasta(cls, genome_filename, template_mh):
+        "Hash each contig in a FASTA file."
+        names = []
+        lengths = _uint64_array()
+        hash_offsets = _uint64_array([0])
+        hashes = _uint64_array()
+        for record in screed.open(genome_filename):
+            mh = template_mh.copy_and_clear()
+            mh.add_sequence(record.sequence, force=True)
+
+            names.append(record.name)
+            lengths.append(len(record.sequence))
+            hashes.extend(sorted(mh.hashes))
+            hash_offsets.append(len(hashes))
+
+        return cls(template_mh, names, lengths, hash_offsets, hashes)
+
+    def save(self, filename):
+        "Save to a binary file; written to a temp file and renamed."
+        mh = self.template_mh
+        header = HEADER.pack(MAGIC, mh.moltype.encode('ascii'), mh.ksize,
+                             mh.seed, mh.scaled, len(self.names))
+
+        name_offsets, name_data = strings_table(self.names)
+
+        sections = [name_offsets, name_data,
+                    _uint64_array(self.lengths).tobytes(),
+                    _uint64_array(self.hash_offsets).tobytes(),
+                    _uint64_array(self.hashes).tobytes()]
+
+        write_sections(filename, header, sections)
+
+    @classmethod
+    def load(cls, filename):
+        "Load from a binary file."
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+
+        if len(data) < HEADER.size:
+            raise ValueError(f"'{filename}' is not a charcoal contig sketches file")
+        magic, moltype, ksize, seed, scaled, n_contigs = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"'{filename}' is not a charcoal contig sketches file")
+        moltype = moltype.rstrip(b'\0').decode('ascii')
+
+        template_mh = sourmash.MinHash(n=0, ksize=ksize, scaled=scaled,
+                                       seed=seed,
+                                       is_protein=(moltype == 'protein'),
+                                       dayhoff=(moltype == 'dayhoff'),
+                                       hp=(moltype == 'hp'))
+
+        pos = pad(HEADER.size)
+
+        def section(nbytes):
+            nonlocal pos
+            x = data[pos:pos + nbytes]
+            pos += pad(nbytes)
+            return x
+
+        def uint64_section(n):
+            a = _uint64_array()
+            a.frombytes(section(8 * n))
+            return a
+
+        name_offsets = uint64_section(n_contigs + 1)
+        name_data = section(name_offsets[-1])
+        names = [ name_data[name_offsets[i]:name_offsets[i + 1]].decode('utf-8')
+                  for i in range(n_contigs) ]
+        lengths = uint64_section(n_contigs)
+        hash_offsets = uint64_section(n_contigs + 1)
+        hashes = uint64_section(hash_offsets[-1])
+
+        return cls(template_mh, names, lengths, hash_offsets, hashes)
+
+
+def load_contigs(genome_filename, empty_mh, sketches_filename=None):
+    """
+    Yield a Contig for each contig in a genome.
+
+    Uses the contig sketches file if given and compatible with 'empty_mh',
+    otherwise reads the genome FASTA.
+    """
+    if sketches_filename:
+        sketches = ContigSketches.load(sketches_filename)
+        if sketches.is_compatible(empty_mh):
+            yield from sketches.contigs()
+            return
+
+        print(f"contig sketches in '{sketches_filename}' don't match the database; reading {genome_filename}")
+
+    for record in screed.open(genome_filename):
+        yield Contig(record.name, len(record.sequence), record.sequence, None)
+
+
+def sketch_genome(genome, output, sig_out, ksize, scaled, moltype):
+    "Save the contig sketches for a genome, and optionally its signature."
+    template_mh = make_template_minhash(ksize, scaled, moltype)
+
+    with metrics.phase('hash_contigs'):
+        sketches = ContigSketches.from_fasta(genome, template_mh)
+        metrics.count('contigs', len(sketches))
+        metrics.count('bp', sum(sketches.lengths))
+        metrics.count('hashes', len(sketches.hashes))
+
+    with metrics.phase('write_sketches'):
+        sketches.save(output)
+        print(f"saved sketches for {len(sketches)} contigs to '{output}'")
+
+        if sig_out:
+            # same as 'sourmash compute' on the genome, w/o rehashing.
+            genome_sig = sourmash.SourmashSignature(sketches.genome_minhash(),
+                                                    filename=genome)
+            with open(sig_out, 'wt') as fp:
+                sourmash.save_signatures([genome_sig], fp)
+            print(f"saved genome signature to '{sig_out}'")
+
+
+@metrics.record('contig_sketches', output='output', genome='genome')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    sketch_genome(args.genome, args.output, args.sig_out, args.ksize,
+                  args.scaled, args.moltype)
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('genome', help='genome file')
+    p.add_argument('-o', '--output', required=True,
+                   help='contig sketches output file')
+    p.add_argument('--sig-out', help='also save the genome signature')
+    p.add_argument('-k', '--ksize', type=int, required=True)
+    p.add_argument('--scaled', type=int, required=True)
+    p.add_argument('--moltype', default='DNA', choices=MOLTYPES)
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -8,60 +8,85 @@ import os.path
 import json
 from collections import defaultdict
 
-import screed
-
 import sourmash
-from sourmash.lca.command_index import load_taxonomy_assignments
-from sourmash.lca import LCA_Database
 
-from .lineage_db import LineageDB
 from .version import version
+from .taxonomy_cache import load_taxonomy
+from .taxonomy_index import build_taxonomy_index
+from .contig_sketches import load_contigs, contig_minhash
 from . import utils
-from .utils import (get_ident, CSV_DictHelper, make_lineage)
+from . import metrics
+from .utils import make_lineage
 from .compare_taxonomy import GATHER_MIN_MATCHES
+from .prepared_matches import load_prepared_matches, prepared_matches_for_args
+from .results_db import load_hit_list
 
 
 def get_matches(mh, lca_db, lin_db, match_rank, threshold_bp):
-    import copy
-    minhash = copy.copy(mh)
-    minhash = minhash.flatten()
-    query_sig = sourmash.SourmashSignature(minhash)
-
-    accs = set()
-
-    # do the gather:
-    while 1:
-        try:
-            results = lca_db.best_containment(query_sig, threshold_bp=threshold_bp)
-        except ValueError:
-            break
-
-        if not results:
+    "Run gather, yielding (ident, lineage, count) matches above threshold_bp."
+    threshold = threshold_bp / mh.scaled
+
+    # gather match counts are non-increasing, so stop at the first one
+    # below threshold.
+    for match_ident, match_lineage, common in utils.gather_matches(mh, lca_db,
+                                                                   lin_db):
+        if common < threshold:
             break
 
-        (match, match_sig, _) = results
-        common = match_sig.minhash.count_common(query_sig.minhash)
-
-        # retrieve identity
-        match_ident = get_ident(match_sig)
-        match_lineage = lin_db.ident_to_lineage[match_ident]
-        
         yield match_ident, match_lineage, common
-        
-        # finish out gather algorithm!
-        minhash.remove_many(match_sig.minhash.hashes)
-        query_sig = sourmash.SourmashSignature(minhash)
-
-    return accs
 
 
+def record_matches(matches, genome_lin, match_rank, matches_info,
+                   matches_counts, taxonomy=None):
+    "Record clean/dirty status and counts for (ident, lineage, count) matches."
+    for acc, match_lin, count in matches:
+        # dirty match
+        if not utils.is_lineage_match(genome_lin, match_lin, match_rank,
+                                      taxonomy):
+            if acc in matches_info:
+                assert matches_info[acc][0] == 'dirty'
+            matches_info[acc] = ['dirty', utils.display_lineage(match_lin)]
+        else:                     # clean
+            if acc in matches_info:
+                assert matches_info[acc][0] == 'clean'
+            matches_info[acc] = ['clean', utils.display_lineage(match_lin)]
+
+        matches_counts[acc] += count
+
+
+def save_matches_json(fp, genomebase, genome_lin, match_rank, scaled,
+                      matches_info, matches_counts):
+    "Save clean/dirty matches info to JSON."
+    out_dict = {}
+    info_dict = {}
+    info_dict['genome'] = genomebase
+    info_dict['genome_lineage'] = utils.display_lineage(genome_lin)
+    info_dict['match_rank'] = match_rank
+    info_dict['scaled'] = scaled
+    out_dict['query_info'] = info_dict
+
+    matches_info_out = {}
+    for acc, (match_type, lineage) in matches_info.items():
+        acc_info = {}
+        acc_info['lineage'] = lineage
+        acc_info['match_type'] = match_type
+        acc_info['counts'] = matches_counts[acc]
+        matches_info_out[acc] = acc_info
+    out_dict['matches'] = matches_info_out
+
+    json.dump(out_dict, fp)
+
+
+@metrics.record('contigs_list_contaminants', output='json_out',
+                genome='genome')
 def main(args):
     "Main entry point for scripting. Use cmdline for command line entry."
     genomebase = os.path.basename(args.genome)
 
     # load hitlist
-    hitlist = CSV_DictHelper(args.hitlist, 'genome')
-    hitlist_entry = hitlist[genomebase]
+    with load_hit_list(args.hitlist,
+                       getattr(args, 'results_db', None)) as hitlist:
+        hitlist_entry = hitlist[genomebase]
     match_rank = hitlist_entry.filter_at
     if hitlist_entry.override_filter_at:
         match_rank = hitlist_entry.override_filter_at
@@ -75,65 +100,43 @@ def main(args):
     genome_lin = make_lineage(hitlist_entry.lineage)
 
     # load taxonomy CSV
-    tax_assign, _ = load_taxonomy_assignments(args.lineages_csv,
-                                              start_column=2)
+    with metrics.phase('load_taxonomy'):
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        taxonomy = build_taxonomy_index(tax_assign)
     print(f'loaded {len(tax_assign)} tax assignments.')
 
     # load the genome signature
     genome_sig = sourmash.load_one_signature(args.genome_sig)
 
-    # load the matches from prefetch as a picklist
-    picklist = sourmash.picklist.SignaturePicklist('prefetch')
-    picklist.load(args.matches_csv, picklist.column_name)
-
-    # load all of the matches in the database, as found by prefetch;
-    # select on them; and then aggregate into MultiIndex.
-    # CTB note: currently, this loads all the signatures into memory.
-    # Alternatively we could do something with LazyLoadedIndex maybe?
-
-    siglist = []
-    for filename in args.databases:
-        db = sourmash.load_file_as_index(filename)
-        db = db.select(picklist=picklist)
-        siglist += list(db.signatures())
-
-    # Hack for examining members of our search database: remove exact matches.
-    new_siglist = []
-    for ss in siglist:
-        if genome_sig.similarity(ss) == 1.0:
-            print(f'removing an identical match: {ss.name}')
-        else:
-            new_siglist.append(ss)
-    siglist = new_siglist
+    # load the matches from prefetch as a picklist, and then stream all
+    # of the matches in the database into an LCA database & lineage
+    # database, removing exact matches & duplicates along the way.
+    # (or load them from the prepared matches cache.)
+    with metrics.phase('load_databases'):
+        databases = utils.load_databases(args.databases)
+    with metrics.phase('load_matches'):
+        prepared = load_prepared_matches(databases, args.matches_csv,
+                                         genome_sig.minhash, tax_assign,
+                                         taxonomy,
+                                         prepared_matches_for_args(args, genomebase))
+        metrics.count('matches', prepared.n_loaded)
+
+    for ss in prepared.exact_siglist:
+        print(f'removing an identical match: {ss.name}')
 
     # if, after removing exact match(es), there is nothing left, quit.
     # (but write an empty output file so that snakemake workflows don't
     # complain.)
-    if not siglist:
+    if prepared.lca_db is None:
         print('no non-identical matches for this genome, exiting.')
         with open(args.json_out, 'wt') as fp:
             pass
         return 0
 
-    # construct a template minhash object that we can use to create new 'uns
-    empty_mh = siglist[0].minhash.copy_and_clear()
-    ksize = empty_mh.ksize
-    scaled = empty_mh.scaled
-    moltype = empty_mh.moltype
+    lca_db, lin_db = prepared.lca_db, prepared.lin_db
 
-    # create empty LCA database to populate...
-    lca_db = LCA_Database(ksize=ksize, scaled=scaled, moltype=moltype)
-    lin_db = LineageDB()
-
-    # ...with specific matches.
-    for ss in siglist:
-        ident = get_ident(ss)
-        lineage = tax_assign[ident]
-
-        lca_db.insert(ss, ident=ident)
-        lin_db.insert(ident, lineage)
-
-    print(f'loaded {len(siglist)} signatures & created LCA Database')
+    # template minhash object that we can use to create new 'uns
+    empty_mh = prepared.empty_mh
 
     print('')
     print(f'reading contigs from {genomebase}')
@@ -141,56 +144,32 @@ def main(args):
     matches_info = {}
     matches_counts = defaultdict(int)
 
-    screed_iter = screed.open(args.genome)
+    contigs = load_contigs(args.genome, empty_mh,
+                           getattr(args, 'contig_sketches', None))
+    contigs = metrics.timed_iter('read_contigs', contigs)
     threshold_bp = empty_mh.scaled * GATHER_MIN_MATCHES
 
     n = - 1
-    for n, record in enumerate(screed_iter):
-        # look at each contig individually
-        mh = empty_mh.copy_and_clear()
-        mh.add_sequence(record.sequence, force=True)
-
-        # collect all the gather results at genus level, together w/counts;
-        # here, results is a list of (lineage, count) tuples.
-        results = list(utils.gather_at_rank(mh, lca_db, lin_db, match_rank))
-
-        for acc, match_lin, count in get_matches(mh, lca_db, lin_db, match_rank,
-                                          threshold_bp):
-            # dirty match
-            if not utils.is_lineage_match(genome_lin, match_lin, match_rank):
-                if acc in matches_info:
-                    assert matches_info[acc][0] == 'dirty'
-                matches_info[acc] = ['dirty', utils.display_lineage(match_lin)]
-            else:                     # clean
-                if acc in matches_info:
-                    assert matches_info[acc][0] == 'clean'
-                matches_info[acc] = ['clean', utils.display_lineage(match_lin)]
-
-            matches_counts[acc] += count
-                    
+    with metrics.phase('gather_contigs'):
+        for n, contig in enumerate(contigs):
+            # look at each contig individually
+            mh = contig_minhash(contig, empty_mh)
+            metrics.count('contigs')
+            metrics.count('bp', contig.length)
+            metrics.count('hashes', len(mh))
+
+            matches = get_matches(mh, lca_db, lin_db, match_rank,
+                                  threshold_bp)
+            record_matches(matches, genome_lin, match_rank, matches_info,
+                           matches_counts, taxonomy)
 
     print(f"Processed {n + 1} contigs.")
 
     # save!
-    with open(args.json_out, 'wt') as fp:
-        out_dict = {}
-        info_dict = {}
-        info_dict['genome'] = genomebase
-        info_dict['genome_lineage'] = utils.display_lineage(genome_lin)
-        info_dict['match_rank'] = match_rank
-        info_dict['scaled'] = empty_mh.scaled
-        out_dict['query_info'] = info_dict
-
-        matches_info_out = {}
-        for acc, (match_type, lineage) in matches_info.items():
-            acc_info = {}
-            acc_info['lineage'] = lineage
-            acc_info['match_type'] = match_type
-            acc_info['counts'] = matches_counts[acc]
-            matches_info_out[acc] = acc_info
-        out_dict['matches'] = matches_info_out
-
-        json.dump(out_dict, fp)
+    with metrics.phase('write_outputs'):
+        with open(args.json_out, 'wt') as fp:
+            save_matches_json(fp, genomebase, genome_lin, match_rank,
+                              empty_mh.scaled, matches_info, matches_counts)
 
     return 0
 
@@ -205,6 +184,8 @@ def cmdline(sys_args):
                    nargs='+')
     p.add_argument('--lineages-csv', help='lineage spreadsheet', required=True)
     p.add_argument('--hitlist', help='hitlist spreadsheet', required=True)
+    p.add_argument('--results-db',
+                   help='look up the hit list in this results store instead')
     p.add_argument('--force', help='continue past survivable errors',
                    action='store_true')
 
@@ -212,6 +193,11 @@ def cmdline(sys_args):
                    help='JSON output file of all matches',
                    required=True)
     p.add_argument('--match-rank', required=True)
+    p.add_argument('--contig-sketches',
+                   help='contig sketches for the genome, instead of rehashing it')
+    p.add_argument('--prepared-matches-dir',
+                   help='directory in which to cache prepared matches for each genome')
+    metrics.add_argument(p)
     args = p.parse_args()
 
     return main(args)
@@ -1,144 +1,167 @@
 #! /usr/bin/env python
 """
-Do gather matches on contigs => taxonomy, and save to JSON
+Do gather matches on contigs => taxonomy, and save to JSON or binary
 """
 import sys
 import argparse
 import os.path
-import json
-
-import screed
 
 import sourmash
-from sourmash.lca.command_index import load_taxonomy_assignments
-from sourmash.lca import LCA_Database
 
-from .lineage_db import LineageDB
+from . import utils
+from . import metrics
 from .version import version
-from .utils import (gather_at_rank, get_ident, ContigGatherInfo)
+from .taxonomy_cache import load_taxonomy
+from .taxonomy_index import build_taxonomy_index
+from .utils import (gather_at_rank, ContigGatherInfo)
+from .contig_sketches import load_contigs, contig_minhash
+from .contigs_tax import save_contigs_tax, SUFFIXES
+from .prepared_matches import load_prepared_matches, prepared_matches_for_args
+
+
+def classify_contig(contig, empty_mh, lca_db, lin_db, match_rank):
+    "Gather a single contig; return (name, ContigGatherInfo)."
+    # look at each contig individually
+    mh = contig_minhash(contig, empty_mh)
+    # collect all the gather results at genus level, together w/counts;
+    # here, results is a list of (lineage, count) tuples.
+    results = list(gather_at_rank(mh, lca_db, lin_db, match_rank))
+    # store together with size of sequence.
+    return contig.name, ContigGatherInfo(contig.length, len(mh), results)
+
+
+def search_genome(genome, genome_sig, matches_csv, json_out, databases,
+                  tax_assign, taxonomy, match_rank, threads=1,
+                  contig_sketches=None, prepared_matches=None):
+    "Do gather matches on the contigs in one genome, and save to JSON."
+    genomebase = os.path.basename(genome)
 
+    # load the genome signature
+    genome_sig = sourmash.load_one_signature(genome_sig)
 
-def main(args):
-    "Main entry point for scripting. Use cmdline for command line entry."
-    genomebase = os.path.basename(args.genome)
-    match_rank = args.match_rank
+    # load the matches from prefetch as a picklist, and then stream all
+    # of the matches in the database into an LCA database & lineage
+    # database, removing exact matches & duplicates along the way.
+    # (or load them from the prepared matches cache.)
+    with metrics.phase('load_matches'):
+        prepared = load_prepared_matches(databases, matches_csv,
+                                         genome_sig.minhash, tax_assign,
+                                         taxonomy, prepared_matches)
+        metrics.count('matches', prepared.n_loaded)
 
-    # load taxonomy CSV
-    tax_assign, _ = load_taxonomy_assignments(args.lineages_csv,
-                                              start_column=2)
-    print(f'loaded {len(tax_assign)} tax assignments.')
+    print(f"loaded {prepared.n_loaded} matches from '{matches_csv}'")
 
-    # load the genome signature
-    genome_sig = sourmash.load_one_signature(args.genome_sig)
-
-    # load the matches from prefetch as a picklist
-    picklist = sourmash.picklist.SignaturePicklist('prefetch')
-    try:
-        picklist.load(args.matches_csv, picklist.column_name)
-    except ValueError:
-        with open(args.matches_csv, 'rt') as fp:
-            contents = fp.read()
-            if not len(contents): # empty is ok.
-                picklist = None
-            else:
-                raise
-
-    # load all of the matches in the database, as found by prefetch;
-    # select on them; and then aggregate into MultiIndex.
-    # CTB note: currently, this loads all the signatures into memory.
-    # Alternatively we could do something with LazyLoadedIndex maybe?
-
-    siglist = []
-    for filename in args.databases:
-        db = sourmash.load_file_as_index(filename)
-        db = db.select(picklist=picklist)
-        siglist += list(db.signatures())
-
-    print(f"loaded {len(siglist)} matches from '{args.matches_csv}'")
-
-    # Hack for examining members of our search database: remove exact matches.
-    new_siglist = []
-    for ss in siglist:
-        if genome_sig.similarity(ss) == 1.0:
-            print(f'removing an identical match: {ss.name}')
-        else:
-            new_siglist.append(ss)
-    siglist = new_siglist
+    for ss in prepared.exact_siglist:
+        print(f'removing an identical match: {ss.name}')
 
     # if, after removing exact match(es), there is nothing left, quit.
     # (but write an empty JSON file so that snakemake workflows don't
     # complain.)
-    if not siglist:
+    if prepared.lca_db is None:
         print('no non-identical matches for this genome, exiting.')
         contigs_tax = {}
-        with open(args.json_out, 'wt') as fp:
-            fp.write(json.dumps(contigs_tax))
+        save_contigs_tax(contigs_tax, json_out)
         return 0
 
-    # remove duplicate signatures in matches
-    # workaround for issue of duplicate sigs in SBT, see sourmash/#1171
-    new_siglist = []
-    seen_md5 = set()
-    for ss in siglist:
-        ss_md5 = ss.md5sum()
-        if not ss_md5 in seen_md5:
-            new_siglist.append(ss)
-            seen_md5.add(ss_md5)    
-        else:
-            print(f'removing a duplicate match: {ss.name}')
-    siglist = new_siglist
-
-    # construct a template minhash object that we can use to create new 'uns
-    empty_mh = siglist[0].minhash.copy_and_clear()
-    ksize = empty_mh.ksize
-    scaled = empty_mh.scaled
-    moltype = empty_mh.moltype
-
-    # create empty LCA database to populate...
-    lca_db = LCA_Database(ksize=ksize, scaled=scaled, moltype=moltype)
-    lin_db = LineageDB()
-
-    # ...with specific matches.
-    for ss in siglist:
-        ident = get_ident(ss)
-        lineage = tax_assign[ident]
-
-        lca_db.insert(ss, ident=ident)
-        lin_db.insert(ident, lineage)
-
-    print(f'loaded {len(siglist)} signatures & created LCA Database')
+    lca_db, lin_db = prepared.lca_db, prepared.lin_db
+
+    # template minhash object that we can use to create new 'uns
+    empty_mh = prepared.empty_mh
 
     print('')
     print(f'reading contigs from {genomebase}')
 
-    screed_iter = screed.open(args.genome)
+    # classify contigs, in parallel if requested; results are in order.
+    utils.get_gather_md5sums(lca_db)
+    records = load_contigs(genome, empty_mh, contig_sketches)
+    records = metrics.timed_iter('read_contigs', records)
+    results = utils.map_contigs(classify_contig, records,
+                                (empty_mh, lca_db, lin_db, match_rank),
+                                threads=threads)
+
     contigs_tax = {}
-    for n, record in enumerate(screed_iter):
-        # look at each contig individually
-        mh = empty_mh.copy_and_clear()
-        mh.add_sequence(record.sequence, force=True)
-        # collect all the gather results at genus level, together w/counts;
-        # here, results is a list of (lineage, count) tuples.
-        results = list(gather_at_rank(mh, lca_db, lin_db, match_rank))
-        # store together with size of sequence.
-        info = ContigGatherInfo(len(record.sequence), len(mh), results)
-        contigs_tax[record.name] = info
+    with metrics.phase('gather_contigs'):
+        for name, info in results:
+            contigs_tax[name] = info
+            metrics.count('contigs')
+            metrics.count('bp', info.length)
+            metrics.count('hashes', info.num_hashes)
 
     print(f"Processed {len(contigs_tax)} contigs.")
 
     # save!
-    with open(args.json_out, 'wt') as fp:
-        fp.write(json.dumps(contigs_tax))
+    with metrics.phase('write_outputs'):
+        save_contigs_tax(contigs_tax, json_out)
 
     return 0
 
 
+def _metrics_output(args):
+    "Name the metrics for a genome, or for a batch of genomes."
+    if not getattr(args, 'genome_list', None):
+        return args.json_out
+    return os.path.join(args.output_directory or args.input_directory,
+                        'contigs_search_taxonomy')
+
+
+@metrics.record('contigs_search_taxonomy', output=_metrics_output)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    match_rank = args.match_rank
+    threads = getattr(args, 'threads', 1)
+    contig_sketches = getattr(args, 'contig_sketches', None)
+
+    # load taxonomy CSV
+    with metrics.phase('load_taxonomy'):
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        taxonomy = build_taxonomy_index(tax_assign)
+    print(f'loaded {len(tax_assign)} tax assignments.')
+
+    # open the databases once, for all genomes.
+    with metrics.phase('load_databases'):
+        databases = utils.load_databases(args.databases)
+
+    # batch mode: run on many genomes, with taxonomy & databases loaded.
+    genome_list = getattr(args, 'genome_list', None)
+    if genome_list:
+        genome_names = utils.load_genome_list(genome_list)
+        print(f"loaded {len(genome_names)} genomes from '{genome_list}'")
+
+        input_dir = args.input_directory
+        output_dir = args.output_directory or input_dir
+        suffix = SUFFIXES[getattr(args, 'contigs_tax_format', 'json')]
+        for genome_name in genome_names:
+            print(f'\nworking on {genome_name}')
+            prefix = os.path.join(input_dir, genome_name)
+            json_out = os.path.join(output_dir, genome_name + suffix)
+            sketches = prefix + '.contigs.sketch'
+            if not os.path.exists(sketches):
+                sketches = None
+            with metrics.genome(genome_name):
+                status = search_genome(os.path.join(args.genome_dir, genome_name),
+                                       prefix + '.sig', prefix + '.matches.csv',
+                                       json_out, databases, tax_assign,
+                                       taxonomy, match_rank, threads, sketches,
+                                       prepared_matches_for_args(args, genome_name))
+            if status != 0:
+                return status
+
+        return 0
+
+    genome_name = os.path.basename(args.genome)
+    with metrics.genome(genome_name):
+        return search_genome(args.genome, args.genome_sig, args.matches_csv,
+                             args.json_out, databases, tax_assign, taxonomy,
+                             match_rank, threads, contig_sketches,
+                             prepared_matches_for_args(args, genome_name))
+
+
 def cmdline(sys_args):
     "Command line entry point w/argparse action."
     p = argparse.ArgumentParser(sys_args)
-    p.add_argument('--genome', help='genome file', required=True)
-    p.add_argument('--genome-sig', help='genome sig', required=True)
-    p.add_argument('--matches-csv', help='all relevant matches', required=True)
+    p.add_argument('--genome', help='genome file')
+    p.add_argument('--genome-sig', help='genome sig')
+    p.add_argument('--matches-csv', help='all relevant matches')
     p.add_argument('--databases', help='sourmash databases', required=True,
                    nargs='+')
     p.add_argument('--lineages-csv', help='lineage spreadsheet', required=True)
@@ -146,11 +169,36 @@ def cmdline(sys_args):
                    action='store_true')
 
     p.add_argument('--json-out',
-                   help='JSON-format output file of all tax results',
-                   required=True)
+                   help='output file of all contigs tax results; JSON if it ends in .json, else binary')
     p.add_argument('--match-rank', required=True)
+    p.add_argument('--threads', type=int, default=1,
+                   help='number of processes to use for classifying contigs')
+    p.add_argument('--contig-sketches',
+                   help='contig sketches for the genome, instead of rehashing it')
+    p.add_argument('--prepared-matches-dir',
+                   help='directory in which to cache prepared matches for each genome')
+
+    # batch mode
+    p.add_argument('--genome-list',
+                   help='file of genome names to run on, in batch mode')
+    p.add_argument('--genome-dir', help='directory containing genomes')
+    p.add_argument('--input-directory',
+                   help='directory containing {genome}.sig and {genome}.matches.csv')
+    p.add_argument('--output-directory',
+                   help='directory for {genome}.contigs-tax.* (default: input directory)')
+    p.add_argument('--contigs-tax-format', default='json',
+                   choices=sorted(SUFFIXES),
+                   help='format for {genome}.contigs-tax.* outputs')
+    metrics.add_argument(p)
     args = p.parse_args()
 
+    if args.genome_list:
+        if not (args.genome_dir and args.input_directory):
+            p.error('--genome-list requires --genome-dir and --input-directory')
+    elif not (args.genome and args.genome_sig and args.matches_csv and \
+              args.json_out):
+        p.error('--genome, --genome-sig, --matches-csv and --json-out are required')
+
     return main(args)
 
 
@@ -0,0 +1,303 @@
+#! /usr/bin/env python
+"""
+Contigs taxonomy (per-contig gather results), in JSON or binary format.
+
+The JSON format stores '{name: [length, num_hashes, [[lineage, count],
+...]]}' for every contig, repeating each lineage in full wherever it
+appears. The binary format interns taxon names and lineages, and stores
+the per-contig values as columns, so it is small and loads quickly;
+each lineage is built once and shared between contigs.
+
+Readers should use load_contigs_tax, which handles either format.
+
+Binary layout (little-endian; each section is padded to 8 bytes):
+
+* header - see HEADER;
+* taxon name offsets (n_names + 1 uint64) and UTF-8 name data;
+* lineage table (n_lineages x len(RANKS) int32 name ids, -1 padded);
+* contig name offsets (n_contigs + 1 uint64) and UTF-8 name data;
+* contig lengths and num_hashes (n_contigs uint64 each);
+* gather offsets (n_contigs + 1 uint64), then lineage ids (uint32) and
+  counts (uint64) for each gather result.
+"""
+import sys
+import argparse
+import json
+import os
+import struct
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+
+from sourmash.lca import LineagePair, taxlist
+
+from .version import version
+from . import metrics
+from .binary_format import pad, strings_table, write_sections
+
+
+MAGIC = b'CHCTAX01'
+RANKS = tuple(taxlist())
+
+# magic, n_contigs, n_gather, n_lineages, n_names.
+HEADER = struct.Struct('<8sQQQQ')
+
+# per-genome file suffixes, by format.
+SUFFIXES = {'json': '.contigs-tax.json', 'binary': '.contigs-tax.bin'}
+
+
+ContigGatherInfo = namedtuple('ContigGatherInfo',
+                              ['length', 'num_hashes', 'gather_tax'])
+
+
+def _array(typecode, values=()):
+    "An array of native ints; the file format is little-endian."
+    assert sys.byteorder == 'little', 'big-endian systems are not supported'
+    return array(typecode, values)
+
+
+def is_binary_contigs_tax(filename):
+    "Is this a binary contigs taxonomy file?"
+    with open(filename, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def load_contigs_tax_json(filename):
+    "Load a JSON contigs taxonomy file into a dict of ContigGatherInfo."
+    with open(filename, 'rt') as fp:
+        contigs_d = json.load(fp)
+        for k in contigs_d:
+            (size, num_hashes, v) = contigs_d[k]
+            vv = []
+            for (lin, count) in v:
+                vv.append((tuple([ LineagePair(*x) for x in lin ]), count))
+            info = ContigGatherInfo(size, num_hashes, vv)
+            contigs_d[k] = info
+
+    return contigs_d
+
+
+def save_contigs_tax_json(contigs_tax, filename):
+    "Save contigs taxonomy as JSON."
+    with open(filename, 'wt') as fp:
+        fp.write(json.dumps(dict(contigs_tax.items())))
+
+
+def save_contigs_tax_binary(contigs_tax, filename):
+    """
+    Save contigs taxonomy in the binary format.
+
+    The file is written to a temporary file and renamed into place.
+    """
+    names = {}
+    lineages = {}
+    lineage_table = _array('i')
+
+    lengths = _array('Q')
+    num_hashes = _array('Q')
+    gather_offsets = _array('Q', [0])
+    gather_lids = _array('I')
+    gather_counts = _array('Q')
+
+    for info in contigs_tax.values():
+        lengths.append(info.length)
+        num_hashes.append(info.num_hashes)
+        for lineage, count in info.gather_tax:
+            lineage = tuple(lineage)
+            lid = lineages.get(lineage)
+            if lid is None:
+                lid = len(lineages)
+                lineages[lineage] = lid
+
+                row = [-1] * len(RANKS)
+                for i, pair in enumerate(lineage):
+                    rank, name = pair
+                    assert rank == RANKS[i], (rank, RANKS[i])
+                    row[i] = names.setdefault(name, len(names))
+                lineage_table.extend(row)
+
+            gather_lids.append(lid)
+            gather_counts.append(count)
+        gather_offsets.append(len(gather_lids))
+
+    name_offsets, name_data = strings_table(names)
+    contig_offsets, contig_data = strings_table(contigs_tax)
+
+    sections = [name_offsets, name_data, lineage_table.tobytes(),
+                contig_offsets, contig_data,
+                lengths.tobytes(), num_hashes.tobytes(),
+                gather_offsets.tobytes(), gather_lids.tobytes(),
+                gather_counts.tobytes()]
+
+    header = HEADER.pack(MAGIC, len(contigs_tax), len(gather_lids),
+                         len(lineages), len(names))
+
+    write_sections(filename, header, sections)
+
+
+class ContigsTax(Mapping):
+    """
+    A read-only dictionary of contig names to ContigGatherInfo, loaded
+    from a binary contigs taxonomy file.
+
+    Behaves like the dictionary returned by load_contigs_tax_json, in
+    the same (contig) order. The columns are available directly as
+    'lengths', 'num_hashes', 'gather_offsets', 'gather_lids' and
+    'gather_counts'; 'lineages' holds the lineage for each lineage id.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+
+        if len(data) < HEADER.size:
+            raise ValueError(f"'{filename}' is not a charcoal contigs taxonomy file")
+        (magic, n_contigs, n_gather, n_lineages, n_names) = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"'{filename}' is not a charcoal contigs taxonomy file")
+
+        buf = memoryview(data)
+        pos = pad(HEADER.size)
+
+        def section(nbytes, fmt=None):
+            nonlocal pos
+            view = buf[pos:pos + nbytes]
+            pos += pad(nbytes)
+            if fmt:
+                view = view.cast(fmt)
+            return view
+
+        def strings(n):
+            offsets = section(8 * (n + 1), 'Q')
+            data = bytes(section(offsets[-1]))
+            return [ data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                     for i in range(n) ]
+
+        taxon_names = strings(n_names)
+        lineage_table = section(4 * n_lineages * len(RANKS), 'i')
+        self.names = strings(n_contigs)
+        self.lengths = section(8 * n_contigs, 'Q')
+        self.num_hashes = section(8 * n_contigs, 'Q')
+        self.gather_offsets = section(8 * (n_contigs + 1), 'Q')
+        self.gather_lids = section(4 * n_gather, 'I')
+        self.gather_counts = section(8 * n_gather, 'Q')
+
+        # build each lineage once; contigs share them.
+        self.lineages = []
+        for lid in range(n_lineages):
+            row = lineage_table[lid * len(RANKS):(lid + 1) * len(RANKS)]
+            lineage = []
+            for rank, name_id in zip(RANKS, row):
+                if name_id < 0:
+                    break
+                lineage.append(LineagePair(rank, taxon_names[name_id]))
+            self.lineages.append(tuple(lineage))
+
+        self._index = None
+
+    def _info(self, i):
+        start, end = self.gather_offsets[i], self.gather_offsets[i + 1]
+        gather_tax = [ (self.lineages[lid], count) for lid, count in
+                       zip(self.gather_lids[start:end],
+                           self.gather_counts[start:end]) ]
+        return ContigGatherInfo(self.lengths[i], self.num_hashes[i],
+                                gather_tax)
+
+    def _iter_infos(self):
+        # convert whole columns at once; much faster than per-contig.
+        lineages = self.lineages
+        gather_tax = [ (lineages[lid], count) for lid, count in
+                       zip(self.gather_lids.tolist(),
+                           self.gather_counts.tolist()) ]
+        offsets = self.gather_offsets.tolist()
+        for i, (length, num_hashes) in enumerate(zip(self.lengths.tolist(),
+                                                     self.num_hashes.tolist())):
+            yield ContigGatherInfo(length, num_hashes,
+                                   gather_tax[offsets[i]:offsets[i + 1]])
+
+    def __getitem__(self, name):
+        if self._index is None:
+            self._index = { k: i for i, k in enumerate(self.names) }
+        return self._info(self._index[name])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def items(self):
+        return zip(self.names, self._iter_infos())
+
+    def values(self):
+        return self._iter_infos()
+
+
+def load_contigs_tax(filename):
+    """
+    Load a contigs taxonomy file, in either binary or JSON format.
+
+    Returns a mapping of contig names to ContigGatherInfo.
+    """
+    if is_binary_contigs_tax(filename):
+        return ContigsTax(filename)
+    return load_contigs_tax_json(filename)
+
+
+def find_contigs_tax(directory, genome_name):
+    """
+    Find the contigs taxonomy file for a genome in a directory; binary
+    is preferred to JSON.
+    """
+    for fmt in ('binary', 'json'):
+        filename = os.path.join(directory, genome_name + SUFFIXES[fmt])
+        if os.path.exists(filename):
+            return filename
+
+    # not found; let the reader complain about the JSON filename.
+    return filename
+
+
+def save_contigs_tax(contigs_tax, filename):
+    """
+    Save contigs taxonomy; the format is chosen by the filename, with
+    JSON for '.json' and binary otherwise.
+    """
+    if filename.endswith('.json'):
+        save_contigs_tax_json(contigs_tax, filename)
+    else:
+        save_contigs_tax_binary(contigs_tax, filename)
+
+
+@metrics.record('contigs_tax', output='output')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('load_contigs_tax'):
+        contigs_tax = load_contigs_tax(args.input)
+        metrics.count('contigs', len(contigs_tax))
+    print(f"loaded {len(contigs_tax)} contig assignments from '{args.input}'")
+
+    with metrics.phase('write_outputs'):
+        save_contigs_tax(contigs_tax, args.output)
+    print(f"saved contig assignments to '{args.output}'")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('input', help='contigs taxonomy file (binary or JSON)')
+    p.add_argument('-o', '--output', required=True,
+                   help='output file; JSON if it ends in .json, else binary')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
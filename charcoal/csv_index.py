@@ -0,0 +1,305 @@
+#! /usr/bin/env python
+"""
+A sorted, memory-mapped index of the rows in a CSV file, by key column.
+
+Cleaning each genome needs one row of the cohort hit list; parsing the
+whole hit list for every genome makes cleaning N genomes O(N^2). Here
+we scan the CSV once and save, for each key value, the byte offset and
+length of its row, in a binary file next to it. Lookups mmap the index,
+binary search it for the key, and parse just that row.
+
+The index records the size, mtime, and SHA256 of the CSV, as the
+taxonomy cache does. It is built once, by the step that writes the CSV
+(`python -m charcoal.csv_index`); readers only open it, with
+open_csv_index, so that concurrent jobs never race to rebuild it.
+
+Layout (little-endian; each section is padded to 8 bytes):
+
+* header - see HEADER;
+* key column name, UTF-8;
+* key offsets (n_rows + 1 uint64), row offsets (n_rows uint64), row
+  lengths (n_rows uint64), and UTF-8 key data, sorted by key.
+"""
+import sys
+import argparse
+import csv
+import io
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+
+from . import metrics
+from .binary_format import pad, strings_table, write_sections, SortedStrings
+from .taxonomy_cache import file_stat, hash_file
+
+
+MAGIC = b'CHCSVX01'
+
+# magic, CSV size, CSV mtime (ns), CSV sha256, n_rows, length of the CSV
+# header row in bytes, length of the key column name.
+HEADER = struct.Struct('<8sQq32sQQQ')
+
+INDEX_SUFFIX = '.idx'
+
+
+def _parse_row(data):
+    "Parse the fields of a single CSV row."
+    return next(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+
+
+def iter_csv_rows(fp):
+    """
+    Scan a CSV file object (binary); yield (offset, length, fields) for
+    each row, including the header. Rows may span lines, w/quoted
+    newlines.
+    """
+    offset = 0
+    start = 0
+    lines = []
+    n_quotes = 0
+    for line in fp:
+        lines.append(line)
+        offset += len(line)
+        n_quotes += line.count(b'"')
+        if n_quotes % 2 == 0:            # not inside a quoted field
+            data = b''.join(lines)
+            if data.strip():
+                yield start, len(data), _parse_row(data)
+            start = offset
+            lines = []
+            n_quotes = 0
+
+    if lines and b''.join(lines).strip():
+        raise ValueError('unterminated quoted field at end of CSV')
+
+
+def build_csv_index(csv_filename, key, index_filename):
+    """
+    Index the rows of 'csv_filename' by the values in column 'key', and
+    save it to 'index_filename'. Raises ValueError if the key column is
+    missing or a value is duplicated, as CSV_DictHelper does.
+
+    The file is written to a temporary file and renamed into place, so
+    concurrent readers never see a partial index.
+    """
+    csv_size, csv_mtime = file_stat(csv_filename)
+    csv_hash = hash_file(csv_filename)
+
+    rows = {}
+    header_len = 0
+    with open(csv_filename, 'rb') as fp:
+        records = iter_csv_rows(fp)
+        for offset, length, fieldnames in records:
+            header_len = offset + length
+            break
+        else:
+            raise ValueError(f"no CSV header in '{csv_filename}'")
+
+        if key not in fieldnames:
+            raise ValueError(f"no column '{key}' in '{csv_filename}'")
+        key_idx = fieldnames.index(key)
+
+        for offset, length, fields in records:
+            keyval = fields[key_idx]
+            if keyval in rows:
+                raise ValueError(f"duplicate key value {key}='{keyval}'")
+            rows[keyval] = (offset, length)
+
+    keys = sorted(rows, key=lambda x: x.encode('utf-8'))
+    key_offsets, key_data = strings_table(keys)
+    key_name = key.encode('utf-8')
+
+    sections = [key_name, key_offsets,
+                struct.pack(f'<{len(keys)}Q', *[ rows[k][0] for k in keys ]),
+                struct.pack(f'<{len(keys)}Q', *[ rows[k][1] for k in keys ]),
+                key_data]
+
+    header = HEADER.pack(MAGIC, csv_size, csv_mtime, csv_hash, len(keys),
+                         header_len, len(key_name))
+
+    write_sections(index_filename, header, sections)
+
+
+def _update_csv_mtime(index_filename, csv_mtime):
+    "Record a new CSV mtime in the index header, after a hash match."
+    with open(index_filename, 'r+b') as fp:
+        fp.seek(16)                       # after magic & CSV size
+        fp.write(struct.pack('<q', csv_mtime))
+
+
+class CSVIndex:
+    """
+    A read-only, memory-mapped index of the rows in a CSV file.
+
+    'get' returns the row for a key value as a dictionary, like the
+    rows of csv.DictReader.
+    """
+    def __init__(self, csv_filename, index_filename):
+        self.csv_filename = csv_filename
+        self.filename = index_filename
+        with open(index_filename, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buf = memoryview(self._mm)
+        if len(buf) < HEADER.size:
+            raise ValueError(f"'{index_filename}' is not a charcoal CSV index")
+
+        (magic, self.csv_size, self.csv_mtime, self.csv_hash, self.n_rows,
+         self.header_len, key_len) = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError(f"'{index_filename}' is not a charcoal CSV index")
+
+        pos = pad(HEADER.size)
+
+        def section(nbytes, fmt=None):
+            nonlocal pos
+            view = buf[pos:pos + nbytes]
+            pos += pad(nbytes)
+            if fmt:
+                view = view.cast(fmt)
+            return view
+
+        self.key = str(section(key_len), 'utf-8')
+        key_offsets = section(8 * (self.n_rows + 1), 'Q')
+        self._row_offsets = section(8 * self.n_rows, 'Q')
+        self._row_lengths = section(8 * self.n_rows, 'Q')
+        key_data = section(key_offsets[-1])
+
+        self._keys = SortedStrings(key_data, key_offsets, self.n_rows)
+        self._fieldnames = None
+
+    def is_valid_for(self, csv_filename, key):
+        """
+        Check that this index was built from the given CSV, for 'key'.
+
+        If size & mtime match, the index is valid; if only the size
+        matches, fall back to comparing the content hash.
+        """
+        if key != self.key:
+            return False
+        size, mtime = file_stat(csv_filename)
+        if size != self.csv_size:
+            return False
+        if mtime == self.csv_mtime:
+            return True
+        return hash_file(csv_filename) == self.csv_hash
+
+    def _read(self, offset, length):
+        with open(self.csv_filename, 'rb') as fp:
+            fp.seek(offset)
+            return fp.read(length)
+
+    @property
+    def fieldnames(self):
+        if self._fieldnames is None:
+            self._fieldnames = _parse_row(self._read(0, self.header_len))
+        return self._fieldnames
+
+    def get(self, keyval):
+        "Return the row for 'keyval' as a dictionary, or None."
+        if not isinstance(keyval, str):
+            return None
+
+        k = keyval.encode('utf-8')
+        i = bisect_left(self._keys, k)
+        if i == len(self._keys) or self._keys[i] != k:
+            return None
+
+        fields = _parse_row(self._read(self._row_offsets[i],
+                                       self._row_lengths[i]))
+        fieldnames = self.fieldnames
+        fields += [None] * (len(fieldnames) - len(fields))
+        return dict(zip(fieldnames, fields))
+
+    def __contains__(self, keyval):
+        return self.get(keyval) is not None
+
+    def __len__(self):
+        return self.n_rows
+
+
+def open_csv_index(csv_filename, key, index_filename=None):
+    """
+    Return the CSVIndex of 'csv_filename' by column 'key', or None if
+    it is missing or stale. Never writes the index.
+
+    The index defaults to '{csv_filename}.idx'.
+    """
+    if index_filename is None:
+        index_filename = csv_filename + INDEX_SUFFIX
+
+    try:
+        index = CSVIndex(csv_filename, index_filename)
+    except (OSError, ValueError):
+        return None
+
+    if index.is_valid_for(csv_filename, key):
+        return index
+    return None
+
+
+def load_csv_index(csv_filename, key, index_filename=None):
+    """
+    Return a CSVIndex of 'csv_filename' by column 'key', building it
+    first if it is missing or stale.
+
+    The index defaults to '{csv_filename}.idx'. If it can't be written,
+    it is built in a temporary directory instead.
+    """
+    if index_filename is None:
+        index_filename = csv_filename + INDEX_SUFFIX
+
+    index = open_csv_index(csv_filename, key, index_filename)
+    if index is not None:
+        # CSV touched but not changed? skip the hash next time.
+        _, csv_mtime = file_stat(csv_filename)
+        if csv_mtime != index.csv_mtime:
+            try:
+                _update_csv_mtime(index_filename, csv_mtime)
+                index.csv_mtime = csv_mtime
+            except OSError:
+                pass
+        return index
+
+    try:
+        build_csv_index(csv_filename, key, index_filename)
+    except OSError as exc:
+        print(f"cannot write CSV index '{index_filename}': {exc}")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_filename = os.path.join(tmpdir, 'csv.idx')
+            build_csv_index(csv_filename, key, index_filename)
+            return CSVIndex(csv_filename, index_filename)
+
+    return CSVIndex(csv_filename, index_filename)
+
+
+@metrics.record('csv_index',
+                output=lambda args: args.output or args.csv + INDEX_SUFFIX)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('index_csv'):
+        index = load_csv_index(args.csv, args.key, args.output)
+        metrics.count('rows', len(index))
+    print(f"indexed {len(index)} rows of '{args.csv}' by '{args.key}'.")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('csv', help='CSV file to index')
+    p.add_argument('--key', default='genome', help='column to index by')
+    p.add_argument('-o', '--output', help='index file (default: {csv}.idx)')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,300 @@
+#! /usr/bin/env python
+"""
+Download genomes from NCBI, for the info CSVs made by genbank_genomes.
+
+Each genome is streamed in chunks to '{output}.part', and renamed into
+place once it is complete and its MD5 matches the one in NCBI's
+'md5checksums.txt' for the assembly; a killed download never leaves a
+truncated genome behind. A download that was interrupted is resumed
+from the end of its '.part' file w/an HTTP Range request.
+
+Several genomes can be downloaded at once w/--jobs; each worker keeps
+its connection to NCBI alive between downloads.
+
+With --genome-cache, genomes are downloaded into a cache shared between
+projects, if they're not there already, and the outputs are linked to
+the cached files; see genome_cache.
+"""
+import sys
+import argparse
+import csv
+import hashlib
+import http.client
+import os
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .combine_csvs import load_file_list
+from .genbank_genomes import Fetcher
+from .genome_cache import open_cache, link_genome
+
+
+PART_SUFFIX = '.part'
+MD5_FILENAME = 'md5checksums.txt'
+
+CHUNK_SIZE = 1024**2
+DEFAULT_JOBS = 4
+DEFAULT_RETRIES = 3
+
+
+class DownloadError(Exception):
+    pass
+
+
+def load_info_csv(filename):
+    "Load the row from a genbank_genomes info CSV."
+    with open(filename, 'rt', newline='') as fp:
+        rows = list(csv.DictReader(fp))
+    if len(rows) != 1:
+        raise DownloadError(f"expected one genome in '{filename}', found {len(rows)}")
+    return rows[0]
+
+
+def parse_md5checksums(content):
+    "Parse an NCBI 'md5checksums.txt'; returns { filename: md5 }."
+    md5sums = {}
+    for line in content.decode('utf-8').splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            md5, filename = fields
+            md5sums[os.path.basename(filename)] = md5.lower()
+    return md5sums
+
+
+def get_expected_md5(url, fetcher):
+    "The MD5 for 'url' from the md5checksums.txt next to it; None if missing."
+    md5_url = url.rsplit('/', 1)[0] + '/' + MD5_FILENAME
+    try:
+        md5sums = parse_md5checksums(fetcher.get(md5_url))
+    except (OSError, http.client.HTTPException) as exc:
+        print(f"cannot get checksums from '{md5_url}': {exc}", file=sys.stderr)
+        return None
+    return md5sums.get(os.path.basename(url))
+
+
+def _hash_file(filename, chunk_size=CHUNK_SIZE):
+    "MD5 & size of a (partial) file."
+    h = hashlib.md5()
+    size = 0
+    with open(filename, 'rb') as fp:
+        while 1:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+    return h, size
+
+
+def _expected_size(response, offset):
+    "The full size of the file being downloaded, if the server says."
+    if response.status == 206:
+        content_range = response.headers.get('Content-Range', '')
+        start = content_range.split()[-1].split('-')[0] if content_range else ''
+        if start != str(offset):
+            raise DownloadError(f"server resumed at the wrong offset: '{content_range}'")
+        total = content_range.rsplit('/', 1)[-1]
+    else:
+        total = response.headers.get('Content-Length')
+    if total and total.isdigit():
+        return int(total)
+    return None
+
+
+def download_file(url, filename, fetcher, md5=None, chunk_size=CHUNK_SIZE):
+    """
+    Download 'url' to 'filename', resuming from '{filename}.part' if it
+    exists. Returns the number of bytes transferred.
+
+    Raises DownloadError if the download is incomplete (the partial file
+    is kept, to resume) or the MD5 doesn't match (the partial file is
+    removed).
+    """
+    part = filename + PART_SUFFIX
+    h, offset = hashlib.md5(), 0
+    if os.path.exists(part):
+        h, offset = _hash_file(part, chunk_size)
+
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+
+    response = fetcher.open(url, headers)
+    try:
+        if response.status == 416 and offset:      # nothing more to get
+            response.read()
+            expected = offset
+            mode = 'ab'
+        elif response.status == 206 and offset:
+            expected = _expected_size(response, offset)
+            mode = 'ab'
+        elif response.status == 200:                # (re)start
+            h, offset = hashlib.md5(), 0
+            expected = _expected_size(response, offset)
+            mode = 'wb'
+        else:
+            response.read()
+            raise urllib.error.HTTPError(url, response.status,
+                                         f'cannot download {url}',
+                                         response.headers, None)
+
+        n_read = 0
+        with open(part, mode) as fp:
+            while 1:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                fp.write(chunk)
+                h.update(chunk)
+                n_read += len(chunk)
+    except BaseException:
+        fetcher.discard(url)
+        raise
+
+    size = offset + n_read
+    if expected is not None and size != expected:
+        fetcher.discard(url)
+        raise DownloadError(f"incomplete download of '{url}': got {size} of {expected} bytes")
+
+    if md5 is not None and h.hexdigest() != md5:
+        os.unlink(part)
+        raise DownloadError(f"MD5 mismatch for '{url}': expected {md5}, got {h.hexdigest()}")
+
+    os.replace(part, filename)
+    return n_read
+
+
+def download_genome(info, filename, fetcher, retries=DEFAULT_RETRIES,
+                    chunk_size=CHUNK_SIZE):
+    """
+    Download the genome for an info CSV row to 'filename', verified
+    against NCBI's checksums; retry (resuming) on errors. Returns the
+    number of bytes transferred, and the MD5 from NCBI (or None).
+    """
+    url = info['genome_url']
+    md5 = get_expected_md5(url, fetcher)
+    if md5 is None:
+        print(f"no MD5 checksum for '{url}'; not verifying it.",
+              file=sys.stderr)
+
+    n_bytes = 0
+    for attempt in range(1, retries + 1):
+        try:
+            n_bytes += download_file(url, filename, fetcher, md5, chunk_size)
+            return n_bytes, md5
+        except urllib.error.HTTPError:
+            raise
+        except (OSError, http.client.HTTPException, DownloadError) as exc:
+            if attempt == retries:
+                raise
+            print(f"retrying '{url}' after error: {exc}", file=sys.stderr)
+
+
+@metrics.record('download_genomes', output='output')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    info_csvs = list(args.info_csvs)
+    if args.info_list:
+        info_csvs += load_file_list(args.info_list)
+    if not info_csvs:
+        print("no info CSVs given.", file=sys.stderr)
+        return -1
+    if args.output and len(info_csvs) > 1:
+        print("use --output-dir w/more than one genome.", file=sys.stderr)
+        return -1
+    if not args.output and not args.output_dir:
+        print("please specify --output or --output-dir.", file=sys.stderr)
+        return -1
+
+    jobs = []
+    for info_csv in info_csvs:
+        info = load_info_csv(info_csv)
+        if args.output:
+            filename = args.output
+        else:
+            filename = os.path.join(args.output_dir,
+                                    f"{info['acc']}_genomic.fna.gz")
+        jobs.append((info, filename))
+
+    fetcher = Fetcher()
+    cache = None
+    if args.genome_cache:
+        cache = open_cache(args.genome_cache, args.cache_max_gb)
+
+    def download_to_cache(info, filename):
+        "Download a genome into the cache unless it's there; link to it."
+        acc = info['acc']
+        n_bytes = 0
+        # one download per accession, across jobs & projects.
+        with cache.lock(f'acc-{acc}'):
+            cached = cache.get(acc)
+            if cached is None:
+                tmpname = cache.tmp_filename(acc)
+                n_bytes, md5 = download_genome(info, tmpname, fetcher,
+                                               args.retries)
+                cached = cache.add(acc, tmpname, md5)
+        link_genome(cached, filename)
+        return n_bytes
+
+    def download(job):
+        info, filename = job
+        if os.path.exists(filename):
+            return info, filename, 0, None
+        try:
+            if cache is not None:
+                n_bytes = download_to_cache(info, filename)
+            else:
+                n_bytes, _ = download_genome(info, filename, fetcher,
+                                             args.retries)
+        except (OSError, http.client.HTTPException, DownloadError) as exc:
+            return info, filename, 0, exc
+        return info, filename, n_bytes, None
+
+    n_failed = 0
+    with metrics.phase('download'):
+        n_threads = max(1, min(args.jobs, len(jobs)))
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for info, filename, n_bytes, error in executor.map(download, jobs):
+                name = info.get('ncbi_tax_name', '')
+                if error is not None:
+                    print(f"cannot download genome for {info['acc']}/{name}: {error}", file=sys.stderr)
+                    n_failed += 1
+                    continue
+                metrics.count('bytes', n_bytes)
+                metrics.count('genomes')
+                print(f"downloaded genome for acc {info['acc']}/{name}: wrote {n_bytes} bytes to {filename}")
+
+    if n_failed:
+        return -1
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('info_csvs', nargs='*',
+                   help='info CSVs from genbank_genomes')
+    p.add_argument('--info-list',
+                   help="file w/info CSV names, one per line; '-' for stdin")
+    p.add_argument('-o', '--output', help='genome file (for one genome)')
+    p.add_argument('--output-dir',
+                   help="directory for '{acc}_genomic.fna.gz' files")
+    p.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                   help='number of genomes to download at once')
+    p.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                   help='attempts per genome')
+    p.add_argument('--genome-cache',
+                   help='shared genome cache directory; see genome_cache')
+    p.add_argument('--cache-max-gb', type=float,
+                   help='evict least recently used genomes from the cache beyond this size')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
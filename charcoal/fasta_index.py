@@ -0,0 +1,251 @@
+"""
+Byte offsets of the records in a FASTA file, for copying them unparsed.
+
+Cleaning a genome only decides which output each contig goes to; the
+sequence itself is never looked at. So rather than parsing each record
+into Python strings and writing it back out, we find where each record
+starts and ends, and copy those bytes directly to the output. Only the
+header lines are decoded.
+
+For an uncompressed FASTA file the offsets can be saved to a file in
+the output directory, e.g. '{genome}.offsets', and reused while the
+FASTA file's size and mtime are unchanged; the input directory is never
+written to. Records are copied out of an mmap of the file, or with
+os.sendfile when the output is uncompressed, too. Compressed files
+can't be seeked, so they are scanned in a single streaming pass.
+
+The offsets file is tab-separated: a '#charcoal-fasta-offsets' line
+with the FASTA size and mtime, then one line per record with the fields
+of FastaRecordOffsets.
+"""
+import gzip
+import mmap
+import os
+import tempfile
+from collections import namedtuple
+
+from .taxonomy_cache import file_stat
+
+
+OFFSETS_SUFFIX = '.offsets'
+
+_OFFSETS_MAGIC = '#charcoal-fasta-offsets'
+
+# size of the reads when scanning a FASTA file.
+CHUNK_SIZE = 4*1024*1024
+
+
+# 'name' is as screed reports it; 'start', 'seq_start' and 'end' are byte
+# offsets of the '>', the sequence, and the end of the record (after its
+# last newline). 'linebases' & 'linewidth' are for the first sequence
+# line, as in a samtools '.fai' file.
+FastaRecordOffsets = namedtuple('FastaRecordOffsets',
+                                ['name', 'length', 'start', 'seq_start',
+                                 'end', 'linebases', 'linewidth'])
+
+
+def is_compressed(filename):
+    "Is this a gzip (or BGZF) file?"
+    with open(filename, 'rb') as fp:
+        return fp.read(2) == b'\x1f\x8b'
+
+
+def _record_offsets(buf, pos, end, base):
+    "Describe the record in buf[pos:end]; 'base' is the offset of buf[0]."
+    hdr_end = buf.find(b'\n', pos, end)
+    if hdr_end < 0:
+        hdr_end = seq_start = end
+    else:
+        seq_start = hdr_end + 1
+
+    name = buf[pos + 1:hdr_end].decode('utf-8').strip()
+
+    # sequence length, w/o line endings.
+    n_eol = buf.count(b'\n', seq_start, end) + buf.count(b'\r', seq_start, end)
+    length = end - seq_start - n_eol
+
+    line_end = buf.find(b'\n', seq_start, end)
+    if line_end < 0:
+        linewidth = linebases = end - seq_start
+    else:
+        linewidth = line_end + 1 - seq_start
+        linebases = len(buf[seq_start:line_end].rstrip(b'\r'))
+
+    return FastaRecordOffsets(name, length, base + pos, base + seq_start,
+                              base + end, linebases, linewidth)
+
+
+def iter_fasta_records(fp, with_data=True, chunk_size=CHUNK_SIZE):
+    """
+    Scan a FASTA file object (binary); yield (FastaRecordOffsets, data)
+    for each record, where 'data' is the raw bytes of the record (or
+    None, unless 'with_data'). Blank lines before the first record are
+    skipped.
+    """
+    buf = bytearray()
+    base = 0                              # file offset of buf[0]
+    pos = 0                               # start of the current record
+    search = 0                            # where to look for the next one
+    eof = False
+
+    # skip leading blank lines.
+    while 1:
+        data = fp.read(chunk_size)
+        if not data:
+            return
+        stripped = data.lstrip()
+        base += len(data) - len(stripped)
+        if stripped:
+            buf += stripped
+            break
+
+    while 1:
+        if pos < len(buf) and buf[pos:pos + 1] != b'>':
+            raise ValueError(f"Bad FASTA format: no '>' at offset {base + pos}")
+
+        idx = buf.find(b'\n>', max(search, pos))
+        if idx >= 0:
+            end = idx + 1
+        elif not eof:
+            # need more data; drop the records we're done with first.
+            del buf[:pos]
+            base += pos
+            search = max(len(buf) - 1, 0)
+            pos = 0
+
+            data = fp.read(chunk_size)
+            if data:
+                buf += data
+            else:
+                eof = True
+            continue
+        else:
+            end = len(buf)
+            if pos == end:
+                return
+
+        offsets = _record_offsets(buf, pos, end, base)
+        yield offsets, bytes(buf[pos:end]) if with_data else None
+        pos = search = end
+
+
+def save_offsets(offsets, fasta_size, fasta_mtime, filename):
+    "Save record offsets for a FASTA file; written to a temp file & renamed."
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wt') as fp:
+            fp.write(f'{_OFFSETS_MAGIC}\t{fasta_size}\t{fasta_mtime}\n')
+            for x in offsets:
+                fp.write('\t'.join(map(str, x)) + '\n')
+        os.chmod(tmpname, 0o644)          # mkstemp files are private
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+def load_offsets(filename, fasta_size, fasta_mtime):
+    "Load record offsets, or return None if missing or out of date."
+    try:
+        with open(filename, 'rt') as fp:
+            header = fp.readline().rstrip('\n').split('\t')
+            if header != [_OFFSETS_MAGIC, str(fasta_size), str(fasta_mtime)]:
+                return None
+
+            offsets = []
+            for line in fp:
+                name, *values = line.rstrip('\n').split('\t')
+                offsets.append(FastaRecordOffsets(name, *map(int, values)))
+    except (OSError, ValueError, TypeError):
+        return None
+
+    return offsets
+
+
+def load_or_build_offsets(fasta_filename, offsets_filename=None):
+    """
+    Return the record offsets for an uncompressed FASTA file, from
+    'offsets_filename' if given and up to date. Otherwise scan the file,
+    and save the offsets to 'offsets_filename' if possible; if not, they
+    are only kept in memory.
+    """
+    size, mtime = file_stat(fasta_filename)
+    if offsets_filename:
+        offsets = load_offsets(offsets_filename, size, mtime)
+        if offsets is not None:
+            return offsets
+
+    with open(fasta_filename, 'rb') as fp:
+        offsets = [ x for x, _ in iter_fasta_records(fp, with_data=False) ]
+
+    if not offsets_filename:
+        return offsets
+
+    try:
+        save_offsets(offsets, size, mtime, offsets_filename)
+    except OSError as exc:
+        print(f"cannot save FASTA offsets to '{offsets_filename}': {exc}")
+
+    return offsets
+
+
+class RawFasta:
+    """
+    The records of a FASTA file, as offsets & raw bytes.
+
+    Iterate to get the FastaRecordOffsets for each record, in order, and
+    use 'copy_record' to write a record to a FastaWriter. The offsets of
+    an uncompressed file are saved to & reused from 'offsets_filename',
+    if given.
+    """
+    def __init__(self, filename, offsets_filename=None):
+        self.filename = filename
+        self.compressed = is_compressed(filename)
+        self._fp = None
+        self._mm = None
+        self._current = None
+
+        if self.compressed:
+            self._fp = gzip.open(filename, 'rb')
+        else:
+            self.offsets = load_or_build_offsets(filename, offsets_filename)
+            self._fp = open(filename, 'rb')
+            if os.fstat(self._fp.fileno()).st_size:
+                self._mm = mmap.mmap(self._fp.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        if self.compressed:
+            for offsets, data in iter_fasta_records(self._fp):
+                self._current = (offsets, data)
+                yield offsets
+            self._current = None
+        else:
+            yield from self.offsets
+
+    def data(self, offsets):
+        "The raw bytes of a record."
+        if self.compressed:
+            current_offsets, data = self._current
+            assert offsets is current_offsets, 'records must be read in order'
+            return data
+        return self._mm[offsets.start:offsets.end]
+
+    def copy_record(self, offsets, writer):
+        "Write a record to a FastaWriter, w/o parsing it."
+        if not self.compressed and writer.codec == 'none':
+            writer.copy_raw_record(offsets, self._fp.fileno())
+        else:
+            writer.write_raw_record(offsets, self.data(offsets))
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,249 @@
+"""
+FASTA output, compressed in parallel.
+
+'.gz' files are written as BGZF - gzip made of independent blocks of up
+to 64 kB, which any gzip reader can read - so that blocks can be
+compressed on several threads, and so that downstream tools (e.g.
+'samtools faidx') can seek without decompressing the whole file. Along
+with the FASTA file we write a '.fai' index of the records and, for
+BGZF, a '.gzi' index of the blocks, in the samtools/htslib formats.
+
+'.zst' files are compressed with zstd, if the optional 'zstandard'
+module is installed; these are not indexed. Anything else is written
+uncompressed, with a '.fai' index.
+"""
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+CODECS = ('bgzf', 'zstd', 'none')
+
+DEFAULT_LEVELS = { 'bgzf': 6, 'zstd': 3, 'none': None }
+
+# uncompressed bytes per BGZF block, as in htslib; the compressed block
+# (with header & footer) must fit in 64 kB, even if incompressible.
+BGZF_BLOCK_SIZE = 0xff00
+
+# the empty block that ends every BGZF file.
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# gzip header with the BGZF 'BC' extra field; then the block size - 1.
+_BGZF_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+
+# size of the buffer for the output file.
+WRITE_BUFFER_SIZE = 1024*1024
+
+
+def codec_for_filename(filename):
+    "Pick the codec from the filename: '.gz' => BGZF, '.zst' => zstd."
+    if filename.endswith('.gz'):
+        return 'bgzf'
+    if filename.endswith('.zst'):
+        return 'zstd'
+    return 'none'
+
+
+def compress_bgzf_block(data, level):
+    "Compress up to BGZF_BLOCK_SIZE bytes into a single BGZF block."
+    assert len(data) <= BGZF_BLOCK_SIZE
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    footer = struct.pack('<II', zlib.crc32(data), len(data))
+    bsize = len(_BGZF_HEADER) + 2 + len(cdata) + len(footer)
+    return _BGZF_HEADER + struct.pack('<H', bsize - 1) + cdata + footer
+
+
+class _BGZFOutput:
+    """
+    Compress data into BGZF blocks on a pool of threads, and write the
+    blocks in order. Records the (compressed, uncompressed) offset at
+    the start of each block after the first, for the '.gzi' index.
+    """
+    def __init__(self, fp, threads, level):
+        self.fp = fp
+        self.level = level
+        self.buf = bytearray()
+        self.coffset = 0
+        self.uoffset = 0
+        self.block_offsets = []
+
+        self.pool = None
+        self.pending = deque()
+        self.max_pending = 4 * threads
+        if threads > 1:
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= BGZF_BLOCK_SIZE:
+            n_full = len(self.buf) - len(self.buf) % BGZF_BLOCK_SIZE
+            for start in range(0, n_full, BGZF_BLOCK_SIZE):
+                self._submit(bytes(self.buf[start:start + BGZF_BLOCK_SIZE]))
+            del self.buf[:n_full]
+
+    def _submit(self, data):
+        if self.pool is None:
+            self._write_block(compress_bgzf_block(data, self.level), len(data))
+            return
+
+        future = self.pool.submit(compress_bgzf_block, data, self.level)
+        self.pending.append((future, len(data)))
+        while len(self.pending) > self.max_pending:
+            self._write_pending()
+
+    def _write_pending(self):
+        future, size = self.pending.popleft()
+        self._write_block(future.result(), size)
+
+    def _write_block(self, block, size):
+        self.fp.write(block)
+        self.coffset += len(block)
+        self.uoffset += size
+        self.block_offsets.append((self.coffset, self.uoffset))
+
+    def close(self):
+        if self.buf:
+            self._submit(bytes(self.buf))
+            self.buf = bytearray()
+        while self.pending:
+            self._write_pending()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.fp.write(BGZF_EOF)
+        self.fp.close()
+
+
+def _zstd_output(fp, threads, level):
+    "A zstd stream writer around 'fp'; requires the 'zstandard' module."
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("writing '.zst' files requires the 'zstandard' module")
+
+    cctx = zstandard.ZstdCompressor(level=level,
+                                    threads=threads if threads > 1 else 0)
+    return cctx.stream_writer(fp)
+
+
+def save_fai(entries, filename):
+    "Save (name, length, offset, linebases, linewidth) as a '.fai' file."
+    with open(filename, 'wt') as fp:
+        for entry in entries:
+            fp.write('\t'.join(map(str, entry)) + '\n')
+
+
+def save_gzi(block_offsets, filename):
+    "Save BGZF (compressed, uncompressed) block offsets as a '.gzi' file."
+    with open(filename, 'wb') as fp:
+        fp.write(struct.pack('<Q', len(block_offsets)))
+        for coffset, uoffset in block_offsets:
+            fp.write(struct.pack('<QQ', coffset, uoffset))
+
+
+class FastaWriter:
+    """
+    Write FASTA records to a file, compressed according to its name.
+
+    Sequences are written on a single line, or copied as they are with
+    write_raw_record/copy_raw_record. 'threads' compress BGZF
+    blocks (or zstd frames) in parallel; 'level' is the compression
+    level for the codec. When closed, '{filename}.fai' and, for BGZF,
+    '{filename}.gzi' are written unless 'index' is False.
+    """
+    def __init__(self, filename, threads=1, level=None, index=True):
+        self.filename = filename
+        self.codec = codec_for_filename(filename)
+        if level is None:
+            level = DEFAULT_LEVELS[self.codec]
+
+        fp = open(filename, 'wb', buffering=WRITE_BUFFER_SIZE)
+        if self.codec == 'bgzf':
+            self._out = _BGZFOutput(fp, threads, level)
+        elif self.codec == 'zstd':
+            self._out = _zstd_output(fp, threads, level)
+        else:
+            self._out = fp
+
+        self.index = index and self.codec != 'zstd'
+        self._fai = []
+        self._offset = 0
+        self.closed = False
+
+    def write_record(self, name, sequence):
+        "Write a single FASTA record."
+        header = f'>{name}\n'.encode('utf-8')
+        data = header + sequence.encode('ascii') + b'\n'
+        length = len(sequence)
+        self._add_fai(name, length, len(header), length, length + 1)
+        self._out.write(data)
+        self._offset += len(data)
+
+    def write_raw_record(self, offsets, data):
+        """
+        Write the raw bytes of a record, as found by fasta_index;
+        'offsets' is its FastaRecordOffsets.
+        """
+        self._add_raw_fai(offsets)
+        self._out.write(data)
+        self._offset += len(data)
+        if not data.endswith(b'\n'):     # last record, w/o a newline
+            self._out.write(b'\n')
+            self._offset += 1
+
+    def copy_raw_record(self, offsets, in_fd):
+        """
+        Copy the raw bytes of a record straight from an uncompressed
+        file, with os.sendfile where available. Only for uncompressed
+        output.
+        """
+        assert self.codec == 'none'
+        if not hasattr(os, 'sendfile'):
+            data = os.pread(in_fd, offsets.end - offsets.start, offsets.start)
+            self.write_raw_record(offsets, data)
+            return
+
+        self._add_raw_fai(offsets)
+        self._out.flush()
+        out_fd = self._out.fileno()
+        pos, end = offsets.start, offsets.end
+        while pos < end:
+            sent = os.sendfile(out_fd, in_fd, pos, end - pos)
+            if not sent:
+                raise OSError(f"unexpected end of input copying '{offsets.name}'")
+            pos += sent
+        self._offset += end - offsets.start
+
+        if os.pread(in_fd, 1, end - 1) != b'\n':  # last record, w/o a newline
+            self._out.write(b'\n')
+            self._offset += 1
+
+    def _add_raw_fai(self, offsets):
+        self._add_fai(offsets.name, offsets.length,
+                      offsets.seq_start - offsets.start,
+                      offsets.linebases, offsets.linewidth)
+
+    def _add_fai(self, name, length, seq_offset, linebases, linewidth):
+        if self.index:
+            fai_name = name.split()[0] if name.strip() else name
+            self._fai.append((fai_name, length, self._offset + seq_offset,
+                              linebases, linewidth))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._out.close()
+
+        if self.index:
+            save_fai(self._fai, self.filename + '.fai')
+            if self.codec == 'bgzf':
+                save_gzi(self._out.block_offsets, self.filename + '.gzi')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,34 +1,217 @@
 #! /usr/bin/env python
 """
-TODO:
-* only get filenames for accs that are not already in output
+Get the genome URLs and NCBI taxonomic names for GenBank/RefSeq accessions.
+
+Each accession takes three requests to NCBI: the genome directory
+listing, the assembly report, and the taxonomy page. Many accessions
+can be resolved at once, with --jobs of them in flight; each worker
+thread keeps its connections to NCBI alive between requests. Responses
+can be cached on disk w/--cache-dir, and are reused until they are
+older than --cache-max-age days.
+
+With --accession-index, accessions are resolved offline instead; see
+accession_index. With --genome-cache, the info for each accession is
+kept in a cache shared between projects; see genome_cache.
 """
 import sys
 import argparse
-import urllib.request
 import csv
+import hashlib
+import http.client
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 from lxml import etree
 
+from . import metrics
+from .accession_index import AccessionIndex
+from .combine_csvs import load_file_list
+from .genome_cache import GenomeCache
+
+
+NCBI_GENOMES_URL = "https://ftp.ncbi.nlm.nih.gov/genomes/all"
+NCBI_TAXONOMY_URL = "https://www.ncbi.nlm.nih.gov/taxonomy/"
+
+INFO_FIELDNAMES = ["acc", "genome_url", "assembly_report_url", "ncbi_tax_name"]
+
+DEFAULT_JOBS = 8
+DEFAULT_CACHE_MAX_AGE = 30                # days
+TIMEOUT = 60                              # seconds
+MAX_REDIRECTS = 5
+
+
+class ResponseCache:
+    """
+    Responses saved on disk by URL, in files named by the URL's SHA256.
+    Responses older than 'max_age' seconds are ignored.
+    """
+    def __init__(self, dirname, max_age):
+        self.dirname = dirname
+        self.max_age = max_age
+        os.makedirs(dirname, exist_ok=True)
+
+    def _filename(self, url):
+        return os.path.join(self.dirname,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def get(self, url):
+        "Return the cached response for 'url', or None."
+        filename = self._filename(url)
+        try:
+            if time.time() - os.stat(filename).st_mtime > self.max_age:
+                return None
+            with open(filename, 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def put(self, url, content):
+        "Save a response; written atomically, for concurrent fetchers."
+        fd, tmpname = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            os.replace(tmpname, self._filename(url))
+        finally:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+
+
+class Fetcher:
+    """
+    Fetch URLs over HTTP(S), w/one keep-alive connection per host for
+    each thread, and an optional ResponseCache.
+    """
+    def __init__(self, cache=None, timeout=TIMEOUT):
+        self.cache = cache
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.n_cached = 0
+
+    def _connection(self, scheme, netloc):
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == 'http':
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise ValueError(f"cannot fetch '{scheme}' URLs")
+            conns[(scheme, netloc)] = conn
+        return conn
+
+    def open(self, url, headers=None):
+        """
+        GET a URL, following redirects. Returns the http.client response;
+        read it to the end before the next request on this thread, or
+        call 'discard'.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            with self._lock:
+                self.n_requests += 1
+            u = urllib.parse.urlsplit(url)
+            path = u.path or '/'
+            if u.query:
+                path += '?' + u.query
+
+            conn = self._connection(u.scheme, u.netloc)
+            # the server may have closed an idle connection; retry once.
+            for attempt in (1, 2):
+                try:
+                    conn.request('GET', path, headers=headers or {})
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected,
+                        http.client.BadStatusLine,
+                        http.client.ImproperConnectionState,
+                        ConnectionError):
+                    conn.close()
+                    if attempt == 2:
+                        raise
+
+            location = response.headers.get('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return response
+
+        return response
+
+    def discard(self, url):
+        "Close this thread's connection to the host of 'url', e.g. after an error."
+        u = urllib.parse.urlsplit(url)
+        conn = getattr(self._local, 'conns', {}).get((u.scheme, u.netloc))
+        if conn is not None:
+            conn.close()
+
+    def get(self, url):
+        "Return the content at 'url', from the cache if possible."
+        if self.cache is not None:
+            content = self.cache.get(url)
+            if content is not None:
+                with self._lock:
+                    self.n_cached += 1
+                return content
+
+        response = self.open(url)
+        content = response.read()
+        if response.status != 200:
+            raise urllib.error.HTTPError(url, response.status,
+                                         f'cannot fetch {url}',
+                                         response.headers, None)
+
+        if self.cache is not None:
+            self.cache.put(url, content)
+        return content
+
+
+def _urlopen_get(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def parse_directory_listing(content):
+    "Names in an FTP or HTML (https://ftp.ncbi.nlm.nih.gov) directory listing."
+    content = content.decode("utf-8")
+    if '<a ' in content.lower():
+        names = re.findall(r'<a\s+href="([^"?]+)"', content, re.IGNORECASE)
+    else:
+        names = [ line.split()[-1] for line in content.splitlines()
+                  if line.strip() ]
+    return [ name.rstrip('/') for name in names ]
+
+
+def url_for_accession(accession, fetcher=None, genomes_url=NCBI_GENOMES_URL):
+    "Find the genome & assembly report URLs for an accession."
+    get = fetcher.get if fetcher is not None else _urlopen_get
 
-def url_for_accession(accession):
     db, acc = accession.strip().split("_")
     if '.' in acc:
         number, version = acc.split(".")
     else:
         number, version = acc, '1'
     number = "/".join([number[p : p + 3] for p in range(0, len(number), 3)])
-    url = f"ftp://ftp.ncbi.nlm.nih.gov/genomes/all/{db}/{number}"
-
-    with urllib.request.urlopen(url) as response:
-        all_names = response.read()
+    url = f"{genomes_url}/{db}/{number}"
 
-    all_names = all_names.decode("utf-8")
+    all_names = parse_directory_listing(get(url + "/"))
 
     full_name = None
-    for line in all_names.splitlines():
-        name = line.split()[-1]
-        db_, acc_, *_ = name.split("_")
+    for name in all_names:
+        db_, acc_, *_ = name.split("_") + ['']
         if db_ == db and acc_.startswith(acc):
             full_name = name
             break
@@ -36,16 +219,17 @@ def url_for_accession(accession):
     if full_name is None:
         return None
     else:
-        url = "https" + url[3:]
+        if url.startswith("ftp://"):
+            url = "https://" + url[len("ftp://"):]
         return (
             f"{url}/{full_name}/{full_name}_genomic.fna.gz",
             f"{url}/{full_name}/{full_name}_assembly_report.txt",
         )
 
 
-def get_taxid_from_assembly_report(url):
-    with urllib.request.urlopen(url) as response:
-        content = response.read()
+def get_taxid_from_assembly_report(url, fetcher=None):
+    get = fetcher.get if fetcher is not None else _urlopen_get
+    content = get(url)
 
     content = content.decode("utf-8").splitlines()
     for line in content:
@@ -61,12 +245,10 @@ def get_taxid_from_assembly_report(url):
     assert 0
 
 
-def get_tax_name_for_taxid(taxid):
-    tax_url = (
-        f"https://www.ncbi.nlm.nih.gov/taxonomy/?term={taxid}&report=taxon&format=text"
-    )
-    with urllib.request.urlopen(tax_url) as response:
-        content = response.read()
+def get_tax_name_for_taxid(taxid, fetcher=None, taxonomy_url=NCBI_TAXONOMY_URL):
+    get = fetcher.get if fetcher is not None else _urlopen_get
+    tax_url = f"{taxonomy_url}?term={taxid}&report=taxon&format=text"
+    content = get(tax_url)
 
     root = etree.fromstring(content)
     notags = etree.tostring(root).decode("utf-8")
@@ -79,38 +261,172 @@ def get_tax_name_for_taxid(taxid):
     return notags
 
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument("accession")
-    p.add_argument("-o", "--output")
-    args = p.parse_args()
-
-    fieldnames = ["acc", "genome_url", "assembly_report_url", "ncbi_tax_name"]
-    if args.output:
-        fp = open(args.output, "wt")
-        w = csv.DictWriter(fp, fieldnames=fieldnames)
-    else:
-        w = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-    w.writeheader()
-
-    acc = args.accession
+def get_genome_info(acc, index=None, fetcher=None,
+                    genomes_url=NCBI_GENOMES_URL,
+                    taxonomy_url=NCBI_TAXONOMY_URL):
+    """
+    Get the genome & assembly report URLs and NCBI taxonomic name for an
+    accession; from the accession index if given, else from NCBI.
+    """
+    if index is not None:
+        info = index.get(acc)
+        if info is not None:
+            return info
+        print(f"{acc} not in accession index '{index.filename}'; asking NCBI",
+              file=sys.stderr)
 
-    genome_url, assembly_report_url = url_for_accession(acc)
-    taxid = get_taxid_from_assembly_report(assembly_report_url)
-    tax_name = get_tax_name_for_taxid(taxid)
+    urls = url_for_accession(acc, fetcher, genomes_url)
+    if urls is None:
+        raise ValueError(f"no genome found for accession '{acc}'")
+    genome_url, assembly_report_url = urls
+    taxid = get_taxid_from_assembly_report(assembly_report_url, fetcher)
+    tax_name = get_tax_name_for_taxid(taxid, fetcher, taxonomy_url)
 
-    d = dict(
+    return dict(
         acc=acc,
         genome_url=genome_url,
         assembly_report_url=assembly_report_url,
         ncbi_tax_name=tax_name,
+        taxid=taxid,
     )
 
-    w.writerow(d)
-    print(f"retrieved for {acc} - {tax_name}", file=sys.stderr)
 
+def info_csv(info):
+    "An info CSV for one accession, as bytes."
+    fp = io.StringIO(newline="")
+    w = csv.DictWriter(fp, fieldnames=INFO_FIELDNAMES, extrasaction="ignore")
+    w.writeheader()
+    w.writerow(info)
+    return fp.getvalue().encode("utf-8")
+
+
+def resolve_accessions(accessions, fetcher, jobs=DEFAULT_JOBS,
+                       accession_index=None, genomes_url=NCBI_GENOMES_URL,
+                       taxonomy_url=NCBI_TAXONOMY_URL, genome_cache=None):
+    """
+    Resolve many accessions w/up to 'jobs' at once. Yields (acc, info,
+    error) in the order given; one of info & error is None.
+    """
+    local = threading.local()
+
+    def resolve(acc):
+        if genome_cache is not None:
+            filename = genome_cache.get_info(acc)
+            if filename is not None:
+                with open(filename, "rt", newline="") as fp:
+                    rows = list(csv.DictReader(fp))
+                if len(rows) == 1:
+                    rows[0]["acc"] = acc
+                    return acc, rows[0], None
+
+        # SQLite connections can't be shared between threads.
+        index = None
+        if accession_index:
+            index = getattr(local, 'index', None)
+            if index is None:
+                index = local.index = AccessionIndex(accession_index)
+        try:
+            info = get_genome_info(acc, index, fetcher, genomes_url,
+                                   taxonomy_url)
+        except (OSError, ValueError, AssertionError,
+                http.client.HTTPException, etree.XMLSyntaxError) as exc:
+            return acc, None, str(exc) or 'cannot parse NCBI response'
+        info = dict(info)
+        info["acc"] = acc
+        if genome_cache is not None:
+            genome_cache.add_info(acc, info_csv(info))
+        return acc, info, None
+
+    jobs = max(1, min(jobs, len(accessions)))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(resolve, accessions)
+
+
+@metrics.record('genbank_genomes', output='output')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    accessions = list(args.accessions)
+    if args.accession_list:
+        accessions += load_file_list(args.accession_list)
+    accessions = list(dict.fromkeys(accessions))      # remove duplicates
+    if not accessions:
+        print("no accessions given.", file=sys.stderr)
+        return -1
+
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, args.cache_max_age * 86400)
+    fetcher = Fetcher(cache)
+
+    genome_cache = None
+    if args.genome_cache:
+        genome_cache = GenomeCache(args.genome_cache)
+
+    if args.output:
+        fp = open(args.output, "wt", newline="")
+    else:
+        fp = sys.stdout
+    w = csv.DictWriter(fp, fieldnames=INFO_FIELDNAMES, extrasaction="ignore")
+    w.writeheader()
+
+    n_failed = 0
+    with metrics.phase('resolve_accessions'):
+        for acc, info, error in resolve_accessions(accessions, fetcher,
+                                                   args.jobs,
+                                                   args.accession_index,
+                                                   args.genomes_url,
+                                                   args.taxonomy_url,
+                                                   genome_cache):
+            if error is not None:
+                print(f"cannot retrieve info for {acc}: {error}",
+                      file=sys.stderr)
+                n_failed += 1
+                continue
+            w.writerow(info)
+            print(f"retrieved for {acc} - {info['ncbi_tax_name']}",
+                  file=sys.stderr)
+        metrics.count('accessions', len(accessions))
+        metrics.count('requests', fetcher.n_requests)
+        metrics.count('cached_responses', fetcher.n_cached)
+
+    if args.output:
+        fp.close()
+
+    if len(accessions) > 1 or fetcher.n_cached:
+        print(f"resolved {len(accessions) - n_failed} of {len(accessions)} accessions w/{fetcher.n_requests} requests to NCBI and {fetcher.n_cached} cached responses.", file=sys.stderr)
+
+    if n_failed:
+        return -1
     return 0
 
 
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument("accessions", nargs="*")
+    p.add_argument("--accession-list",
+                   help="file w/accessions, one per line; '-' for stdin")
+    p.add_argument("-o", "--output")
+    p.add_argument("--accession-index",
+                   help="resolve accessions offline, from this index (see accession_index)")
+    p.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS,
+                   help="number of accessions to resolve at once")
+    p.add_argument("--cache-dir", help="cache NCBI responses in this directory")
+    p.add_argument("--cache-max-age", type=float,
+                   default=DEFAULT_CACHE_MAX_AGE,
+                   help="days before cached responses are fetched again")
+    p.add_argument("--genome-cache",
+                   help="shared genome cache directory; see genome_cache")
+    p.add_argument("--genomes-url", default=NCBI_GENOMES_URL,
+                   help=argparse.SUPPRESS)
+    p.add_argument("--taxonomy-url", default=NCBI_TAXONOMY_URL,
+                   help=argparse.SUPPRESS)
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
 if __name__ == "__main__":
-    sys.exit(main())
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
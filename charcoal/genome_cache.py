@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+"""
+A cache of reference genomes & their info CSVs, shared between projects.
+
+Stage 2 downloads the genomes that match each query, into
+'genbank_genomes/' under the working directory of each project; the
+same genomes are downloaded again for every project. With a shared
+cache, each genome is downloaded once, and projects link to it.
+
+Layout of the cache directory:
+
+* 'objects/{md5[:2]}/{md5}' - genome files, by MD5 (as in NCBI's
+  md5checksums.txt), so identical files are stored once;
+* 'refs/{acc}.json' - the object for an accession, w/its size & name;
+  the mtime of the ref is its last use, for LRU eviction;
+* 'info/{acc}.info.csv' - genbank_genomes info CSVs;
+* 'tmp/' - downloads in progress;
+* 'locks/' - lock files.
+
+Changes are made under an exclusive lock on 'locks/cache.lock', and
+files are written atomically, so concurrent snakemake jobs (& several
+projects) can share a cache. When the genomes take up more than the
+size cap, the least recently used are evicted; genomes used in the last
+EVICT_GRACE seconds are kept, as running jobs may still need them.
+"""
+import sys
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:                       # not on Unix
+    fcntl = None
+
+from . import metrics
+
+
+# don't evict genomes used more recently than this, in seconds.
+EVICT_GRACE = 3600
+
+_CHUNK_SIZE = 1024**2
+
+
+def md5_file(filename):
+    "MD5 of a file, as a hex string."
+    h = hashlib.md5()
+    with open(filename, 'rb') as fp:
+        while 1:
+            chunk = fp.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_atomic(filename, content):
+    dirname = os.path.dirname(filename)
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        os.chmod(tmpname, 0o644)          # mkstemp files are private
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+def link_genome(cached, filename):
+    "Point 'filename' at a cached genome, w/a symlink."
+    cached = os.path.abspath(cached)
+    dirname = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(dirname, exist_ok=True)
+    tmpname = os.path.join(dirname, f'.{os.path.basename(filename)}.{os.getpid()}.lnk')
+    if os.path.lexists(tmpname):
+        os.unlink(tmpname)
+    os.symlink(cached, tmpname)
+    os.replace(tmpname, filename)
+
+
+class GenomeCache:
+    """
+    A shared cache of genomes & info CSVs by accession; see the module
+    docstring. 'max_bytes' caps the size of the genomes, if given.
+    """
+    def __init__(self, dirname, max_bytes=None):
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        for sub in ('objects', 'refs', 'info', 'tmp', 'locks'):
+            os.makedirs(os.path.join(dirname, sub), exist_ok=True)
+
+    @contextmanager
+    def lock(self, name='cache'):
+        "Hold an exclusive lock, across processes; not reentrant."
+        lockfile = os.path.join(self.dirname, 'locks', f'{name}.lock')
+        with open(lockfile, 'a') as fp:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+    def tmp_filename(self, acc, suffix='_genomic.fna.gz'):
+        "Where to download a genome for the cache; stable, to resume."
+        return os.path.join(self.dirname, 'tmp', f'{acc}{suffix}')
+
+    def _object_path(self, md5):
+        return os.path.join(self.dirname, 'objects', md5[:2], md5)
+
+    def _ref_path(self, acc):
+        return os.path.join(self.dirname, 'refs', f'{acc}.json')
+
+    def _find(self, directory, acc, suffix):
+        "Find a file for 'acc', which may be missing its version."
+        filename = os.path.join(self.dirname, directory, acc + suffix)
+        if os.path.exists(filename):
+            return filename
+        pattern = os.path.join(self.dirname, directory,
+                               glob.escape(acc) + '.*' + suffix)
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            return matches[-1]
+        return None
+
+    def get(self, acc):
+        "Return the path of the cached genome for 'acc', or None."
+        ref_path = self._find('refs', acc, '.json')
+        if ref_path is None:
+            return None
+        try:
+            with open(ref_path, 'rt') as fp:
+                ref = json.load(fp)
+            path = self._object_path(ref['md5'])
+            if not os.path.exists(path):
+                return None
+            os.utime(ref_path)            # mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None
+        return path
+
+    def add(self, acc, filename, md5=None):
+        """
+        Move a genome file into the cache for 'acc', & evict old genomes
+        if over the size cap. Returns the cached path.
+        """
+        if md5 is None:
+            md5 = md5_file(filename)
+        path = self._object_path(md5)
+        ref = dict(acc=acc, md5=md5, size=os.path.getsize(filename),
+                   name=os.path.basename(filename))
+
+        with self.lock():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(filename)
+            else:
+                tmpname = path + f'.{os.getpid()}.tmp'
+                shutil.move(filename, tmpname)
+                os.chmod(tmpname, 0o644)
+                os.replace(tmpname, path)
+            _write_atomic(self._ref_path(acc),
+                          json.dumps(ref).encode('utf-8'))
+            if self.max_bytes is not None:
+                self._evict(self.max_bytes)
+
+        return path
+
+    def get_info(self, acc):
+        "Return the path of the cached info CSV for 'acc', or None."
+        return self._find('info', acc, '.info.csv')
+
+    def add_info(self, acc, content):
+        "Cache the info CSV (as bytes) for 'acc'."
+        _write_atomic(os.path.join(self.dirname, 'info', f'{acc}.info.csv'),
+                      content)
+
+    def entries(self):
+        "List (last used, size, acc, md5) for the cached genomes."
+        entries = []
+        for ref_path in glob.glob(os.path.join(self.dirname, 'refs', '*.json')):
+            try:
+                with open(ref_path, 'rt') as fp:
+                    ref = json.load(fp)
+                entries.append((os.stat(ref_path).st_mtime, ref['size'],
+                                ref['acc'], ref['md5']))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def total_size(self):
+        "Total size of the cached genomes, in bytes."
+        sizes = { md5: size for _, size, _, md5 in self.entries() }
+        return sum(sizes.values())
+
+    def evict(self, max_bytes):
+        "Evict least recently used genomes until under 'max_bytes'."
+        with self.lock():
+            return self._evict(max_bytes)
+
+    def _evict(self, max_bytes):
+        entries = sorted(self.entries())
+        sizes = { md5: size for _, size, _, md5 in entries }
+        total = sum(sizes.values())
+        n_refs = {}
+        for _, _, _, md5 in entries:
+            n_refs[md5] = n_refs.get(md5, 0) + 1
+
+        now = time.time()
+        evicted = []
+        for last_used, size, acc, md5 in entries:
+            if total <= max_bytes:
+                break
+            if now - last_used < EVICT_GRACE:
+                break                     # the rest are newer still
+
+            os.unlink(self._ref_path(acc))
+            evicted.append(acc)
+            n_refs[md5] -= 1
+            if not n_refs[md5]:
+                try:
+                    os.unlink(self._object_path(md5))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        return evicted
+
+
+def open_cache(dirname, max_gb=None):
+    "Open a GenomeCache w/a cap in GB (0 or None for no cap)."
+    max_bytes = int(max_gb * 1024**3) if max_gb else None
+    return GenomeCache(dirname, max_bytes)
+
+
+def find_genome(acc, genome_dir='genbank_genomes', genome_cache=None):
+    """
+    Find the genome file for an accession: in 'genome_dir' as
+    '{acc}*.fna.gz', or else in the shared cache, if given.
+    """
+    pattern = os.path.join(genome_dir, glob.escape(acc) + '*.fna.gz')
+    for filename in sorted(glob.glob(pattern)):
+        if os.path.exists(filename):          # skip dangling links
+            return filename
+
+    if genome_cache:
+        if isinstance(genome_cache, str):
+            genome_cache = GenomeCache(genome_cache)
+        filename = genome_cache.get(acc)
+        if filename is not None:
+            return filename
+
+    raise FileNotFoundError(f"no genome for accession '{acc}' in '{genome_dir}'" + (' or the genome cache' if genome_cache else ''))
+
+
+@metrics.record('genome_cache')
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    cache = open_cache(args.cache_dir, args.max_gb)
+
+    if args.max_gb:
+        evicted = cache.evict(cache.max_bytes)
+        print(f"evicted {len(evicted)} genomes.")
+
+    entries = cache.entries()
+    total = cache.total_size()
+    print(f"{len(entries)} genomes, {total / 1024**2:.1f} MB in '{args.cache_dir}'.")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('cache_dir', help='genome cache directory')
+    p.add_argument('--max-gb', type=float,
+                   help='evict least recently used genomes down to this size')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
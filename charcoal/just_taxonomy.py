@@ -4,7 +4,6 @@ Remove bad contigs based solely on taxonomy.
 """
 import sys
 import argparse
-import gzip
 from collections import Counter, defaultdict
 import csv
 import os.path
@@ -12,13 +11,17 @@ import os.path
 import screed
 
 import sourmash
-from sourmash.lca.command_index import load_taxonomy_assignments
 from sourmash.lca import LCA_Database, LineagePair
 
 from . import utils
+from . import metrics
 from . import lineage_db
 from .lineage_db import LineageDB
 from .version import version
+from .taxonomy_cache import load_taxonomy
+from .taxonomy_index import build_taxonomy_index
+from .contig_sketches import ContigSketches, contig_minhash
+from .fasta_writer import FastaWriter
 from .utils import (get_idents_for_hashval, gather_lca_assignments,
     count_lca_for_assignments, pretty_print_lineage, pretty_print_lineage2,
     WriteAndTrackFasta, gather_at_rank, get_ident)
@@ -170,19 +173,29 @@ class ContigsDecontaminator(object):
 
         self.contig_reports = {}
 
-    def set_clean_filename(self, filename):
-        clean_fp = gzip.open(filename, 'wt')
+    def set_clean_filename(self, filename, threads=1, level=None):
+        clean_fp = FastaWriter(filename, threads, level)
         self.clean_out = WriteAndTrackFasta(clean_fp, self.empty_mh)
 
-    def set_dirty_filename(self, filename):
-        dirty_fp = gzip.open(filename, 'wt')
+    def set_dirty_filename(self, filename, threads=1, level=None):
+        dirty_fp = FastaWriter(filename, threads, level)
         self.dirty_out = WriteAndTrackFasta(dirty_fp, self.empty_mh)
 
-    def clean_contigs(self, screed_iter, report_fp, no_write=False):
+    def clean_contigs(self, screed_iter, report_fp, no_write=False,
+                      contigs=None):
+        """
+        Examine & write out each contig. 'contigs', if given, yields the
+        corresponding contig sketches, so the sequences aren't rehashed.
+        """
         for n, record in enumerate(screed_iter):
             # make a new minhash and start examining it.
-            mh = self.empty_mh.copy_and_clear()
-            mh.add_sequence(record.sequence, force=True)
+            if contigs is not None:
+                contig = next(contigs)
+                assert contig.name == record.name
+                mh = contig_minhash(contig, self.empty_mh)
+            else:
+                mh = self.empty_mh.copy_and_clear()
+                mh.add_sequence(record.sequence, force=True)
 
             clean_flag = ContigInfo.NO_HASH
             ctg_lin = ""
@@ -204,11 +217,11 @@ class ContigsDecontaminator(object):
             # write out contigs -> clean or dirty files.
             if clean_flag != ContigInfo.DIRTY:   # non-dirty => clean
                 if self.clean_out:
-                    self.clean_out.write(record, no_write=no_write)
+                    self.clean_out.write(record, no_write=no_write, mh=mh)
             else:
                 assert clean_flag == ContigInfo.DIRTY
                 if self.dirty_out:
-                    self.dirty_out.write(record, no_write=no_write)
+                    self.dirty_out.write(record, no_write=no_write, mh=mh)
 
             hash_ident_cnt = 0
             for hashval in mh.get_mins():
@@ -236,7 +249,7 @@ class ContigsDecontaminator(object):
         for lin, count in gather_at_rank(contig_mh, self.lca_db,
                                          self.lin_db, self.match_rank):
             if utils.is_lineage_match(lin, self.genome_lineage,
-                                      self.match_rank):
+                                      self.match_rank, self.lin_db.taxonomy):
                 good_count += count
 
         if good_count >= self.GATHER_THRESHOLD:
@@ -263,7 +276,7 @@ class ContigsDecontaminator(object):
         common_kb = common_hashcount * contig_mh.scaled / 1000
         # if it matched outside rank, => dirty.
         if utils.is_lineage_match(self.genome_lineage, contig_lineage,
-                                  self.match_rank):
+                                  self.match_rank, self.lin_db.taxonomy):
             clean = ContigInfo.CLEAN
         else:
             clean = ContigInfo.DIRTY
@@ -330,13 +343,15 @@ def choose_genome_lineage(guessed_genome_lineage, provided_lineage, match_rank,
 
 ###
 
+@metrics.record('just_taxonomy', output='report', genome='genome')
 def main(args):
     "Main entry point for scripting. Use cmdline for command line entry."
     genomebase = os.path.basename(args.genome)
     match_rank = args.match_rank
 
-    tax_assign, _ = load_taxonomy_assignments(args.lineages_csv,
-                                              start_column=2)
+    with metrics.phase('load_taxonomy'):
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        taxonomy = build_taxonomy_index(tax_assign)
     print(f'loaded {len(tax_assign)} tax assignments.')
 
     siglist = list(sourmash.load_file_as_signatures(args.matches_sig))
@@ -365,13 +380,27 @@ def main(args):
     report('')
     report(f'genome: {genomebase}')
 
-    print(f'pass 1: reading contigs from {genomebase}')
+    # use precomputed contig sketches, if we have them & they match.
+    sketches = None
+    if getattr(args, 'contig_sketches', None):
+        sketches = ContigSketches.load(args.contig_sketches)
+        if not sketches.is_compatible(empty_mh):
+            print(f"contig sketches in '{args.contig_sketches}' don't match the matches; ignoring")
+            sketches = None
+
     entire_mh = empty_mh.copy_and_clear()
-    total_bp = 0
-    for n, record in enumerate(screed.open(args.genome)):
-        entire_mh.add_sequence(record.sequence, force=True)
-        total_bp += len(record.sequence)
-    n_contigs = n + 1
+    if sketches:
+        print(f'pass 1: using contig sketches for {genomebase}')
+        entire_mh.add_many(sketches.hashes)
+        total_bp = sum(sketches.lengths)
+        n_contigs = len(sketches)
+    else:
+        print(f'pass 1: reading contigs from {genomebase}')
+        total_bp = 0
+        for n, record in enumerate(screed.open(args.genome)):
+            entire_mh.add_sequence(record.sequence, force=True)
+            total_bp += len(record.sequence)
+        n_contigs = n + 1
 
     report(f'genome has {n_contigs} contigs in {total_bp/1000:.1f}kb')
     report(f'{len(entire_mh)} hashes total.')
@@ -401,7 +430,7 @@ def main(args):
 
     # create empty LCA database to populate...
     lca_db = LCA_Database(ksize=ksize, scaled=scaled, moltype=moltype)
-    lin_db = LineageDB()
+    lin_db = LineageDB(taxonomy)
 
     # ...with specific matches.
     for ss in siglist:
@@ -479,7 +508,10 @@ def main(args):
 
     # do the cleaning
     screed_iter = screed.open(args.genome)
-    cleaner.clean_contigs(screed_iter, report_fp)
+    contigs = None
+    if sketches:
+        contigs = sketches.contigs()
+    cleaner.clean_contigs(screed_iter, report_fp, contigs=contigs)
     dirty_mh = cleaner.dirty_out.minhash
 
     fail = False
@@ -654,6 +686,9 @@ def cmdline(sys_args):
                    default='NA')        # default is str NA
     p.add_argument('--match-rank', help='rank below which matches are _not_ contaminants', default='genus')
     p.add_argument('--contig-report', help='contig report (CSV)')
+    p.add_argument('--contig-sketches',
+                   help='contig sketches for the genome, instead of rehashing it')
+    metrics.add_argument(p)
     args = p.parse_args()
 
     main(args)
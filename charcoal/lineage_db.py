@@ -18,6 +18,8 @@ import pytest
 
 from sourmash.lca import LineagePair
 
+from .taxonomy_index import TaxonomyIndex
+
 
 def cached_property(fun):
     """A memoize decorator for class properties."""
@@ -40,19 +42,18 @@ class LineageDB(object):
 
     Identifiers `ident` must be unique.
 
-    Integer `lid` indices can be used as keys in dictionary attributes:
-    * `lid_to_lineage`, to get a lineage for that `lid`.
-    * `lid_to_idents`, to get set of identifiers for that `lid`.
-
-    `lineage_to_lid` is a dictionary with tuples of LineagePair as keys,
-    `lid` as values.
-
-    `ident_to_lid` is a dictionary from unique str identifer to integer `lid`.
     `ident_to_lineage` is a dict from identifier to lineage.
+    `lineage_to_idents` is a dict from lineage to a set of identifiers.
+
+    `ident_to_lid` is a dictionary from unique str identifer to integer
+    lineage id `lid`, in the taxonomy index `taxonomy`, built from the
+    loaded taxonomy; see taxonomy_index.build_taxonomy_index.
     """
-    def __init__(self):
+    def __init__(self, taxonomy):
         self.lineage_to_idents = defaultdict(set)
         self.ident_to_lineage = {}
+        self.ident_to_lid = {}
+        self.taxonomy = taxonomy
 
     def _invalidate_cache(self):
         if hasattr(self, '_cache'):
@@ -63,7 +64,8 @@ class LineageDB(object):
 
         'ident' must be a unique string identifer across this database.
 
-        'lineage', if specified, must contain a tuple of LineagePair objects.
+        'lineage', if specified, must contain a tuple of LineagePair objects,
+        and must be in the taxonomy index.
         """
         if ident in self.ident_to_lineage:
             raise ValueError("identifier {} is already in this lineage db.".format(ident))
@@ -73,11 +75,16 @@ class LineageDB(object):
 
         try:
             lineage = tuple(lineage)
-            self.lineage_to_idents[lineage].add(ident)
+            lid = self.taxonomy.lineage_id(lineage)
         except TypeError:
             raise ValueError('lineage cannot be used as a key?!')
 
+        if lid is None:
+            raise ValueError("lineage for {} is not in the taxonomy index.".format(ident))
+
+        self.lineage_to_idents[lineage].add(ident)
         self.ident_to_lineage[ident] = lineage
+        self.ident_to_lid[ident] = lid
 
     def __repr__(self):
         return "LineageDB('{}')".format(self.filename)
@@ -194,19 +201,34 @@ def test_lineage_db_1():
     lineage = ((LineagePair('rank1', 'name1'),
                 LineagePair('rank2', 'name2')))
 
-    ldb = LineageDB()
+    taxonomy = TaxonomyIndex()
+    taxonomy.add(lineage)
+    ldb = LineageDB(taxonomy)
     ldb.insert('uniq', lineage)
 
     assert 'uniq' in ldb.lineage_to_idents[lineage]
     assert ldb.ident_to_lineage['uniq'] == lineage
 
 
+def test_lineage_db_1_not_indexed():
+    # lineages must already be in the taxonomy index.
+    lineage = ((LineagePair('rank1', 'name1'),
+                LineagePair('rank2', 'name2')))
+
+    taxonomy = TaxonomyIndex()
+    ldb = LineageDB(taxonomy)
+
+    with pytest.raises(ValueError):
+        ldb.insert('uniq', lineage)
+    assert len(taxonomy) == 1
+
+
 def test_lineage_db_1_tuple():
     # list here cannot be tuple-ized for use as a lineage
     lineage = ([LineagePair('rank1', 'name1'),
                 LineagePair('rank2', 'name2')],)
 
-    ldb = LineageDB()
+    ldb = LineageDB(TaxonomyIndex())
 
     with pytest.raises(ValueError):
         ldb.insert('uniq', lineage)
@@ -216,7 +238,7 @@ def test_lineage_db_1_non_iter():
     # try a non-iterable => fail.
     lineage = 1
 
-    ldb = LineageDB()
+    ldb = LineageDB(TaxonomyIndex())
 
     with pytest.raises(ValueError):
         ldb.insert('uniq', lineage)
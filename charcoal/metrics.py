@@ -0,0 +1,297 @@
+"""
+Timing & memory metrics for charcoal steps.
+
+Each entry point ('python -m charcoal.*') records metrics while it runs,
+and saves them as JSON next to its outputs - by default in
+'{output}.metrics.json'; see --metrics-json. 'charcoal perf-report'
+aggregates them across a run; see perf_report.
+
+Metrics are kept for named phases - loading the taxonomy, selecting
+matches from the databases, building the LCA database, hashing and
+gathering contigs, writing outputs - w/wall and CPU time (incl. worker
+processes) and the peak RSS of the process so far. Counts (contigs,
+hashes, matches...) are added to the current phase too, which gives
+rates. Steps that run on many genomes also break everything down by
+genome.
+
+Phases may nest; their times are inclusive. When no metrics are being
+recorded (e.g. when charcoal is used as a library) all of this is a
+no-op.
+"""
+import sys
+import os
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:                       # not on Unix
+    resource = None
+
+from .version import version
+
+
+METRICS_SUFFIX = '.metrics.json'
+
+# the Metrics being recorded in this process, if any.
+_current = None
+
+
+def cpu_time():
+    "CPU time of this process and its finished children, in seconds."
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss_mb():
+    "Peak RSS of this process, and of its largest finished child, in MB."
+    if resource is None:
+        return None, None
+
+    # ru_maxrss is in kB on Linux, bytes on macOS.
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (round(peak * unit / 1024**2, 1),
+            round(child_peak * unit / 1024**2, 1))
+
+
+def _new_stats():
+    return dict(wall_s=0.0, cpu_s=0.0, calls=0, counts={})
+
+
+def _add_count(counts, name, n):
+    counts[name] = counts.get(name, 0) + n
+
+
+def _with_rates(stats):
+    "Add {count}_per_s for each count to a copy of 'stats'."
+    stats = dict(stats)
+    wall = stats['wall_s']
+    stats['rates'] = { f'{name}_per_s': round(n / wall, 1) if wall else None
+                       for name, n in stats['counts'].items() }
+    return stats
+
+
+class Metrics:
+    """
+    Metrics for one run of a program; see the module docstring.
+
+    Use the module-level 'phase', 'genome' and 'count' functions to add
+    to the Metrics being recorded.
+    """
+    def __init__(self, program, argv=None):
+        self.program = program
+        self.argv = list(sys.argv if argv is None else argv)
+        self.status = None
+        self.phases = {}
+        self.counts = {}
+        self.genomes = {}
+        self._phase_stack = []
+        self._genome = None
+        self._start_wall = time.perf_counter()
+        self._start_cpu = cpu_time()
+
+    def _tables(self):
+        "The phase & count tables to add to: overall, and the genome's."
+        tables = [(self.phases, self.counts)]
+        if self._genome is not None:
+            g = self.genomes[self._genome]
+            tables.append((g['phases'], g['counts']))
+        return tables
+
+    def add_phase(self, name, wall, cpu):
+        "Add a (wall, CPU) time to phase 'name'."
+        peak, _ = peak_rss_mb()
+        for phases, _ in self._tables():
+            stats = phases.get(name)
+            if stats is None:
+                stats = phases[name] = _new_stats()
+            stats['wall_s'] += wall
+            stats['cpu_s'] += cpu
+            stats['calls'] += 1
+            stats['peak_rss_mb'] = peak
+
+    def count(self, name, n=1):
+        "Add 'n' to count 'name', overall & for any current phase."
+        phase = self._phase_stack[-1] if self._phase_stack else None
+        for phases, counts in self._tables():
+            _add_count(counts, name, n)
+            if phase:
+                stats = phases.get(phase)
+                if stats is None:
+                    stats = phases[phase] = _new_stats()
+                _add_count(stats['counts'], name, n)
+
+    @contextmanager
+    def phase(self, name):
+        "Time the enclosed code as phase 'name'."
+        self._phase_stack.append(name)
+        start_wall, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            self._phase_stack.pop()
+            self.add_phase(name, time.perf_counter() - start_wall,
+                           cpu_time() - start_cpu)
+
+    @contextmanager
+    def genome(self, name):
+        "Attribute the enclosed phases & counts to genome 'name', too."
+        outer = self._genome
+        if name not in self.genomes:
+            self.genomes[name] = dict(wall_s=0.0, cpu_s=0.0, phases={},
+                                      counts={})
+        self._genome = name
+        start_wall, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            g = self.genomes[name]
+            g['wall_s'] += time.perf_counter() - start_wall
+            g['cpu_s'] += cpu_time() - start_cpu
+            g['peak_rss_mb'], _ = peak_rss_mb()
+            self._genome = outer
+
+    def to_dict(self):
+        "The metrics so far, as a JSON-able dictionary."
+        wall = time.perf_counter() - self._start_wall
+        peak, child_peak = peak_rss_mb()
+
+        genomes = {}
+        for name, g in self.genomes.items():
+            g = dict(g)
+            g['phases'] = { k: _with_rates(v) for k, v in g['phases'].items() }
+            genomes[name] = g
+
+        d = dict(program=self.program,
+                 version=version,
+                 argv=self.argv,
+                 status=self.status,
+                 wall_s=wall,
+                 cpu_s=cpu_time() - self._start_cpu,
+                 peak_rss_mb=peak,
+                 peak_child_rss_mb=child_peak,
+                 phases={ k: _with_rates(v) for k, v in self.phases.items() },
+                 counts=dict(self.counts),
+                 genomes=genomes)
+        d['rates'] = _with_rates(d)['rates']
+        return d
+
+    def save(self, filename):
+        with open(filename, 'wt') as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+            fp.write('\n')
+
+
+def current():
+    "The Metrics being recorded, or None."
+    return _current
+
+
+@contextmanager
+def phase(name):
+    "Time the enclosed code as phase 'name', if recording."
+    if _current is None:
+        yield
+    else:
+        with _current.phase(name):
+            yield
+
+
+@contextmanager
+def genome(name):
+    "Attribute the enclosed phases & counts to genome 'name', if recording."
+    if _current is None:
+        yield
+    else:
+        with _current.genome(name):
+            yield
+
+
+def count(name, n=1):
+    "Add 'n' to count 'name', if recording."
+    if _current is not None:
+        _current.count(name, n)
+
+
+def timed_iter(name, iterable):
+    """
+    Yield from 'iterable', timing only the time spent producing items
+    as phase 'name'; for streamed work like reading database matches.
+    """
+    if _current is None:
+        yield from iterable
+        return
+
+    metrics = _current
+    it = iter(iterable)
+    while 1:
+        start_wall, start_cpu = time.perf_counter(), cpu_time()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            metrics.add_phase(name, time.perf_counter() - start_wall,
+                              cpu_time() - start_cpu)
+        yield item
+
+
+def add_argument(p):
+    "Add --metrics-json to an argparse parser."
+    p.add_argument('--metrics-json',
+                   help=f'save timing & memory metrics to this file (default: next to the outputs, as *{METRICS_SUFFIX})')
+
+
+def record(program, output=None, genome=None):
+    """
+    Decorator for an entry point's 'main(args)': record metrics while it
+    runs, and save them to 'args.metrics_json'.
+
+    If --metrics-json wasn't given, save them to '{output}.metrics.json',
+    where 'output' is the name of an args attribute or a function of
+    args returning a filename. If 'genome' names an args attribute,
+    everything is attributed to that genome, too. If 'args' has no
+    'metrics_json' at all (main() called from a script or test),
+    nothing is recorded.
+    """
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(args):
+            global _current
+            if _current is not None or not hasattr(args, 'metrics_json'):
+                return main(args)
+
+            filename = args.metrics_json
+            if not filename and output:
+                if callable(output):
+                    outname = output(args)
+                else:
+                    outname = getattr(args, output, None)
+                if outname and outname != '-':
+                    filename = outname + METRICS_SUFFIX
+            if not filename:
+                return main(args)
+
+            _current = Metrics(program)
+            try:
+                genome_name = getattr(args, genome, None) if genome else None
+                if genome_name:
+                    with _current.genome(os.path.basename(genome_name)):
+                        _current.status = main(args)
+                else:
+                    _current.status = main(args)
+            finally:
+                metrics, _current = _current, None
+                try:
+                    metrics.save(filename)
+                except OSError as exc:
+                    print(f"cannot save metrics to '{filename}': {exc}",
+                          file=sys.stderr)
+            return metrics.status
+
+        return wrapper
+    return decorator
@@ -0,0 +1,214 @@
+#! /usr/bin/env python
+"""
+Aggregate the metrics saved by charcoal steps across a run.
+
+Finds the '*.metrics.json' files (see metrics) under the given
+directories, and reports time & memory by program, by phase, and for
+the genomes that took the longest. Use --json to save the aggregated
+numbers, too.
+"""
+import sys
+import argparse
+import json
+import os
+
+from .metrics import METRICS_SUFFIX
+
+
+def find_metrics_files(paths):
+    "Find metrics files under directories; files are taken as given."
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+
+        for dirpath, dirnames, files in os.walk(path):
+            dirnames.sort()
+            for name in sorted(files):
+                if name.endswith(METRICS_SUFFIX):
+                    filenames.append(os.path.join(dirpath, name))
+
+    return filenames
+
+
+def load_metrics(filenames):
+    "Load metrics files; skip (w/a warning) any that can't be read."
+    runs = []
+    for filename in filenames:
+        try:
+            with open(filename, 'rt') as fp:
+                run = json.load(fp)
+            if not isinstance(run, dict) or 'program' not in run:
+                raise ValueError('not a charcoal metrics file')
+        except (OSError, ValueError) as exc:
+            print(f"skipping '{filename}': {exc}", file=sys.stderr)
+            continue
+        run['filename'] = filename
+        runs.append(run)
+
+    return runs
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def _add_counts(total, counts):
+    for name, n in counts.items():
+        total[name] = total.get(name, 0) + n
+
+
+def _rates(wall, counts):
+    return { f'{name}_per_s': round(n / wall, 1) if wall else None
+             for name, n in counts.items() }
+
+
+def _add_phases(total, phases):
+    "Add a table of phase stats to another."
+    for name, stats in phases.items():
+        t = total.setdefault(name, dict(wall_s=0.0, cpu_s=0.0, calls=0,
+                                        peak_rss_mb=None, counts={}))
+        t['wall_s'] += stats.get('wall_s', 0)
+        t['cpu_s'] += stats.get('cpu_s', 0)
+        t['calls'] += stats.get('calls', 0)
+        t['peak_rss_mb'] = _max(t['peak_rss_mb'], stats.get('peak_rss_mb'))
+        _add_counts(t['counts'], stats.get('counts', {}))
+
+
+def summarize(runs):
+    """
+    Aggregate metrics: returns a dictionary w/totals by program, by
+    (program, phase), and by genome.
+    """
+    programs = {}
+    phases = {}
+    genomes = {}
+    for run in runs:
+        program = run['program']
+        p = programs.setdefault(program, dict(runs=0, wall_s=0.0, cpu_s=0.0,
+                                              peak_rss_mb=None, counts={}))
+        p['runs'] += 1
+        p['wall_s'] += run.get('wall_s', 0)
+        p['cpu_s'] += run.get('cpu_s', 0)
+        p['peak_rss_mb'] = _max(p['peak_rss_mb'],
+                                _max(run.get('peak_rss_mb'),
+                                     run.get('peak_child_rss_mb')))
+        _add_counts(p['counts'], run.get('counts', {}))
+
+        _add_phases(phases.setdefault(program, {}), run.get('phases', {}))
+
+        for name, g in run.get('genomes', {}).items():
+            t = genomes.setdefault(name, dict(wall_s=0.0, cpu_s=0.0,
+                                              peak_rss_mb=None, counts={},
+                                              phases={}))
+            t['wall_s'] += g.get('wall_s', 0)
+            t['cpu_s'] += g.get('cpu_s', 0)
+            t['peak_rss_mb'] = _max(t['peak_rss_mb'], g.get('peak_rss_mb'))
+            # each step sees the same contigs, so don't add them up.
+            for k, n in g.get('counts', {}).items():
+                t['counts'][k] = max(t['counts'].get(k, 0), n)
+            _add_phases(t['phases'],
+                        { f'{program}:{k}': v
+                          for k, v in g.get('phases', {}).items() })
+
+    for table in [programs, genomes] + list(phases.values()):
+        for stats in table.values():
+            stats['rates'] = _rates(stats['wall_s'], stats['counts'])
+
+    return dict(n_files=len(runs), programs=programs, phases=phases,
+                genomes=genomes)
+
+
+def _fmt_mb(mb):
+    return '-' if mb is None else f'{mb:.0f}'
+
+
+def _fmt_rates(rates):
+    return ', '.join( f'{k[:-6]} {v:,.0f}/s' for k, v in rates.items()
+                      if v is not None )
+
+
+def format_report(summary, top=10):
+    "Format the summary as a text report; returns a list of lines."
+    programs = summary['programs']
+    total_wall = sum( p['wall_s'] for p in programs.values() )
+
+    def pct(wall):
+        return f'{100 * wall / total_wall:5.1f}%' if total_wall else '    -'
+
+    lines = [f"loaded metrics from {summary['n_files']} files; "
+             f"{total_wall:.1f}s wall time in total.", '']
+
+    lines.append('by program:')
+    lines.append(f"  {'program':<26} {'runs':>5} {'wall s':>9} {'':>6} {'cpu s':>9} {'max MB':>7}")
+    for name, p in sorted(programs.items(), key=lambda x: -x[1]['wall_s']):
+        lines.append(f"  {name:<26} {p['runs']:>5} {p['wall_s']:>9.2f} {pct(p['wall_s'])} {p['cpu_s']:>9.2f} {_fmt_mb(p['peak_rss_mb']):>7}")
+
+    all_phases = [ (program, name, stats)
+                   for program, phases in summary['phases'].items()
+                   for name, stats in phases.items() ]
+    all_phases.sort(key=lambda x: -x[2]['wall_s'])
+    lines.append('')
+    lines.append(f'hottest phases (of {len(all_phases)}):')
+    lines.append(f"  {'program:phase':<40} {'calls':>6} {'wall s':>9} {'':>6} {'cpu s':>9} {'max MB':>7}  rates")
+    for program, name, s in all_phases[:top]:
+        label = f'{program}:{name}'
+        lines.append(f"  {label:<40} {s['calls']:>6} {s['wall_s']:>9.2f} {pct(s['wall_s'])} {s['cpu_s']:>9.2f} {_fmt_mb(s['peak_rss_mb']):>7}  {_fmt_rates(s['rates'])}")
+
+    genomes = sorted(summary['genomes'].items(), key=lambda x: -x[1]['wall_s'])
+    lines.append('')
+    lines.append(f'hottest genomes (of {len(genomes)}):')
+    lines.append(f"  {'genome':<40} {'wall s':>9} {'cpu s':>9} {'max MB':>7} {'contigs':>8} {'matches':>8}  slowest phase")
+    for name, g in genomes[:top]:
+        counts = g['counts']
+        slowest = ''
+        if g['phases']:
+            phase, s = max(g['phases'].items(), key=lambda x: x[1]['wall_s'])
+            slowest = f"{phase} ({s['wall_s']:.2f}s)"
+        lines.append(f"  {name:<40} {g['wall_s']:>9.2f} {g['cpu_s']:>9.2f} {_fmt_mb(g['peak_rss_mb']):>7} {counts.get('contigs', 0):>8} {counts.get('matches', 0):>8}  {slowest}")
+
+    return lines
+
+
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    filenames = find_metrics_files(args.paths)
+    runs = load_metrics(filenames)
+    if not runs:
+        print(f'no metrics files found in {", ".join(args.paths)}',
+              file=sys.stderr)
+        return -1
+
+    summary = summarize(runs)
+    print('\n'.join(format_report(summary, args.top)))
+
+    if args.json:
+        with open(args.json, 'wt') as fp:
+            json.dump(summary, fp, indent=2)
+        print(f"\nsaved aggregated metrics to '{args.json}'")
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('paths', nargs='+',
+                   help='output directories (searched for *.metrics.json) or metrics files')
+    p.add_argument('--top', type=int, default=10,
+                   help='number of phases & genomes to show')
+    p.add_argument('--json', help='save the aggregated metrics as JSON')
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -7,14 +7,15 @@ import argparse
 import csv
 import os.path
 import json
-import glob
 import itertools
 
 from . import alignplot
 from .alignplot import AlignmentContainer
+from .genome_cache import GenomeCache
 
 import sourmash
 from . import utils
+from . import metrics
 
 # minimum alignment size, in kb
 # in practice, this is also bounded by the aligner used - mashmap generally
@@ -22,6 +23,8 @@ from . import utils
 MIN_ALIGN_SIZE=0.5
 
 
+@metrics.record('postprocess_alignments', output='summary_csv',
+                genome='genome')
 def main(args):
     "Main entry point for scripting. Use cmdline for command line entry."
 
@@ -59,6 +62,7 @@ def main(args):
 
     clean_accs.sort(key=lambda x: -x[2])
     dirty_accs.sort(key=lambda x: -x[2])
+    metrics.count('matches', len(clean_accs) + len(dirty_accs))
 
     output = []
 
@@ -77,40 +81,39 @@ def main(args):
 
     print("\n".join(output))
 
-    def load_target_pairs(match_list):
-        pairs = []
-        for acc, _, _ in match_list:
-            filename = glob.glob(f'genbank_genomes/{acc}*.fna.gz')
-            #assert len(filename) == 1, filename # @CTB
-            filename = filename[0]
-            pairs.append((acc, filename))
+    genome_cache = None
+    if args.genome_cache:
+        genome_cache = GenomeCache(args.genome_cache)
 
-        return pairs
+    def load_target_pairs(match_list):
+        return alignplot.load_target_pairs([ acc for acc, _, _ in match_list ],
+                                           args.genbank_genomes, genome_cache)
 
     contaminant_pairs = load_target_pairs(dirty_accs)
     clean_pairs = load_target_pairs(clean_accs)
+    target_files = dict(contaminant_pairs + clean_pairs)
 
     contigs_by_acc = {}
     contigs_to_acc = {}
     all_sizes = {}
-    all_sizes.update(alignplot.load_contig_sizes(args.genome))
-    for acc, _, _ in itertools.chain(clean_accs, dirty_accs):
-        filename = glob.glob(f'genbank_genomes/{acc}*.fna.gz')
-        filename = filename[0]
-        sizes = alignplot.load_contig_sizes(filename)
-        all_sizes.update(sizes)
-        contigs_by_acc[acc] = sizes
-        for contig_name in sizes:
-            assert contig_name not in contigs_to_acc
-            contigs_to_acc[contig_name] = acc
+    with metrics.phase('load_contig_sizes'):
+        all_sizes.update(alignplot.load_contig_sizes(args.genome))
+        for acc, _, _ in itertools.chain(clean_accs, dirty_accs):
+            sizes = alignplot.load_contig_sizes(target_files[acc])
+            all_sizes.update(sizes)
+            contigs_by_acc[acc] = sizes
+            for contig_name in sizes:
+                assert contig_name not in contigs_to_acc
+                contigs_to_acc[contig_name] = acc
+        metrics.count('contigs', len(all_sizes))
 
     dirty_alignment = AlignmentContainer(genomebase, args.genome, contaminant_pairs, f'{inp_dir}/hitlist-accessions.info.csv')
 
-    results = {}
-    for t_acc, _ in contaminant_pairs:
-        mashmap_file = f'{inp_dir}/{genomebase}.x.{t_acc}.mashmap.align'
-        results[t_acc] = dirty_alignment._read_mashmap(mashmap_file)
-    dirty_alignment.results = results
+    with metrics.phase('load_alignments'):
+        dirty_alignment.load_mashmap(f'{inp_dir}/{genomebase}',
+                                     combined=args.combined_alignments,
+                                     contigs_to_acc=contigs_to_acc)
+        metrics.count('alignments', len(dirty_alignment))
 
     print(f'filtering dirty alignments to query size >= 500 and identity >= {args.min_align_pident}%')
     dirty_alignment.filter(query_size=MIN_ALIGN_SIZE, pident=args.min_align_pident)
@@ -166,7 +169,14 @@ def cmdline(sys_args):
     p.add_argument('--summary-csv', required=True)
     p.add_argument('--min-query-coverage', type=float, required=True)
     p.add_argument('--min-align-pident', type=float, required=True)
+    p.add_argument('--combined-alignments', action='store_true',
+                   help="read one '{genome}.mashmap.align' for all targets")
+    p.add_argument('--genbank-genomes', default='genbank_genomes',
+                   help='directory of downloaded match genomes')
+    p.add_argument('--genome-cache',
+                   help='shared genome cache directory; see genome_cache')
     p.add_argument('genome')
+    metrics.add_argument(p)
     args = p.parse_args()
 
     return main(args)
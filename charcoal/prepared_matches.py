@@ -0,0 +1,170 @@
+"""
+An on-disk cache of the prepared matches for a genome.
+
+Every stage 1 step starts the same way: load the prefetch matches as a
+picklist, scan the databases for them, and build an LCA database from
+the non-identical matches. Scanning the databases is the slow part, and
+is repeated on every rerun even when nothing has changed.
+
+Here the matching signatures are saved as they are streamed out of the
+databases, in a gzipped file next to the other per-genome outputs. The
+cache is keyed by a hash of the inputs - the genome sketch, the prefetch
+matches CSV, the databases, and the lineages CSV - and when the key
+matches, the LCA database is rebuilt from the cached signatures, without
+touching the databases.
+
+Layout: gzipped text; the first line is a JSON header, and each further
+line is a signature in sourmash JSON format, in database order.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from sourmash.signature import (SourmashSignature, load_signatures,
+                                save_signatures)
+
+from . import utils
+from .taxonomy_cache import file_stat, hash_file
+
+
+FORMAT = 'charcoal_prepared_matches_v1'
+
+SUFFIX = '.prepared-matches.gz'
+
+
+def prepared_matches_filename(directory, genome_name):
+    "The prepared matches cache for a genome in a directory."
+    return os.path.join(directory, genome_name + SUFFIX)
+
+
+def prepared_matches_for_args(args, genome_name):
+    "The cache for a genome under --prepared-matches-dir, or None."
+    directory = getattr(args, 'prepared_matches_dir', None)
+    if directory:
+        return prepared_matches_filename(directory, genome_name)
+    return None
+
+
+def prepared_matches_key(databases, matches_csv, genome_mh, tax_assign):
+    """
+    Hash the inputs to load_matches_into_lca_database.
+
+    The genome sketch and matches CSV are hashed by content; databases
+    are large, so they are identified by path, size and mtime. The
+    lineages CSV hash is taken from the taxonomy cache. Returns None if
+    the inputs can't be identified, in which case there is no caching.
+    """
+    csv_hash = getattr(tax_assign, 'csv_hash', None)
+    if csv_hash is None:
+        return None
+
+    h = hashlib.sha256()
+    h.update(FORMAT.encode('ascii'))
+    h.update(f'{genome_mh.moltype}\0{genome_mh.ksize}\0{genome_mh.scaled}\0'.encode('ascii'))
+    h.update(SourmashSignature(genome_mh).md5sum().encode('ascii'))
+    h.update(hash_file(matches_csv))
+
+    for db in databases:
+        location = getattr(db, 'location', None)
+        if not location or not os.path.exists(location):
+            return None
+        size, mtime = file_stat(location)
+        h.update(f'{os.path.abspath(location)}\0{size}\0{mtime}\0'.encode('utf-8'))
+
+    h.update(csv_hash)
+
+    return h.hexdigest()
+
+
+def _read_header(cache_filename):
+    "Return the header of a cache file, or None if it can't be read."
+    try:
+        with gzip.open(cache_filename, 'rt') as fp:
+            header = json.loads(fp.readline())
+    except (OSError, EOFError, ValueError):
+        return None
+
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        return None
+    return header
+
+
+def _iter_cached_signatures(cache_filename):
+    "Yield the signatures in a cache file."
+    with gzip.open(cache_filename, 'rt') as fp:
+        fp.readline()                     # header
+        for line in fp:
+            yield from load_signatures(line)
+
+
+def _iter_and_save_signatures(signatures, key, cache_filename):
+    """
+    Yield 'signatures', saving them to a cache file as they go by.
+
+    The file is written to a temporary file and renamed into place once
+    all of the signatures have been seen, so a partial cache is never
+    left behind.
+    """
+    dirname = os.path.dirname(os.path.abspath(cache_filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        n = 0
+        with os.fdopen(fd, 'wb') as raw, \
+             gzip.open(raw, 'wt', compresslevel=1) as fp:
+            fp.write(json.dumps({ 'format': FORMAT, 'key': key }) + '\n')
+            for ss in signatures:
+                fp.write(save_signatures([ss]).decode('utf-8') + '\n')
+                n += 1
+                yield ss
+        os.chmod(tmpname, 0o644)          # mkstemp files are private
+        os.replace(tmpname, cache_filename)
+        print(f"saved {n} prepared matches to '{cache_filename}'")
+    finally:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+def load_prepared_matches(databases, matches_csv, genome_mh, tax_assign,
+                          taxonomy, cache_filename=None):
+    """
+    Load the prefetch matches for a genome into an LCA database.
+
+    The same as loading the picklist from 'matches_csv' and calling
+    utils.load_matches_into_lca_database, but if 'cache_filename' is
+    given, the matching signatures are cached there and reused while
+    the inputs are unchanged. Returns a PreparedMatches tuple.
+    """
+    key = None
+    if cache_filename:
+        key = prepared_matches_key(databases, matches_csv, genome_mh,
+                                   tax_assign)
+
+    if key:
+        header = _read_header(cache_filename)
+        if header and header.get('key') == key:
+            print(f"loading prepared matches from '{cache_filename}'")
+            signatures = _iter_cached_signatures(cache_filename)
+            return utils.load_matches_into_lca_database(None, None,
+                                                        genome_mh,
+                                                        tax_assign,
+                                                        taxonomy,
+                                                        signatures)
+        if header:
+            print(f"prepared matches in '{cache_filename}' are out of date; rebuilding.")
+
+    if key and not os.access(os.path.dirname(os.path.abspath(cache_filename)),
+                             os.W_OK):
+        print(f"cannot write prepared matches to '{cache_filename}'")
+        key = None
+
+    picklist = utils.load_prefetch_picklist(matches_csv)
+    signatures = utils.iter_matching_signatures(databases, picklist)
+    if key:
+        signatures = _iter_and_save_signatures(signatures, key,
+                                               cache_filename)
+
+    return utils.load_matches_into_lca_database(databases, picklist,
+                                                genome_mh, tax_assign,
+                                                taxonomy, signatures)
@@ -0,0 +1,441 @@
+#! /usr/bin/env python
+"""
+An SQLite store for the cohort-wide results.
+
+Each genome's stage 1 and stage 2 results are written as small CSV (or
+JSON) files, which are then concatenated into 'stage1_hitlist.csv',
+'stage1_genome_summary.csv' and 'stage2_summary.csv'. Looking up one
+genome in those files means reparsing the whole cohort. Here the same
+rows are loaded into indexed SQLite tables, one per output, and the
+combined CSVs are exported from them.
+
+Rows are upserted per source file: loading a file replaces the rows
+previously loaded from it, and files whose contents are unchanged are
+skipped, so the store can be updated incrementally as genomes finish.
+All values are kept as the strings in the CSV files, so the exported
+CSVs are the same as those from combine_csvs.
+
+Tables:
+
+* 'stage1_hitlist', 'stage1_genome_summary', 'stage2_summary' - the
+  columns of the per-genome CSV files, indexed by 'genome';
+* 'contam_pairs' - (genome, source_lineage, target_lineage, count)
+  loaded from '{genome}.contam_summary.json' files.
+"""
+import sys
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+from . import utils
+from . import metrics
+from .combine_csvs import DEFAULT_MAX_ROWS, load_file_list, sort_rows
+from .taxonomy_cache import file_stat, hash_file
+
+
+CSV_TABLES = ('stage1_hitlist', 'stage1_genome_summary', 'stage2_summary')
+CONTAM_TABLE = 'contam_pairs'
+TABLES = CSV_TABLES + (CONTAM_TABLE,)
+
+CONTAM_FIELDNAMES = ['genome', 'source_lineage', 'target_lineage', 'count']
+
+KEY = 'genome'
+
+# seconds to wait for other processes writing to the store.
+LOCK_TIMEOUT = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS _tables (name TEXT PRIMARY KEY,
+                                    fieldnames TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS _sources (tbl TEXT NOT NULL,
+                                     filename TEXT NOT NULL,
+                                     size INTEGER, mtime INTEGER,
+                                     sha256 TEXT, position INTEGER,
+                                     PRIMARY KEY (tbl, filename));
+"""
+
+
+def _quote(name):
+    "Quote an SQL identifier."
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _lineage_str(lineage):
+    "A lineage from a contamination summary, as ';'-separated names."
+    return ';'.join(name for _, name in lineage)
+
+
+def _load_contam_rows(filename):
+    "Rows for the contam_pairs table, from a contamination summary JSON."
+    with open(filename, 'rt') as fp:
+        x = json.load(fp)
+
+    rows = []
+    for genome, items in x.items():
+        for source, target, count in items:
+            rows.append({ 'genome': genome,
+                          'source_lineage': _lineage_str(source),
+                          'target_lineage': _lineage_str(target),
+                          'count': str(count) })
+    return CONTAM_FIELDNAMES, rows
+
+
+def _load_csv_rows(filename):
+    "The fieldnames and rows in a CSV file."
+    with open(filename, 'rt', newline='') as fp:
+        r = csv.DictReader(fp)
+        rows = list(r)
+        return r.fieldnames, rows
+
+
+class ResultsDB:
+    """
+    The cohort results store in an SQLite file.
+
+    The default rollback journal works on NFS & other shared filesystems;
+    'wal' switches the store to write-ahead logging, which lets readers
+    & a writer overlap, but needs a local filesystem.
+
+    'readonly' opens an existing store for lookups only: it neither
+    creates the schema nor takes the write lock.
+    """
+    def __init__(self, filename, wal=False, readonly=False):
+        self.filename = filename
+        if readonly:
+            if not os.path.exists(filename):
+                raise ValueError(f"no results store '{filename}'")
+            self.conn = sqlite3.connect(f'file:{filename}?mode=ro', uri=True,
+                                        timeout=LOCK_TIMEOUT,
+                                        isolation_level=None)
+            return
+
+        self.conn = sqlite3.connect(filename, timeout=LOCK_TIMEOUT,
+                                    isolation_level=None)
+        if wal:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        with self._write():
+            for statement in _SCHEMA.split(';'):
+                if statement.strip():
+                    self.conn.execute(statement)
+
+    @contextmanager
+    def _write(self):
+        """
+        A write transaction. It takes the write lock up front, so that
+        concurrent writers wait for each other rather than failing.
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fieldnames(self, table):
+        "The columns of a table, in CSV order; None if it doesn't exist."
+        c = self.conn.execute('SELECT fieldnames FROM _tables WHERE name=?',
+                              (table,))
+        row = c.fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def _create_table(self, table, fieldnames):
+        if KEY not in fieldnames:
+            raise ValueError(f"table '{table}' needs a '{KEY}' column")
+
+        existing = self.fieldnames(table)
+        if existing is not None:
+            if existing != fieldnames:
+                diff = set(existing) ^ set(fieldnames)
+                raise ValueError(f"disjoint fieldnames for table '{table}': {str(diff)}")
+            return
+
+        cols = ', '.join(f'{_quote(f)} TEXT' for f in fieldnames)
+        qt = _quote(table)
+        self.conn.execute(f'CREATE TABLE {qt} (_source TEXT NOT NULL, {cols})')
+        self.conn.execute(f'CREATE INDEX {_quote(table + "_key")} ON {qt} ({_quote(KEY)})')
+        self.conn.execute(f'CREATE INDEX {_quote(table + "_source")} ON {qt} (_source)')
+        self.conn.execute('INSERT INTO _tables VALUES (?, ?)',
+                          (table, json.dumps(fieldnames)))
+
+    def _is_loaded(self, table, filename):
+        """
+        Is this file loaded, and unchanged since? Checks size & mtime
+        first, and then the contents, since snakemake touches outputs.
+        """
+        c = self.conn.execute('SELECT size, mtime, sha256 FROM _sources WHERE tbl=? AND filename=?',
+                              (table, filename))
+        row = c.fetchone()
+        if row is None:
+            return False
+
+        size, mtime = file_stat(filename)
+        if (size, mtime) == tuple(row[:2]):
+            return True
+        if size != row[0] or hash_file(filename).hex() != row[2]:
+            return False
+
+        self.conn.execute('UPDATE _sources SET mtime=? WHERE tbl=? AND filename=?',
+                          (mtime, table, filename))
+        return True
+
+    def _upsert(self, table, filename, position):
+        "Replace the rows loaded from 'filename'; call in a transaction."
+        size, mtime = file_stat(filename)
+        sha256 = hash_file(filename).hex()
+        if table == CONTAM_TABLE:
+            fieldnames, rows = _load_contam_rows(filename)
+        else:
+            fieldnames, rows = _load_csv_rows(filename)
+            if fieldnames is None:        # empty file
+                raise ValueError(f"no CSV header in '{filename}'")
+
+        self._create_table(table, fieldnames)
+
+        qt = _quote(table)
+        cols = ', '.join(_quote(f) for f in ['_source'] + fieldnames)
+        marks = ', '.join('?' * (len(fieldnames) + 1))
+        self.conn.execute(f'DELETE FROM {qt} WHERE _source=?', (filename,))
+        self.conn.executemany(f'INSERT INTO {qt} ({cols}) VALUES ({marks})',
+                              [ [filename] + [ row[f] for f in fieldnames ]
+                                for row in rows ])
+
+        if position is None:
+            c = self.conn.execute('SELECT position FROM _sources WHERE tbl=? AND filename=?',
+                                  (table, filename))
+            row = c.fetchone()
+            if row is None:
+                c = self.conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM _sources WHERE tbl=?',
+                                      (table,))
+                row = c.fetchone()
+            position = row[0]
+
+        self.conn.execute('INSERT OR REPLACE INTO _sources VALUES (?, ?, ?, ?, ?, ?)',
+                          (table, filename, size, mtime, sha256, position))
+
+    def upsert(self, table, filename):
+        """
+        Load the rows from a per-genome CSV (or, for 'contam_pairs', a
+        contamination summary JSON) into 'table', replacing any rows
+        previously loaded from the same file.
+        """
+        assert table in TABLES, table
+        filename = os.path.abspath(filename)
+        with self._write():
+            self._upsert(table, filename, None)
+
+    def update(self, table, filenames):
+        """
+        Make 'table' hold the rows of exactly these files, in this order.
+
+        Files that are unchanged since they were loaded are not reread;
+        rows from files that are no longer listed are removed. Returns
+        the number of files loaded.
+        """
+        assert table in TABLES, table
+        filenames = [ os.path.abspath(f) for f in filenames ]
+
+        n_loaded = 0
+        with self._write():
+            c = self.conn.execute('SELECT filename FROM _sources WHERE tbl=?',
+                                  (table,))
+            old = set(row[0] for row in c) - set(filenames)
+            if old and self.fieldnames(table) is not None:
+                self.conn.executemany(f'DELETE FROM {_quote(table)} WHERE _source=?',
+                                      [ (f,) for f in old ])
+            self.conn.executemany('DELETE FROM _sources WHERE tbl=? AND filename=?',
+                                  [ (table, f) for f in old ])
+
+            for position, filename in enumerate(filenames):
+                if self._is_loaded(table, filename):
+                    self.conn.execute('UPDATE _sources SET position=? WHERE tbl=? AND filename=?',
+                                      (position, table, filename))
+                else:
+                    self._upsert(table, filename, position)
+                    n_loaded += 1
+
+        return n_loaded
+
+    def iter_rows(self, table, genome=None):
+        "Yield the rows in a table as dicts, in load order."
+        fieldnames = self.fieldnames(table)
+        if fieldnames is None:
+            return
+
+        cols = ', '.join(f't.{_quote(f)}' for f in fieldnames)
+        query = f"""SELECT {cols} FROM {_quote(table)} t
+                    JOIN _sources s ON s.tbl=? AND s.filename=t._source"""
+        params = [table]
+        if genome is not None:
+            query += f' WHERE t.{_quote(KEY)}=?'
+            params.append(genome)
+        query += ' ORDER BY s.position, t.rowid'
+
+        for row in self.conn.execute(query, params):
+            yield dict(zip(fieldnames, row))
+
+    def get(self, table, genome):
+        "The row for a genome, or None."
+        for row in self.iter_rows(table, genome):
+            return row
+        return None
+
+    def contam_summary(self, genome):
+        "A genome's contamination summary, as from load_contamination_summary."
+        z = []
+        for row in self.iter_rows(CONTAM_TABLE, genome):
+            z.append((utils.make_lineage(row['source_lineage']),
+                      utils.make_lineage(row['target_lineage']),
+                      int(row['count'])))
+        return z
+
+    def export_csv(self, table, fp, sort_by=None, reverse=False,
+                   max_rows=DEFAULT_MAX_ROWS, tmpdir=None):
+        "Write a table as CSV, sorted as combine_csvs does."
+        fieldnames = self.fieldnames(table)
+        if fieldnames is None:
+            raise ValueError(f"no table '{table}' in '{self.filename}'")
+
+        w = csv.DictWriter(fp, fieldnames)
+        w.writeheader()
+        with tempfile.TemporaryDirectory(dir=tmpdir) as tmpdir:
+            rows = sort_rows(self.iter_rows(table), fieldnames,
+                             sort_by or fieldnames[0], reverse, max_rows,
+                             tmpdir)
+            for row in rows:
+                w.writerow(row)
+
+
+class ResultsTable:
+    """
+    A table in the results store, looked up by genome like
+    CSV_DictHelper.
+    """
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filename = f'{db.filename}:{table}'
+
+    def __getitem__(self, k):
+        row = self.db.get(self.table, k)
+        if row is None:
+            raise KeyError(k)
+        return utils.AttrDict(row)
+
+    def __contains__(self, k):
+        return self.db.get(self.table, k) is not None
+
+    def __iter__(self):
+        for row in self.db.iter_rows(self.table):
+            yield row[KEY]
+
+    def __len__(self):
+        c = self.db.conn.execute(f'SELECT COUNT(*) FROM {_quote(self.table)}')
+        return c.fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_hit_list(hit_list_csv, results_db=None):
+    """
+    The hit list from a results store if given, else from the CSV; close
+    it when done, or use it as a context manager.
+    """
+    if results_db:
+        return ResultsTable(ResultsDB(results_db, readonly=True),
+                            'stage1_hitlist')
+    return utils.IndexedCSV_DictHelper(hit_list_csv, KEY)
+
+
+def _metrics_output(args):
+    "Name the metrics after the exported CSV, or the store & table."
+    if args.export and args.export != '-':
+        return args.export
+    return f'{args.db}.{args.table}'
+
+
+@metrics.record('results_db', output=_metrics_output)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    inputs = list(args.inputs)
+    if args.file_list:
+        inputs += load_file_list(args.file_list)
+
+    with ResultsDB(args.db, args.wal) as db:
+        if inputs:
+            try:
+                with metrics.phase('update'):
+                    n_loaded = db.update(args.table, inputs)
+                    metrics.count('files', n_loaded)
+            except ValueError as exc:
+                print(f'error! {exc}', file=sys.stderr)
+                return -1
+            print(f"loaded {n_loaded} of {len(inputs)} files into '{args.table}'",
+                  file=sys.stderr)
+
+        if args.export:
+            with metrics.phase('export'):
+                if args.export == '-':
+                    db.export_csv(args.table, sys.stdout, args.sort_by,
+                                  args.reverse, args.max_rows, args.tmpdir)
+                else:
+                    with open(args.export, 'wt', newline='') as fp:
+                        db.export_csv(args.table, fp, args.sort_by,
+                                      args.reverse, args.max_rows,
+                                      args.tmpdir)
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('db', help='SQLite results store')
+    p.add_argument('table', choices=TABLES)
+    p.add_argument('inputs', nargs='*',
+                   help='per-genome CSVs (or contamination summary JSONs)')
+    p.add_argument('--file-list',
+                   help="file containing input filenames, one per line; '-' for stdin")
+    p.add_argument('--export', help="export the table as CSV; '-' for stdout")
+    p.add_argument('--sort-by', default=None)
+    p.add_argument('--reverse', action='store_true')
+    p.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS,
+                   help='maximum number of rows to sort in memory')
+    p.add_argument('--tmpdir', help='directory for temporary sorted runs')
+    p.add_argument('--wal', action='store_true',
+                   help='use write-ahead logging; not on NFS')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    if args.max_rows < 1:
+        p.error('--max-rows must be at least 1')
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,498 @@
+#! /usr/bin/env python
+"""
+Run all of stage 1 on a genome in a single pass: contigs taxonomy,
+hit list & genome summary, and contaminant matches.
+
+This does the same work as contigs_search_taxonomy, compare_taxonomy,
+and contigs_list_contaminants, but only loads the taxonomy, selects the
+prefetch matches, and builds the LCA database once. Each contig is
+hashed and gathered once, too.
+
+In batch mode (--genome-list) many genomes are run in one process, w/the
+taxonomy & databases loaded once; with --shard, only one shard of the
+list is run. --sketch and --prefetch also build each genome's sketches
+and prefetch matches in-process, as the contigs_sig_wc and
+prefetch_all_matches_wc rules would.
+"""
+import sys
+import argparse
+import os.path
+import itertools
+from collections import defaultdict, namedtuple
+
+
+import sourmash
+from sourmash.search import prefetch_database
+
+from . import utils
+from . import metrics
+from .version import version
+from .taxonomy_cache import load_taxonomy
+from .taxonomy_index import build_taxonomy_index
+from .contigs_tax import save_contigs_tax, SUFFIXES
+from .utils import ContigGatherInfo
+from .compare_taxonomy import (GATHER_MIN_MATCHES, F_IDENT_THRESHOLD,
+                               F_MAJOR_THRESHOLD, check_exact_matches,
+                               classify_genome, load_provided_lineages,
+                               summarize_genome, write_hit_list,
+                               write_genome_summary)
+from .contigs_list_contaminants import record_matches, save_matches_json
+from .contig_sketches import (load_contigs, contig_minhash, sketch_genome,
+                              MOLTYPES)
+from .prepared_matches import load_prepared_matches, prepared_matches_for_args
+from .results_db import ResultsDB
+
+
+def search_contig(contig, empty_mh, lca_db, lin_db, match_rank):
+    """
+    Gather a single contig, once.
+
+    Returns (name, ContigGatherInfo, matches above threshold).
+    """
+    # look at each contig individually
+    mh = contig_minhash(contig, empty_mh)
+
+    # collect all the gather matches, in order.
+    matches = list(utils.gather_matches(mh, lca_db, lin_db))
+
+    # aggregate at match_rank, together w/counts; here, results is
+    # a list of (lineage, count) tuples.
+    results = list(utils.aggregate_at_rank(matches, match_rank, lin_db))
+    info = ContigGatherInfo(contig.length, len(mh), results)
+
+    # only matches above threshold are tracked as clean or dirty.
+    matches = list(itertools.takewhile(lambda m: m[2] >= GATHER_MIN_MATCHES,
+                                       matches))
+
+    return contig.name, info, matches
+
+
+def search_contigs(genome_filename, empty_mh, lca_db, lin_db, match_rank,
+                   genome_lin, threads=1, contig_sketches=None):
+    """
+    Gather each contig once; classify contigs & collect contaminant matches.
+
+    Returns the contigs taxonomy dictionary, and (matches_info,
+    matches_counts) as used by contigs_list_contaminants.
+    """
+    contigs_tax = {}
+    matches_info = {}
+    matches_counts = defaultdict(int)
+
+    # gather contigs, in parallel if requested; results are in order.
+    utils.get_gather_md5sums(lca_db)
+    records = load_contigs(genome_filename, empty_mh, contig_sketches)
+    records = metrics.timed_iter('read_contigs', records)
+    results = utils.map_contigs(search_contig, records,
+                                (empty_mh, lca_db, lin_db, match_rank),
+                                threads=threads)
+
+    with metrics.phase('gather_contigs'):
+        for name, info, matches in results:
+            contigs_tax[name] = info
+            metrics.count('contigs')
+            metrics.count('bp', info.length)
+            metrics.count('hashes', info.num_hashes)
+
+            # track matches above threshold as clean or dirty.
+            record_matches(matches, genome_lin, match_rank, matches_info,
+                           matches_counts, lin_db.taxonomy)
+
+    print(f"Processed {len(contigs_tax)} contigs.")
+
+    return contigs_tax, (matches_info, matches_counts)
+
+
+Stage1Outputs = namedtuple('Stage1Outputs',
+                           ['json_out', 'hit_list', 'genome_summary',
+                            'contam_summary_json', 'matches_json'])
+
+
+def outputs_in_directory(output_dir, genome_name, contigs_tax_format='json'):
+    "Name the stage 1 outputs for a genome as the Snakefile does."
+    prefix = os.path.join(output_dir, genome_name)
+    return Stage1Outputs(prefix + SUFFIXES[contigs_tax_format],
+                         prefix + '.hitlist_for_filtering.csv',
+                         prefix + '.genome_summary.csv',
+                         prefix + '.contam_summary.json',
+                         prefix + '.matches.json')
+
+
+def run_genome(genome, genome_sig, matches_csv, outputs, databases,
+               tax_assign, taxonomy, provided_lineages, match_rank,
+               min_f_ident, min_f_major, threads=1, contig_sketches=None,
+               prepared_matches=None):
+    "Run all of stage 1 on one genome, and save to 'outputs'."
+    genome_name = os.path.basename(genome)
+    provided_lineage = provided_lineages.get(genome_name, '')
+
+    print(f"working on {genome_name}")
+
+    # load the genome signature
+    genome_sig = sourmash.load_one_signature(genome_sig)
+    entire_mh = genome_sig.minhash
+
+    # load the matches from prefetch as a picklist, and then stream all
+    # of the matches in the database into an LCA database & lineage
+    # database -- once -- removing exact matches & duplicates as we go.
+    # (or load them from the prepared matches cache.)
+    with metrics.phase('load_matches'):
+        prepared = load_prepared_matches(databases, matches_csv, entire_mh,
+                                         tax_assign, taxonomy,
+                                         prepared_matches)
+        metrics.count('matches', prepared.n_loaded)
+
+    print(f"loaded {prepared.n_loaded} matches from '{matches_csv}'")
+
+    exact_siglist = prepared.exact_siglist
+    if prepared.empty_mh is not None:
+        assert entire_mh.scaled == prepared.empty_mh.scaled
+    elif exact_siglist:
+        assert entire_mh.scaled == exact_siglist[0].minhash.scaled
+
+    comment = check_exact_matches(exact_siglist, provided_lineage)
+
+    # the LCA database is built on non-identical matches, but leave exact
+    # matches in for genome classification if they're the only matches.
+    has_nonexact = prepared.lca_db is not None
+    lca_db, lin_db = prepared.lca_db, prepared.lin_db
+    if not has_nonexact and exact_siglist and not comment:
+        siglist = utils.remove_duplicate_signatures(exact_siglist)
+        lca_db, lin_db = utils.build_lca_database(siglist, tax_assign,
+                                                  taxonomy)
+
+    # classify the genome, as in compare_taxonomy.get_genome_taxonomy.
+    if not prepared.n_loaded:
+        comment = 'no matches for this genome.'
+        print(comment)
+        x = None, comment, False, 0.0, 0.0
+    elif comment:
+        x = None, comment, True, 1.0, 1.0
+    else:
+        with metrics.phase('classify_genome'):
+            x = classify_genome(entire_mh, lca_db, lin_db, provided_lineage,
+                                match_rank, min_f_ident, min_f_major)
+    genome_lineage, comment, needs_lineage, f_major, f_ident = x
+
+    # genome lineage, as reported in the hit list.
+    if genome_lineage and not comment:
+        genome_lin = genome_lineage
+    else:
+        genome_lin = ()
+
+    # classify contigs, unless there are no non-identical matches.
+    contigs_tax = {}
+    matches_info = {}
+    matches_counts = {}
+    scaled = entire_mh.scaled
+    if has_nonexact:
+        empty_mh = prepared.empty_mh
+        scaled = empty_mh.scaled
+
+        print('')
+        print(f'reading contigs from {genome_name}')
+        contigs_tax, (matches_info, matches_counts) = \
+            search_contigs(genome, empty_mh, lca_db, lin_db,
+                           match_rank, genome_lin, threads, contig_sketches)
+    else:
+        print('no non-identical matches for this genome.')
+
+    # summarize contamination.
+    with metrics.phase('summarize_genome'):
+        vals, contam = summarize_genome(genome_name, contigs_tax,
+                                        genome_lineage, comment,
+                                        needs_lineage, f_major, f_ident,
+                                        match_rank, taxonomy)
+
+    with metrics.phase('write_outputs'):
+        # save contigs taxonomy!
+        save_contigs_tax(contigs_tax, outputs.json_out)
+
+        # output hit list and genome summary.
+        summary_items = [(genome_name, vals)]
+        write_hit_list(summary_items, outputs.hit_list)
+        write_genome_summary(summary_items, outputs.genome_summary)
+
+        print(f"processed {genome_name}.")
+
+        print(f"saving contamination summary to {outputs.contam_summary_json}")
+        with open(outputs.contam_summary_json, 'wt') as fp:
+            utils.save_contamination_summary({ genome_name: contam }, fp)
+
+        # save clean/dirty matches!
+        with open(outputs.matches_json, 'wt') as fp:
+            save_matches_json(fp, genome_name, genome_lin, match_rank,
+                              scaled, matches_info, matches_counts)
+
+    return 0
+
+
+def prefetch_genome(genome_sig, databases, matches_csv, log_txt, scaled,
+                    threshold_bp):
+    """
+    Find all matches to a genome in the (opened) databases and save them
+    to a CSV, as 'sourmash prefetch' does; log to 'log_txt'.
+    """
+    query = sourmash.load_one_signature(genome_sig)
+    query_mh = query.minhash
+    if query_mh.track_abundance:
+        query_mh = query_mh.flatten()
+    if scaled and scaled != query_mh.scaled:
+        query_mh = query_mh.downsample(scaled=scaled)
+    query.minhash = query_mh
+
+    with open(log_txt, 'wt') as logfp:
+        def log(msg):
+            print(msg, file=logfp)
+
+        log(f'loaded query: {str(query)[:30]}... (k={query_mh.ksize}, {query_mh.moltype})')
+        if not len(query_mh):
+            log('no query hashes!? exiting.')
+            print(f"no query hashes in '{genome_sig}'", file=sys.stderr)
+            return -1
+
+        n_matches = 0
+        did_a_search = False
+        with open(matches_csv, 'wt', newline='') as csvfp:
+            w = None
+            for db in databases:
+                location = getattr(db, 'location', '')
+                db = db.select(ksize=query_mh.ksize,
+                               moltype=query_mh.moltype,
+                               containment=True, scaled=True)
+                if not db:
+                    log(f"...no compatible signatures in '{location}'; skipping")
+                    continue
+
+                for result in prefetch_database(query, db, threshold_bp):
+                    if w is None:
+                        w = result.init_dictwriter(csvfp)
+                    result.write(w)
+                    n_matches += 1
+                did_a_search = True
+
+        if not did_a_search:
+            log('ERROR in prefetch: no compatible signatures in any databases?!')
+            print(f"no compatible databases for '{genome_sig}'", file=sys.stderr)
+            return -1
+
+        log(f"saved {n_matches} matches to CSV file '{matches_csv}'")
+        metrics.count('prefetch_matches', n_matches)
+
+    return 0
+
+
+def save_to_results_db(db, outputs):
+    "Upsert a genome's hit list, summary & contamination into the store."
+    db.upsert('stage1_hitlist', outputs.hit_list)
+    db.upsert('stage1_genome_summary', outputs.genome_summary)
+    db.upsert('contam_pairs', outputs.contam_summary_json)
+
+
+def run_batch_genome(args, genome_name, input_dir, output_dir,
+                     contigs_tax_format, databases, tax_assign, taxonomy,
+                     provided_lineages, threads, results_db):
+    "Run all of stage 1 on one genome in batch mode; see main."
+    genome = os.path.join(args.genome_dir, genome_name)
+    prefix = os.path.join(input_dir, genome_name)
+    outputs = outputs_in_directory(output_dir, genome_name,
+                                   contigs_tax_format)
+    sketches = prefix + '.contigs.sketch'
+
+    # build the genome signature & contig sketches, and prefetch?
+    if getattr(args, 'sketch', False):
+        sketch_genome(genome, sketches, prefix + '.sig', args.ksize,
+                      args.scaled, args.moltype)
+    if getattr(args, 'prefetch', False):
+        with metrics.phase('prefetch'):
+            status = prefetch_genome(prefix + '.sig', databases,
+                                     prefix + '.matches.csv',
+                                     prefix + '.matches.txt',
+                                     args.prefetch_scaled, args.threshold_bp)
+        if status != 0:
+            return status
+
+    if not os.path.exists(sketches):
+        sketches = None
+    status = run_genome(genome, prefix + '.sig', prefix + '.matches.csv',
+                        outputs, databases, tax_assign, taxonomy,
+                        provided_lineages, args.match_rank,
+                        args.min_f_ident, args.min_f_major, threads, sketches,
+                        prepared_matches_for_args(args, genome_name))
+    if status == 0 and results_db:
+        with metrics.phase('save_results_db'):
+            save_to_results_db(results_db, outputs)
+
+    return status
+
+
+def _metrics_output(args):
+    "Name the metrics for a genome, or for a batch/shard of genomes."
+    if not getattr(args, 'genome_list', None):
+        return args.hit_list
+
+    shard = getattr(args, 'shard', None)
+    name = 'stage1' if shard is None else f'stage1.shard{shard}'
+    return os.path.join(args.output_directory or args.input_directory, name)
+
+
+@metrics.record('stage1', output=_metrics_output)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    match_rank = args.match_rank
+    threads = getattr(args, 'threads', 1)
+
+    assert match_rank in ('superkingdom', 'phylum', 'class', 'order',
+                          'family', 'genus'), match_rank
+
+    with metrics.phase('load_taxonomy'):
+        # load taxonomy CSV
+        tax_assign, _ = load_taxonomy(args.lineages_csv)
+        print(f'loaded {len(tax_assign)} tax assignments.')
+        taxonomy = build_taxonomy_index(tax_assign)
+
+        # load the provided lineages file
+        provided_lineages = load_provided_lineages(args.provided_lineages)
+        print(f"loaded {len(provided_lineages)} provided lineages")
+
+    # open the databases once, for all genomes.
+    with metrics.phase('load_databases'):
+        databases = utils.load_databases(args.databases)
+
+    # add results to the results store, as each genome finishes?
+    results_db = None
+    if getattr(args, 'results_db', None):
+        results_db = ResultsDB(args.results_db)
+
+    # batch mode: run on many genomes, with taxonomy & databases loaded.
+    genome_list = getattr(args, 'genome_list', None)
+    if genome_list:
+        genome_names = utils.load_genome_list(genome_list)
+        print(f"loaded {len(genome_names)} genomes from '{genome_list}'")
+
+        shard = getattr(args, 'shard', None)
+        if shard is not None:
+            start = shard * args.shard_size
+            genome_names = genome_names[start:start + args.shard_size]
+            print(f"running on shard {shard}: {len(genome_names)} genomes")
+
+        input_dir = args.input_directory
+        output_dir = args.output_directory or input_dir
+        contigs_tax_format = getattr(args, 'contigs_tax_format', 'json')
+        for genome_name in genome_names:
+            print('')
+            with metrics.genome(genome_name):
+                status = run_batch_genome(args, genome_name, input_dir,
+                                          output_dir, contigs_tax_format,
+                                          databases, tax_assign, taxonomy,
+                                          provided_lineages, threads,
+                                          results_db)
+            if status != 0:
+                return status
+
+        return 0
+
+    outputs = Stage1Outputs(args.json_out, args.hit_list, args.genome_summary,
+                            args.contam_summary_json, args.matches_json)
+    genome_name = os.path.basename(args.genome)
+    with metrics.genome(genome_name):
+        status = run_genome(args.genome, args.genome_sig, args.matches_csv,
+                            outputs, databases, tax_assign, taxonomy,
+                            provided_lineages, match_rank, args.min_f_ident,
+                            args.min_f_major, threads,
+                            getattr(args, 'contig_sketches', None),
+                            prepared_matches_for_args(args, genome_name))
+        if status == 0 and results_db:
+            with metrics.phase('save_results_db'):
+                save_to_results_db(results_db, outputs)
+
+    return status
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('--genome', help='genome file')
+    p.add_argument('--genome-sig', help='genome sig')
+    p.add_argument('--matches-csv', help='all relevant matches')
+    p.add_argument('--databases', help='sourmash databases', required=True,
+                   nargs='+')
+    p.add_argument('--lineages-csv', help='lineage spreadsheet', required=True)
+    p.add_argument('--provided-lineages', help='provided lineages')
+    p.add_argument('--min_f_ident', type=float, default=F_IDENT_THRESHOLD)
+    p.add_argument('--min_f_major', type=float, default=F_MAJOR_THRESHOLD)
+    p.add_argument('--match-rank', required=True)
+    p.add_argument('--force', help='continue past survivable errors',
+                   action='store_true')
+    p.add_argument('--threads', type=int, default=1,
+                   help='number of processes to use for classifying contigs')
+    p.add_argument('--contig-sketches',
+                   help='contig sketches for the genome, instead of rehashing it')
+    p.add_argument('--prepared-matches-dir',
+                   help='directory in which to cache prepared matches for each genome')
+    p.add_argument('--results-db',
+                   help='SQLite results store to add each genome\'s results to')
+
+    p.add_argument('--json-out',
+                   help='output file of all contigs tax results; JSON if it ends in .json, else binary')
+    p.add_argument('--hit-list')
+    p.add_argument('--genome-summary')
+    p.add_argument('--contam-summary-json')
+    p.add_argument('--matches-json',
+                   help='JSON output file of all matches')
+
+    # batch mode
+    p.add_argument('--genome-list',
+                   help='file of genome names to run on, in batch mode')
+    p.add_argument('--genome-dir', help='directory containing genomes')
+    p.add_argument('--input-directory',
+                   help='directory containing {genome}.sig and {genome}.matches.csv')
+    p.add_argument('--output-directory',
+                   help='directory for per-genome outputs (default: input directory)')
+    p.add_argument('--contigs-tax-format', default='json',
+                   choices=sorted(SUFFIXES),
+                   help='format for {genome}.contigs-tax.* outputs')
+    p.add_argument('--shard', type=int,
+                   help='run only on this shard (0-based) of the genome list')
+    p.add_argument('--shard-size', type=int,
+                   help='number of genomes in each shard')
+
+    # batch mode: build inputs in-process
+    p.add_argument('--sketch', action='store_true',
+                   help='save {genome}.sig and {genome}.contigs.sketch in the input directory first')
+    p.add_argument('-k', '--ksize', type=int, default=31)
+    p.add_argument('--scaled', type=int, default=1000)
+    p.add_argument('--moltype', default='DNA', choices=MOLTYPES)
+    p.add_argument('--prefetch', action='store_true',
+                   help='save {genome}.matches.csv (& .txt) in the input directory first')
+    p.add_argument('--prefetch-scaled', type=int, default=1000,
+                   help='scaled at which to prefetch matches')
+    p.add_argument('--threshold-bp', type=float,
+                   help='prefetch threshold (default: 3 x --prefetch-scaled)')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    if args.threshold_bp is None:
+        args.threshold_bp = args.prefetch_scaled * 3
+
+    if args.genome_list:
+        if not (args.genome_dir and args.input_directory):
+            p.error('--genome-list requires --genome-dir and --input-directory')
+        if (args.shard is None) != (args.shard_size is None):
+            p.error('--shard and --shard-size must be given together')
+        if args.shard_size is not None and args.shard_size < 1:
+            p.error('--shard-size must be at least 1')
+    elif not (args.genome and args.genome_sig and args.matches_csv and \
+              args.json_out and args.hit_list and args.genome_summary and \
+              args.contam_summary_json and args.matches_json):
+        p.error('--genome, --genome-sig, --matches-csv, and all output files are required')
+    elif args.shard is not None or args.sketch or args.prefetch:
+        p.error('--shard, --sketch and --prefetch require --genome-list')
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
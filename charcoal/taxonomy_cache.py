@@ -0,0 +1,300 @@
+#! /usr/bin/env python
+"""
+A compiled, memory-mapped cache of a lineages CSV.
+
+Parsing a large lineages spreadsheet (e.g. GTDB) with
+sourmash.lca.command_index.load_taxonomy_assignments is slow, and every
+stage 1 step needs it. Here we parse the CSV once, and save identifiers
+and lineages in a compact binary file next to it. The cache records the
+size, mtime, and SHA256 of the CSV, and is rebuilt when the CSV changes.
+
+Loading the cache mmaps the file; identifiers are found by binary search,
+and lineages are only turned into LineagePair tuples when looked up.
+
+Layout (little-endian; each section is padded to 8 bytes):
+
+* header - see HEADER;
+* taxon name offsets (n_names + 1 uint64) and UTF-8 name data;
+* lineage table (n_lineages x len(RANKS) int32 name ids, -1 padded);
+* identifier offsets (n_idents + 1 uint64), lineage id for each
+  identifier (n_idents uint32), and UTF-8 identifier data, sorted.
+"""
+import sys
+import os
+import argparse
+import hashlib
+import mmap
+import struct
+from bisect import bisect_left
+from collections.abc import Mapping
+
+from sourmash.lca import LineagePair, taxlist
+from sourmash.lca.command_index import load_taxonomy_assignments
+
+from .version import version
+from . import metrics
+from .binary_format import pad, strings_table, write_sections, SortedStrings
+
+
+MAGIC = b'CHTAXC01'
+RANKS = tuple(taxlist())
+
+# magic, CSV size, CSV mtime (ns), CSV sha256, num_rows, n_idents,
+# n_lineages, n_names.
+HEADER = struct.Struct('<8sQq32sQQQQ')
+
+CACHE_SUFFIX = '.taxcache'
+
+
+def file_stat(filename):
+    "Return (size, mtime in ns) for a file."
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+
+def hash_file(filename):
+    "Return the SHA256 digest of a file's contents."
+    h = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+        while 1:
+            block = fp.read(1024*1024)
+            if not block:
+                break
+            h.update(block)
+    return h.digest()
+
+
+def compile_taxonomy(assignments, num_rows, csv_size, csv_mtime, csv_hash,
+                     cache_filename):
+    """
+    Write 'assignments' (as from load_taxonomy_assignments) to a cache file.
+
+    The file is written to a temporary file and renamed into place, so
+    concurrent readers never see a partial cache.
+    """
+    names = {}
+    lineages = {}
+    lineage_table = []
+
+    idents = sorted(assignments, key=lambda x: x.encode('utf-8'))
+    ident_lids = []
+    for ident in idents:
+        lineage = assignments[ident]
+        lid = lineages.get(lineage)
+        if lid is None:
+            lid = len(lineages)
+            lineages[lineage] = lid
+
+            row = [-1] * len(RANKS)
+            for i, pair in enumerate(lineage):
+                assert pair.rank == RANKS[i], (pair.rank, RANKS[i])
+                row[i] = names.setdefault(pair.name, len(names))
+            lineage_table.extend(row)
+
+        ident_lids.append(lid)
+
+    name_offsets, name_data = strings_table(names)
+    ident_offsets, ident_data = strings_table(idents)
+
+    sections = [name_offsets, name_data,
+                struct.pack(f'<{len(lineage_table)}i', *lineage_table),
+                ident_offsets,
+                struct.pack(f'<{len(ident_lids)}I', *ident_lids),
+                ident_data]
+
+    header = HEADER.pack(MAGIC, csv_size, csv_mtime, csv_hash, num_rows,
+                         len(idents), len(lineages), len(names))
+
+    write_sections(cache_filename, header, sections)
+
+
+def _update_csv_mtime(cache_filename, csv_mtime):
+    "Record a new CSV mtime in the cache header, after a hash match."
+    with open(cache_filename, 'r+b') as fp:
+        fp.seek(16)                       # after magic & CSV size
+        fp.write(struct.pack('<q', csv_mtime))
+
+
+class TaxonomyCache(Mapping):
+    """
+    A read-only, memory-mapped dictionary of identifiers to lineages.
+
+    Behaves like the 'assignments' dictionary returned by
+    load_taxonomy_assignments.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buf = memoryview(self._mm)
+        if len(buf) < HEADER.size:
+            raise ValueError(f"'{filename}' is not a charcoal taxonomy cache")
+
+        (magic, self.csv_size, self.csv_mtime, self.csv_hash, self.num_rows,
+         n_idents, n_lineages, n_names) = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError(f"'{filename}' is not a charcoal taxonomy cache")
+
+        pos = pad(HEADER.size)
+
+        def section(nbytes, fmt=None):
+            nonlocal pos
+            view = buf[pos:pos + nbytes]
+            pos += pad(nbytes)
+            if fmt:
+                view = view.cast(fmt)
+            return view
+
+        self._name_offsets = section(8 * (n_names + 1), 'Q')
+        self._names = section(self._name_offsets[-1])
+        self._lineage_table = section(4 * n_lineages * len(RANKS), 'i')
+        ident_offsets = section(8 * (n_idents + 1), 'Q')
+        self._ident_lids = section(4 * n_idents, 'I')
+        ident_data = section(ident_offsets[-1])
+
+        self._idents = SortedStrings(ident_data, ident_offsets, n_idents)
+        self._lineage_cache = {}
+
+    def is_valid_for(self, csv_filename):
+        """
+        Check that this cache was built from the given CSV.
+
+        If size & mtime match, the cache is valid; if only the size
+        matches, fall back to comparing the content hash.
+        """
+        size, mtime = file_stat(csv_filename)
+        if size != self.csv_size:
+            return False
+        if mtime == self.csv_mtime:
+            return True
+        return hash_file(csv_filename) == self.csv_hash
+
+    def _name(self, name_id):
+        start = self._name_offsets[name_id]
+        end = self._name_offsets[name_id + 1]
+        return str(self._names[start:end], 'utf-8')
+
+    def lineage_id(self, ident):
+        "Return the integer id of the lineage for 'ident'; KeyError if none."
+        if not isinstance(ident, str):
+            raise KeyError(ident)
+
+        key = ident.encode('utf-8')
+        i = bisect_left(self._idents, key)
+        if i == len(self._idents) or self._idents[i] != key:
+            raise KeyError(ident)
+        return self._ident_lids[i]
+
+    def get_lineage(self, lid):
+        "Return the lineage (a tuple of LineagePair) for a lineage id."
+        lineage = self._lineage_cache.get(lid)
+        if lineage is None:
+            start = lid * len(RANKS)
+            lineage = []
+            for rank, name_id in zip(RANKS,
+                                     self._lineage_table[start:start + len(RANKS)]):
+                if name_id < 0:
+                    break
+                lineage.append(LineagePair(rank, self._name(name_id)))
+            lineage = tuple(lineage)
+            self._lineage_cache[lid] = lineage
+
+        return lineage
+
+    def distinct_lineages(self):
+        "Yield each distinct lineage in the cache, once, in lineage id order."
+        for lid in range(len(self._lineage_table) // len(RANKS)):
+            yield self.get_lineage(lid)
+
+    def __getitem__(self, ident):
+        return self.get_lineage(self.lineage_id(ident))
+
+    def __contains__(self, ident):
+        try:
+            self.lineage_id(ident)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._idents)
+
+    def __iter__(self):
+        for i in range(len(self._idents)):
+            yield str(self._idents[i], 'utf-8')
+
+
+def load_taxonomy(lineages_csv, cache_filename=None):
+    """
+    Load taxonomy assignments from a lineages CSV, via a compiled cache.
+
+    Returns (assignments, num_rows), as load_taxonomy_assignments does.
+    The cache defaults to '{lineages_csv}.taxcache'; if it is missing
+    or stale it is rebuilt. If it can't be written, the parsed CSV is
+    used directly.
+    """
+    if cache_filename is None:
+        cache_filename = lineages_csv + CACHE_SUFFIX
+
+    try:
+        cache = TaxonomyCache(cache_filename)
+        if cache.is_valid_for(lineages_csv):
+            # CSV touched but not changed? skip the hash next time.
+            _, csv_mtime = file_stat(lineages_csv)
+            if csv_mtime != cache.csv_mtime:
+                try:
+                    _update_csv_mtime(cache_filename, csv_mtime)
+                    cache.csv_mtime = csv_mtime
+                except OSError:
+                    pass
+            return cache, cache.num_rows
+        print(f"taxonomy cache '{cache_filename}' is out of date; rebuilding.")
+    except (OSError, ValueError):
+        pass
+
+    csv_size, csv_mtime = file_stat(lineages_csv)
+    csv_hash = hash_file(lineages_csv)
+    assignments, num_rows = load_taxonomy_assignments(lineages_csv,
+                                                      start_column=2)
+
+    try:
+        compile_taxonomy(assignments, num_rows, csv_size, csv_mtime,
+                         csv_hash, cache_filename)
+        print(f"saved taxonomy cache to '{cache_filename}'")
+    except OSError as exc:
+        print(f"cannot write taxonomy cache '{cache_filename}': {exc}")
+        return assignments, num_rows
+
+    cache = TaxonomyCache(cache_filename)
+    return cache, cache.num_rows
+
+
+@metrics.record('taxonomy_cache',
+                output=lambda args: args.output or args.lineages_csv + CACHE_SUFFIX)
+def main(args):
+    "Main entry point for scripting. Use cmdline for command line entry."
+    with metrics.phase('load_taxonomy'):
+        tax_assign, num_rows = load_taxonomy(args.lineages_csv, args.output)
+        metrics.count('rows', num_rows)
+    print(f'{len(tax_assign)} tax assignments from {num_rows} rows are cached.')
+
+    return 0
+
+
+def cmdline(sys_args):
+    "Command line entry point w/argparse action."
+    p = argparse.ArgumentParser(sys_args)
+    p.add_argument('lineages_csv', help='lineage spreadsheet')
+    p.add_argument('-o', '--output',
+                   help='cache file (default: {lineages_csv}.taxcache)')
+    metrics.add_argument(p)
+    args = p.parse_args()
+
+    return main(args)
+
+
+# execute this, when run with `python -m`.
+if __name__ == '__main__':
+    returncode = cmdline(sys.argv[1:])
+    sys.exit(returncode)
@@ -0,0 +1,194 @@
+"""
+An integer index of the taxonomy tree.
+
+Each distinct lineage (tuple of LineagePair) is a node with an integer
+lineage id, 'lid'; node 0 is the root, the empty lineage. Adding a
+lineage adds all of its ancestors, and precomputes for each rank the
+ancestor at that rank, so that rank matches, pop-to-rank, and lowest
+common ancestor queries are integer operations instead of walks over
+tuples of LineagePair.
+
+The results are the same as the sourmash.lca functions is_lineage_match,
+pop_to_rank, build_tree/find_lca, and utils.find_disagree_rank.
+
+The index is built once from the loaded taxonomy, with
+build_taxonomy_index, and is then only read: looking up a lineage that
+is not in it never adds it, so memory use and lids don't depend on
+which genomes are processed, or in what order. Whoever loads the
+taxonomy holds the index, and passes it to LineageDB and the rest.
+"""
+from sourmash.lca import taxlist
+from sourmash.lca.lca_utils import pop_to_rank
+
+
+RANKS = tuple(taxlist())
+RANK_INDEX = { rank: i for i, rank in enumerate(RANKS) }
+
+
+class TaxonomyIndex:
+    """
+    Integer node ids for lineages, with per-rank ancestors.
+
+    * 'lid_to_lineage[lid]' is the lineage for a lineage id;
+    * 'lineage_to_lid' is a dictionary from lineage to lineage id.
+    """
+    def __init__(self):
+        self.lineage_to_lid = {}
+        self.lid_to_lineage = []
+
+        # for each lid: lids of lineage[:i], for i in 0..len(lineage).
+        self._prefixes = []
+        # for each lid: lid of pop_to_rank(lineage, rank), for each rank.
+        self._at_rank = []
+        # ...the same, but -1 unless the lineage goes down to that rank.
+        self._match_at_rank = []
+        # for each lid: lid of the lineage without empty names.
+        self._named = []
+
+        root = self.add(())
+        assert root == 0
+
+    def __len__(self):
+        return len(self.lid_to_lineage)
+
+    def lineage_id(self, lineage):
+        "Return the lineage id for 'lineage', or None if it's not indexed."
+        try:
+            return self.lineage_to_lid.get(lineage)
+        except TypeError:                    # list, not tuple
+            return self.lineage_to_lid.get(tuple(lineage))
+
+    def match_id(self, lineage):
+        """
+        Return the lid of the longest prefix of 'lineage' that is indexed.
+
+        For is_match and match_mask against lineages in the index, this
+        is the same as the lid of 'lineage' itself, so lineages from
+        outside the taxonomy (e.g. provided genome lineages) can be
+        compared without adding them.
+        """
+        lineage = tuple(lineage)
+        for i in range(len(lineage), 0, -1):
+            lid = self.lineage_to_lid.get(lineage[:i])
+            if lid is not None:
+                return lid
+        return 0
+
+    def add(self, lineage):
+        "Add 'lineage' and its ancestors, if needed; return its lid."
+        lineage = tuple(lineage)
+        lid = self.lineage_to_lid.get(lineage)
+        if lid is None:
+            lid = self._add(lineage)
+        return lid
+
+    def _add(self, lineage):
+        # add ancestors & the named lineage first, so lids are in order.
+        parents = [ self.add(lineage[:i])
+                    for i in range(1, len(lineage)) ]
+        named = tuple([ pair for pair in lineage if pair.name ])
+        named_lid = None
+        if named != lineage:
+            named_lid = self.add(named)
+
+        lid = len(self.lid_to_lineage)
+        self.lineage_to_lid[lineage] = lid
+        self.lid_to_lineage.append(lineage)
+
+        if lineage:
+            prefixes = tuple([0] + parents + [lid])
+        else:
+            prefixes = (lid,)
+
+        at_rank = []
+        match_at_rank = []
+        for rank in RANKS:
+            popped = pop_to_rank(lineage, rank)
+            rank_lid = prefixes[len(popped)]
+            at_rank.append(rank_lid)
+            if popped and popped[-1].rank == rank:
+                match_at_rank.append(rank_lid)
+            else:
+                match_at_rank.append(-1)
+
+        self._prefixes.append(prefixes)
+        self._at_rank.append(tuple(at_rank))
+        self._match_at_rank.append(tuple(match_at_rank))
+        self._named.append(lid if named_lid is None else named_lid)
+
+        return lid
+
+    def lineage(self, lid):
+        "Return the lineage for a lineage id."
+        return self.lid_to_lineage[lid]
+
+    def rank_id(self, lid, rank):
+        "Return the lid of the ancestor at 'rank'; same as pop_to_rank."
+        return self._at_rank[lid][RANK_INDEX[rank]]
+
+    def is_match(self, lid_a, lid_b, rank):
+        "Do two lineages match down to 'rank'? Same as is_lineage_match."
+        i = RANK_INDEX[rank]
+        a = self._match_at_rank[lid_a][i]
+        return a >= 0 and a == self._match_at_rank[lid_b][i]
+
+    def match_mask(self, lid_a, lid_b):
+        """
+        Return a bitmask of the ranks at which two lineages match: bit i
+        is set if is_match(lid_a, lid_b, RANKS[i]).
+        """
+        mask = 0
+        for i, (a, b) in enumerate(zip(self._match_at_rank[lid_a],
+                                       self._match_at_rank[lid_b])):
+            if a >= 0 and a == b:
+                mask |= 1 << i
+        return mask
+
+    def disagree_rank(self, lid_a, lid_b):
+        "Return the first rank at which two lineages differ, or None."
+        prefixes_a = self._prefixes[lid_a]
+        prefixes_b = self._prefixes[lid_b]
+        for i in range(1, min(len(prefixes_a), len(prefixes_b))):
+            if prefixes_a[i] != prefixes_b[i]:
+                return self.lid_to_lineage[lid_a][i - 1].rank
+        return None
+
+    def lca(self, lids):
+        """
+        Find the lowest common ancestor of some lineages.
+
+        Returns (lid, reason) where 'reason' is the number of children
+        of the LCA; same as find_lca(build_tree(lineages)).
+        """
+        named = set([ self._named[lid] for lid in lids ])
+        paths = [ self._prefixes[lid] for lid in named ]
+
+        lid = 0
+        depth = 1
+        while 1:
+            children = set([ p[depth] for p in paths if len(p) > depth ])
+            if len(children) != 1:
+                return lid, len(children)
+
+            lid = children.pop()
+            depth += 1
+
+
+def build_taxonomy_index(tax_assign):
+    """
+    Build a TaxonomyIndex of all the lineages in a loaded taxonomy.
+
+    'tax_assign' is as returned by taxonomy_cache.load_taxonomy; for a
+    TaxonomyCache, the distinct lineages are read from its lineage
+    table rather than by looking up every identifier.
+    """
+    distinct_lineages = getattr(tax_assign, 'distinct_lineages', None)
+    if distinct_lineages is not None:
+        lineages = distinct_lineages()
+    else:
+        lineages = dict.fromkeys(tax_assign.values())     # in CSV order
+
+    index = TaxonomyIndex()
+    for lineage in lineages:
+        index.add(lineage)
+    return index
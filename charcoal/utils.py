@@ -1,17 +1,61 @@
 """
 utility functions for charcoal.
 """
+import sys
 import json
 from collections import defaultdict, Counter, namedtuple
 import csv
+import heapq
+import weakref
+import multiprocessing
 
 import sourmash
-from sourmash.lca import lca_utils, LineagePair, taxlist, display_lineage
-from sourmash.lca.lca_utils import (is_lineage_match, pop_to_rank,
-                                    make_lineage)
+from sourmash.lca import (lca_utils, LineagePair, taxlist, display_lineage,
+                          LCA_Database)
+from sourmash.lca.lca_utils import make_lineage
+
+from .lineage_db import LineageDB
+from .csv_index import open_csv_index
+from .taxonomy_index import RANKS
+from .contigs_tax import ContigGatherInfo, load_contigs_tax
+from . import metrics
+
+ALL_RANKS_MASK = (1 << len(RANKS)) - 1
+
+
+def is_lineage_match(lin_a, lin_b, rank, taxonomy=None):
+    """
+    Check to see if two lineages are a match down to given rank.
+
+    If 'taxonomy' (a TaxonomyIndex) is given, it is used for lineages
+    that are in it.
+    """
+    if taxonomy is not None:
+        lid_a = taxonomy.lineage_id(lin_a)
+        lid_b = taxonomy.lineage_id(lin_b)
+        if lid_a is not None and lid_b is not None:
+            return taxonomy.is_match(lid_a, lid_b, rank)
+
+    return bool(lca_utils.is_lineage_match(lin_a, lin_b, rank))
+
+
+def pop_to_rank(lin, rank, taxonomy=None):
+    """
+    Remove lineage tuples from given lineage `lin` until `rank` is reached.
+
+    If 'taxonomy' (a TaxonomyIndex) is given, it is used for lineages
+    that are in it.
+    """
+    if taxonomy is not None:
+        lid = taxonomy.lineage_id(lin)
+        if lid is not None:
+            return taxonomy.lineage(taxonomy.rank_id(lid, rank))
+
+    return lca_utils.pop_to_rank(lin, rank)
 
 
 def find_disagree_rank(lin_a, lin_b):
+    "Return the first rank at which two lineages disagree, or None."
     for a, b in zip(lin_a, lin_b):
         assert a.rank == b.rank
         if a.name != b.name:
@@ -36,31 +80,41 @@ def gather_lca_assignments(hashvals, rank, dblist, ldb):
     for hashval in hashvals:
         for lca_db in dblist:
             for ident in get_idents_for_hashval(lca_db, hashval):
-                lineage = ldb.ident_to_lineage[ident]
+                lid = ldb.ident_to_lid[ident]
 
                 if rank:
-                    lineage = pop_to_rank(lineage, rank)
-                assignments[hashval].add(lineage)
+                    lid = ldb.taxonomy.rank_id(lid, rank)
+                assignments[hashval].add(ldb.taxonomy.lineage(lid))
 
     return assignments
 
 
-def count_lca_for_assignments(assignments):
+def count_lca_for_assignments(assignments, taxonomy=None):
     """
     For each hashval, count the LCA across its assignments.
+
+    If 'taxonomy' (a TaxonomyIndex) is given, it is used for hashvals
+    whose lineages are all in it.
     """
     counts = Counter()
     for hashval in assignments:
-
-        # for each list of tuple_info [(rank, name), ...] build
-        # a tree that lets us discover lowest-common-ancestor.
         lineages = assignments[hashval]
-        tree = sourmash.lca.build_tree(lineages)
 
-        # now find either a leaf or the first node with multiple
-        # children; that's our lowest-common-ancestor node.
-        lca, reason = sourmash.lca.find_lca(tree)
-        counts[lca] += 1
+        # find either a leaf or the first node with multiple children
+        # in the tree of lineages; that's our lowest-common-ancestor node.
+        lids = None
+        if taxonomy is not None:
+            lids = [ taxonomy.lineage_id(lin) for lin in lineages ]
+            if None in lids:
+                lids = None
+
+        if lids is not None:
+            lca, reason = taxonomy.lca(lids)
+            counts[taxonomy.lineage(lca)] += 1
+        else:
+            tree = sourmash.lca.build_tree(lineages)
+            lca, reason = sourmash.lca.find_lca(tree)
+            counts[lca] += 1
 
     return counts
 
@@ -95,10 +149,14 @@ class WriteAndTrackFasta:
         self.n = 0
         self.bp = 0
 
-    def write(self, record, no_write=False):
+    def write(self, record, no_write=False, mh=None):
+        "Write a record; 'mh', if given, is its already-computed sketch."
         if not no_write:
-            self.outfp.write(f'>{record.name}\n{record.sequence}\n')
-        self.minhash.add_sequence(record.sequence, force=True)
+            self.outfp.write_record(record.name, record.sequence)
+        if mh is not None:
+            self.minhash.merge(mh)
+        else:
+            self.minhash.add_sequence(record.sequence, force=True)
         self.n += 1
         self.bp += len(record.sequence)
 
@@ -106,15 +164,19 @@ class WriteAndTrackFasta:
         self.outfp.close()
 
 
-def gather_at_rank(mh, lca_db, lin_db, match_rank):
-    "Run gather, and aggregate at given rank."
+def gather_matches_by_best_containment(mh, lca_db, lin_db):
+    """
+    Run gather, yielding (ident, lineage, count) for each match in order.
+
+    This is the straightforward version, which calls best_containment and
+    rebuilds the query for every match; see gather_matches.
+    """
     minhash = mh.flatten().to_mutable()
     query_sig = sourmash.SourmashSignature(minhash)
 
     # do the gather:
-    counts = Counter()
     while query_sig.minhash:
-        
+
         results = lca_db.best_containment(query_sig, threshold_bp=0)
 
         if not results:
@@ -122,28 +184,159 @@ def gather_at_rank(mh, lca_db, lin_db, match_rank):
 
         (match, match_sig, _) = results
 
-        # retrieve lineage & pop to match_rank
+        # retrieve identity & lineage
         match_ident = get_ident(match_sig)
         match_lineage = lin_db.ident_to_lineage[match_ident]
-        match_lineage = pop_to_rank(match_lineage, match_rank)
 
-        # count at match_rank
         common = match_sig.minhash.count_common(query_sig.minhash)
-        counts[match_lineage] += common
+        yield match_ident, match_lineage, common
 
         # finish out gather algorithm!
         minhash.remove_many(match_sig.minhash.hashes)
         query_sig = sourmash.SourmashSignature(minhash)
 
+
+# gather_matches reads these private LCA_Database attributes, which may
+# change between sourmash releases; without them, it falls back to
+# gather_matches_by_best_containment. Checked once per class.
+_LCA_DB_ATTRS = ('_signatures', '_hashval_to_idx', '_idx_to_ident')
+_lca_db_has_attrs = {}
+
+def _has_lca_db_attrs(lca_db):
+    "Does this LCA database have the attributes gather_matches needs?"
+    cls = type(lca_db)
+    has_attrs = _lca_db_has_attrs.get(cls)
+    if has_attrs is None:
+        has_attrs = all(hasattr(lca_db, a) for a in _LCA_DB_ATTRS)
+        _lca_db_has_attrs[cls] = has_attrs
+        if not has_attrs:
+            print(f'note: {cls.__name__} has changed; using the slower gather.',
+                  file=sys.stderr)
+    return has_attrs
+
+
+# md5sums of the signatures in each LCA database, by idx; used for
+# breaking ties in gather_matches the same way best_containment does.
+_lca_db_md5sums = weakref.WeakKeyDictionary()
+
+def get_gather_md5sums(lca_db):
+    """
+    Return md5sums of the signatures in 'lca_db', by idx; cached.
+
+    Call this before forking workers so that they share the cache.
+    """
+    md5sums = _lca_db_md5sums.get(lca_db)
+    if md5sums is None:
+        md5sums = { idx: ss.md5sum()
+                    for idx, ss in lca_db._signatures.items() }
+        _lca_db_md5sums[lca_db] = md5sums
+    return md5sums
+
+
+def gather_matches(mh, lca_db, lin_db):
+    """
+    Run gather, yielding (ident, lineage, count) for each match in order.
+
+    Counts are non-increasing, so callers that only want matches above a
+    threshold can stop at the first match below it.
+
+    Rather than running best_containment against all of the candidates
+    once per match, the overlap of the query with each candidate is
+    counted once, and counts are decremented as hashes are assigned to
+    matches. Results are identical to gather_matches_by_best_containment,
+    including breaking ties by md5sum.
+
+    This uses LCA_Database internals; if they're missing, it falls back
+    to gather_matches_by_best_containment.
+    """
+    if mh.scaled != lca_db.scaled or not _has_lca_db_attrs(lca_db):
+        # leave downsampling (or a changed LCA_Database) to sourmash.
+        yield from gather_matches_by_best_containment(mh, lca_db, lin_db)
+        return
+
+    hashval_to_idx = lca_db._hashval_to_idx
+
+    # count overlaps with the query, & track the shared hashes.
+    remaining = set(mh.hashes)
+    counts = Counter()
+    shared_hashes = defaultdict(list)
+    for hashval in remaining:
+        for idx in hashval_to_idx.get(hashval, ()):
+            counts[idx] += 1
+            shared_hashes[idx].append(hashval)
+
+    if not counts:
+        return
+
+    md5sums = get_gather_md5sums(lca_db)
+    idx_to_ident = lca_db._idx_to_ident
+
+    # best match is largest count, then smallest md5sum. Counts only go
+    # down, so stale heap entries are re-pushed with their current count.
+    heap = [ (-count, md5sums[idx], idx) for idx, count in counts.items() ]
+    heapq.heapify(heap)
+
+    while heap:
+        neg_count, md5, idx = heapq.heappop(heap)
+        count = counts[idx]
+        if -neg_count != count:
+            if count:
+                heapq.heappush(heap, (-count, md5, idx))
+            continue
+
+        match_ident = idx_to_ident[idx]
+        match_lineage = lin_db.ident_to_lineage[match_ident]
+        yield match_ident, match_lineage, count
+
+        # assign the shared hashes to this match.
+        for hashval in shared_hashes.pop(idx):
+            if hashval in remaining:
+                remaining.remove(hashval)
+                for other_idx in hashval_to_idx[hashval]:
+                    counts[other_idx] -= 1
+
+        assert counts[idx] == 0
+
+
+def aggregate_at_rank(matches, match_rank, lin_db=None):
+    """
+    Aggregate (ident, lineage, count) gather matches at given rank.
+
+    If 'lin_db' is given, its lineage ids are used for the idents.
+    """
+    counts = Counter()
+    if lin_db is None:
+        for match_ident, match_lineage, common in matches:
+            # count at match_rank
+            match_lineage = lca_utils.pop_to_rank(match_lineage, match_rank)
+            counts[match_lineage] += common
+
+        # return!
+        for lin, count in counts.most_common():
+            yield lin, count
+        return
+
+    taxonomy = lin_db.taxonomy
+    for match_ident, match_lineage, common in matches:
+        # count at match_rank
+        lid = lin_db.ident_to_lid[match_ident]
+        counts[taxonomy.rank_id(lid, match_rank)] += common
+
     # return!
-    for lin, count in counts.most_common():
-        yield lin, count
+    for lid, count in counts.most_common():
+        yield taxonomy.lineage(lid), count
+
+
+def gather_at_rank(mh, lca_db, lin_db, match_rank):
+    "Run gather, and aggregate at given rank."
+    matches = gather_matches(mh, lca_db, lin_db)
+    return aggregate_at_rank(matches, match_rank, lin_db)
 
 
-def summarize_at_rank(lincounts, rank):
+def summarize_at_rank(lincounts, rank, taxonomy=None):
     newcounts = Counter()
     for lin, count in lincounts:
-        lin = pop_to_rank(lin, rank)
+        lin = pop_to_rank(lin, rank, taxonomy)
         newcounts[lin] += count
 
     return newcounts.most_common()
@@ -156,26 +349,246 @@ def get_ident(sig):
     return ident
 
 
-ContigGatherInfo = namedtuple('ContigGatherInfo',
-                              ['length', 'num_hashes', 'gather_tax'])
+def load_prefetch_picklist(matches_csv):
+    """
+    Load the matches from prefetch as a picklist.
 
-def load_contigs_gather_json(filename):
-    # load contigs JSON file - @CTB
+    An empty matches file is ok, and returns None.
+    """
+    picklist = sourmash.picklist.SignaturePicklist('prefetch')
+    try:
+        picklist.load(matches_csv, picklist.column_name)
+    except ValueError:
+        with open(matches_csv, 'rt') as fp:
+            contents = fp.read()
+            if not len(contents): # empty is ok.
+                picklist = None
+            else:
+                raise
+
+    return picklist
+
+
+def load_databases(filenames):
+    """
+    Open all of the sourmash databases as indices.
+
+    These can be kept open and reused across genomes.
+    """
+    return [ sourmash.load_file_as_index(filename) for filename in filenames ]
+
+
+def iter_matching_signatures(databases, picklist):
+    """
+    Yield the matches in the (opened) databases, as found by prefetch.
+
+    Signatures are loaded one at a time, so that callers can process
+    and drop them without holding all of the matches in memory.
+    """
+    for db in databases:
+        db = db.select(picklist=picklist)
+        for ss in db.signatures():
+            yield ss
+
+
+def load_genome_list(filename):
+    "Load a list of genome names, one per line; ignore empty lines."
     with open(filename, 'rt') as fp:
-        contigs_d = json.load(fp)
-        for k in contigs_d:
-            (size, num_hashes, v) = contigs_d[k]
-            vv = []
-            for (lin, count) in v:
-                vv.append((tuple([ LineagePair(*x) for x in lin ]), count))
-            info = ContigGatherInfo(size, num_hashes, vv)
-            contigs_d[k] = info
+        genome_list = [ line.strip() for line in fp ]
+
+    return [ line for line in genome_list if line ]
+
+
+def remove_duplicate_signatures(siglist):
+    """
+    Remove duplicate signatures in matches.
+
+    Workaround for issue of duplicate sigs in SBT, see sourmash/#1171
+    """
+    new_siglist = []
+    seen_md5 = set()
+    for ss in siglist:
+        ss_md5 = ss.md5sum()
+        if not ss_md5 in seen_md5:
+            new_siglist.append(ss)
+            seen_md5.add(ss_md5)
+        else:
+            print(f'removing a duplicate match: {ss.name}')
+
+    return new_siglist
+
+
+def build_lca_database(siglist, tax_assign, taxonomy):
+    """
+    Create an LCA database & lineage database from specific matches.
+
+    'taxonomy' is the TaxonomyIndex for 'tax_assign'.
+    """
+    # construct a template minhash object that we can use to create new 'uns
+    empty_mh = siglist[0].minhash.copy_and_clear()
+    ksize = empty_mh.ksize
+    scaled = empty_mh.scaled
+    moltype = empty_mh.moltype
+
+    # create empty LCA database to populate...
+    lca_db = LCA_Database(ksize=ksize, scaled=scaled, moltype=moltype)
+    lin_db = LineageDB(taxonomy)
 
-    return contigs_d
+    # ...with specific matches.
+    for ss in siglist:
+        ident = get_ident(ss)
+        lineage = tax_assign[ident]
 
+        lca_db.insert(ss, ident=ident)
+        lin_db.insert(ident, lineage)
 
-def is_contig_contaminated(genome_lineage, contig_taxlist, rank, match_count_threshold):
-    taxlist_at_rank = summarize_at_rank(contig_taxlist, rank)
+    print(f'loaded {len(siglist)} signatures & created LCA Database')
+
+    return lca_db, lin_db
+
+
+PreparedMatches = namedtuple('PreparedMatches',
+                             ['lca_db', 'lin_db', 'empty_mh', 'n_loaded',
+                              'exact_siglist'])
+
+def load_matches_into_lca_database(databases, picklist, genome_mh,
+                                   tax_assign, taxonomy, signatures=None):
+    """
+    Stream prefetch matches into an LCA database & lineage database.
+
+    Each match is checked against the genome (exact matches are set
+    aside), de-duplicated by md5sum, and inserted; the signature is then
+    dropped, so memory use is bounded by the LCA database itself rather
+    than by the number of matching signatures.
+
+    Returns a PreparedMatches tuple; 'lca_db', 'lin_db' and 'empty_mh'
+    are None if there are no non-identical matches. Only the exact
+    matches (usually just the genome itself) are kept in 'exact_siglist'.
+    'taxonomy' is the TaxonomyIndex for 'tax_assign'.
+
+    'signatures', if given, are used instead of the matches in the
+    databases; see prepared_matches.load_prepared_matches.
+    """
+    if signatures is None:
+        signatures = iter_matching_signatures(databases, picklist)
+    signatures = metrics.timed_iter('select_matches', signatures)
+
+    lca_db = lin_db = empty_mh = None
+    exact_siglist = []
+    seen_md5 = set()
+    n_loaded = 0
+    n_inserted = 0
+
+    for ss in signatures:
+        n_loaded += 1
+
+        # Hack for examining members of our search database: remove
+        # exact matches.
+        if genome_mh.similarity(ss.minhash) >= 1.0:
+            exact_siglist.append(ss)
+            continue
+
+        # Workaround for issue of duplicate sigs in SBT, see sourmash/#1171
+        ss_md5 = ss.md5sum()
+        if ss_md5 in seen_md5:
+            print(f'removing a duplicate match: {ss.name}')
+            continue
+        seen_md5.add(ss_md5)
+
+        if lca_db is None:
+            # construct a template minhash object that we can use to
+            # create new 'uns
+            empty_mh = ss.minhash.copy_and_clear()
+            lca_db = LCA_Database(ksize=empty_mh.ksize,
+                                  scaled=empty_mh.scaled,
+                                  moltype=empty_mh.moltype)
+            lin_db = LineageDB(taxonomy)
+
+        with metrics.phase('build_lca'):
+            ident = get_ident(ss)
+            lineage = tax_assign[ident]
+
+            lca_db.insert(ss, ident=ident)
+            lin_db.insert(ident, lineage)
+        n_inserted += 1
+
+    if lca_db is not None:
+        print(f'loaded {n_inserted} signatures & created LCA Database')
+
+    return PreparedMatches(lca_db, lin_db, empty_mh, n_loaded, exact_siglist)
+
+
+# per-process state for map_contigs workers.
+_contig_worker = None
+
+def _init_contig_worker(fn, args):
+    global _contig_worker
+    _contig_worker = (fn, args)
+
+
+def _run_contig_worker(item):
+    n, record = item
+    fn, args = _contig_worker
+    return n, fn(record, *args)
+
+
+def map_contigs(fn, records, args=(), threads=1):
+    """
+    Yield fn(record, *args) for each Contig record, in order.
+
+    With threads > 1, the contigs are processed in a pool of worker
+    processes, largest contigs first; results are still yielded in the
+    input order. 'fn' must be a module-level function. The workers are
+    forked, so 'args' (e.g. an LCA database) are shared, not pickled.
+    """
+    if threads <= 1:
+        for record in records:
+            yield fn(record, *args)
+        return
+
+    records = list(records)
+    order = sorted(range(len(records)), key=lambda i: -records[i].length)
+
+    results = [None] * len(records)
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(threads, initializer=_init_contig_worker,
+                  initargs=(fn, args)) as pool:
+        tasks = ( (n, records[n]) for n in order )
+        for n, result in pool.imap_unordered(_run_contig_worker, tasks):
+            results[n] = result
+
+    yield from results
+
+
+def load_contigs_gather_json(filename):
+    "Load contigs taxonomy, from either a JSON or a binary file."
+    return load_contigs_tax(filename)
+
+
+def genome_lineage_id(taxonomy, genome_lineage):
+    """
+    Return the lineage id to compare contigs to a genome lineage with,
+    or None if there is no genome lineage; see TaxonomyIndex.match_id.
+    """
+    if not genome_lineage:
+        return None
+    return taxonomy.match_id(genome_lineage)
+
+
+def lineage_ids_for_taxlist(taxonomy, contig_taxlist):
+    "Convert a contig's [(lineage, count), ...] to [(lid, count), ...]."
+    match_id = taxonomy.match_id
+    return [ (match_id(lin), count) for lin, count in contig_taxlist ]
+
+
+def is_contig_contaminated(genome_lineage, contig_taxlist, rank,
+                           match_count_threshold, taxonomy=None):
+    if taxonomy is not None:
+        genome_lid = genome_lineage_id(taxonomy, genome_lineage)
+        contig_lidlist = lineage_ids_for_taxlist(taxonomy, contig_taxlist)
+        return is_contig_contaminated_lids(taxonomy, genome_lid,
+                                           contig_lidlist, rank,
+                                           match_count_threshold)
 
     top_hit = None
     if contig_taxlist:
@@ -191,12 +604,73 @@ def is_contig_contaminated(genome_lineage, contig_taxlist, rank, match_count_thr
         for hit, count in contig_taxlist[1:]:
             if is_lineage_match(genome_lineage, hit, rank):
                 is_bad = False
+                break
 
     return is_bad
 
 
-def is_contig_clean(genome_lineage, contig_taxlist, rank, match_count_threshold):
-    taxlist_at_rank = summarize_at_rank(contig_taxlist, rank)
+def is_contig_contaminated_lids(taxonomy, genome_lid, contig_lidlist, rank,
+                                match_count_threshold):
+    """
+    is_contig_contaminated, with lineage ids in 'taxonomy'; lid 0 is no
+    hit, and a genome lid of None is no genome lineage.
+    """
+    top_hit = 0
+    if contig_lidlist:
+        top_hit, count = contig_lidlist[0]
+        if count < match_count_threshold:
+            top_hit = 0
+
+    is_match = taxonomy.is_match
+    is_bad = False
+    if genome_lid is not None and top_hit and \
+       not is_match(genome_lid, top_hit, rank):
+        is_bad = True
+
+        # rescue?
+        for hit, count in contig_lidlist[1:]:
+            if is_match(genome_lid, hit, rank):
+                is_bad = False
+                break
+
+    return is_bad
+
+
+def contaminated_ranks_mask(taxonomy, genome_lid, contig_lidlist,
+                            match_count_threshold, match_masks):
+    """
+    Return a bitmask of the ranks at which a contig is contaminated: bit
+    i is set if is_contig_contaminated_lids at taxonomy_index.RANKS[i].
+
+    'match_masks' is a dictionary used to cache the match mask of each
+    hit lid against 'genome_lid'.
+    """
+    if genome_lid is None or not contig_lidlist:
+        return 0
+
+    top_hit, count = contig_lidlist[0]
+    if not top_hit or count < match_count_threshold:
+        return 0
+
+    # contaminated at a rank if no hit matches the genome at that rank.
+    matched = 0
+    for hit, count in contig_lidlist:
+        mask = match_masks.get(hit)
+        if mask is None:
+            mask = taxonomy.match_mask(genome_lid, hit)
+            match_masks[hit] = mask
+        matched |= mask
+
+    return ALL_RANKS_MASK & ~matched
+
+
+def is_contig_clean(genome_lineage, contig_taxlist, rank,
+                    match_count_threshold, taxonomy=None):
+    if taxonomy is not None:
+        genome_lid = genome_lineage_id(taxonomy, genome_lineage)
+        contig_lidlist = lineage_ids_for_taxlist(taxonomy, contig_taxlist)
+        return is_contig_clean_lids(taxonomy, genome_lid, contig_lidlist,
+                                    rank, match_count_threshold)
 
     if contig_taxlist:
         top_hit, count = contig_taxlist[0]
@@ -206,6 +680,22 @@ def is_contig_clean(genome_lineage, contig_taxlist, rank, match_count_threshold)
 
     return False
 
+
+def is_contig_clean_lids(taxonomy, genome_lid, contig_lidlist, rank,
+                         match_count_threshold):
+    """
+    is_contig_clean, with lineage ids in 'taxonomy'; a genome lid of
+    None is no genome lineage.
+    """
+    if contig_lidlist:
+        top_hit, count = contig_lidlist[0]
+        if count >= match_count_threshold:
+            if genome_lid is not None and \
+               taxonomy.is_match(genome_lid, top_hit, rank):
+                return True
+
+    return False
+
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
@@ -214,6 +704,7 @@ class AttrDict(dict):
 
 class CSV_DictHelper:
     def __init__(self, filename, key):
+        self.filename = filename
         self.rows = {}
         with open(filename, 'rt') as fp:
             r = csv.DictReader(fp)
@@ -233,6 +724,54 @@ class CSV_DictHelper:
         return len(self.rows)
 
 
+class IndexedCSV_DictHelper:
+    """
+    Like CSV_DictHelper, but rows are looked up in the sorted index
+    built next to the CSV by `python -m charcoal.csv_index`, rather than
+    loading the whole CSV. The index is only opened, never written; if
+    it is missing or stale, the CSV is loaded as CSV_DictHelper does.
+    """
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = open_csv_index(self.filename, self.key)
+            if self._index is None:
+                print(f"no up-to-date index for '{self.filename}'; loading the whole CSV.")
+                self._index = CSV_DictHelper(self.filename, self.key).rows
+        return self._index
+
+    def __getitem__(self, k):
+        row = self.index.get(k)
+        if row is None:
+            raise KeyError(k)
+        return AttrDict(row)
+
+    def __contains__(self, k):
+        return k in self.index
+
+    def __iter__(self):
+        with open(self.filename, 'rt') as fp:
+            for row in csv.DictReader(fp):
+                yield row[self.key]
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def save_contamination_summary(detected_contam, fp):
     "Save a contamination summary to JSON."
     json.dump(detected_contam, fp)
@@ -33,5 +33,6 @@ setup(
     setup_requires = [ "setuptools>=38.6.0",
                        'setuptools_scm', 'setuptools_scm_git_archive' ],
     use_scm_version = {"write_to": "charcoal/version.py"},
-    install_requires = ['snakemake==6.4.1', 'click>=7,<8']
+    install_requires = ['snakemake==6.4.1', 'click>=7,<8'],
+    extras_require = { 'zstd': ['zstandard'] },
 )
@@ -0,0 +1,101 @@
+import os.path
+import csv
+import pytest
+from . import pytest_utils as utils
+
+from charcoal import accession_index, genbank_genomes
+from charcoal.accession_index import AccessionIndex
+
+
+genbank_summary = utils.relative_file('tests/test-data/ncbi/assembly_summary_genbank.txt')
+refseq_summary = utils.relative_file('tests/test-data/ncbi/assembly_summary_refseq.txt.gz')
+
+
+def test_split_accession():
+    assert accession_index.split_accession('GCA_001593925.1') == ('GCA_001593925', 1)
+    assert accession_index.split_accession(' GCA_001593925\n') == ('GCA_001593925', None)
+
+
+@utils.in_tempdir
+def test_build_and_get(location):
+    index_file = os.path.join(location, 'acc.sqlite')
+    n = accession_index.build_accession_index([genbank_summary,
+                                               refseq_summary], index_file)
+    assert n == 4                         # one w/o an FTP path is skipped
+
+    with AccessionIndex(index_file) as index:
+        assert len(index) == 4
+
+        info = index.get('GCA_001593925.1')
+        assert info['acc'] == 'GCA_001593925.1'
+        assert info['taxid'] == '1313'
+        assert info['ncbi_tax_name'] == 'Candidatus Dactylopiibacterium carminicum'
+        assert info['genome_url'] == 'https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/001/593/925/GCA_001593925.1_ASM159392v1/GCA_001593925.1_ASM159392v1_genomic.fna.gz'
+        assert info['assembly_report_url'] == 'https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/001/593/925/GCA_001593925.1_ASM159392v1/GCA_001593925.1_ASM159392v1_assembly_report.txt'
+
+        # no version => latest; ftp:// paths => https://
+        assert index.get('GCA_000005845')['acc'] == 'GCA_000005845.2'
+        old = index.get('GCA_000005845.1')
+        assert old['genome_url'].startswith('https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/005/845/GCA_000005845.1_ASM584v1/')
+
+        # refseq, from a gzipped summary.
+        assert index.get('GCF_000005845.2')['taxid'] == '511145'
+
+        assert index.get('GCA_900000001.1') is None
+        assert index.get('GCA_000005845.3') is None
+        assert 'GCA_001593925' in index
+
+
+@utils.in_tempdir
+def test_bad_files(location):
+    bad = os.path.join(location, 'bad.txt')
+    with open(bad, 'wt') as fp:
+        fp.write('GCA_001593925.1\tfoo\n')
+
+    with pytest.raises(ValueError):
+        accession_index.build_accession_index([bad],
+                                              os.path.join(location, 'x.sqlite'))
+    assert os.listdir(location) == ['bad.txt']
+
+    with pytest.raises(ValueError):
+        AccessionIndex(bad)
+    with pytest.raises(ValueError):
+        AccessionIndex(os.path.join(location, 'nosuchfile.sqlite'))
+
+
+@utils.in_tempdir
+def test_genbank_genomes_offline(location):
+    # build an index w/the command line entry point...
+    args = utils.Args()
+    args.summary_files = [genbank_summary]
+    args.output = os.path.join(location, 'acc.sqlite')
+    assert accession_index.main(args) == 0
+
+    # ...and resolve an accession from it w/o any network access.
+    def no_network(*args, **kw):
+        raise AssertionError('network access!')
+
+    get = genbank_genomes.Fetcher.get
+    genbank_genomes.Fetcher.get = no_network
+    try:
+        gargs = utils.Args()
+        gargs.accessions = ['GCA_000005845']
+        gargs.accession_list = None
+        gargs.output = os.path.join(location, 'GCA_000005845.info.csv')
+        gargs.accession_index = args.output
+        gargs.jobs = 1
+        gargs.cache_dir = None
+        gargs.genomes_url = genbank_genomes.NCBI_GENOMES_URL
+        gargs.taxonomy_url = genbank_genomes.NCBI_TAXONOMY_URL
+        gargs.genome_cache = None
+        assert genbank_genomes.main(gargs) == 0
+    finally:
+        genbank_genomes.Fetcher.get = get
+
+    with open(gargs.output, 'rt') as fp:
+        rows = list(csv.DictReader(fp))
+
+    assert rows == [{ 'acc': 'GCA_000005845',
+                      'genome_url': 'https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/005/845/GCA_000005845.2_ASM584v2/GCA_000005845.2_ASM584v2_genomic.fna.gz',
+                      'assembly_report_url': 'https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/005/845/GCA_000005845.2_ASM584v2/GCA_000005845.2_ASM584v2_assembly_report.txt',
+                      'ncbi_tax_name': 'Escherichia coli str. K-12 substr. MG1655' }]
@@ -0,0 +1,59 @@
+"Tests for loading saved mashmap alignments."
+import os.path
+from . import pytest_utils as utils
+
+from charcoal.alignplot import AlignmentContainer
+
+
+# query, qsize, qstart, qend, strand, target, tsize, tstart, tend, pident
+ALIGN_A = 'q1 20000 0 9999 + a1 30000 100 10099 99.5\n'
+ALIGN_B = 'q1 20000 10000 19999 - b1 15000 0 9999 97.0\n' \
+          'q1 20000 0 4999 + b2 8000 0 4999 96.0\n'
+
+
+def write_file(filename, content):
+    with open(filename, 'wt') as fp:
+        fp.write(content)
+    return filename
+
+
+def make_container(location):
+    targets = [ ('GCA_A', write_file(os.path.join(location, 'a.fa'),
+                                     '>a1 first\nACGT\n')),
+                ('GCA_B', write_file(os.path.join(location, 'b.fa'),
+                                     '>b1\nACGT\n>b2\nACGT\n')) ]
+    return AlignmentContainer('q.fa', 'q.fa', targets)
+
+
+@utils.in_tempdir
+def test_load_mashmap_pairwise(location):
+    prefix = os.path.join(location, 'q.fa')
+    write_file(f'{prefix}.x.GCA_A.mashmap.align', ALIGN_A)
+    write_file(f'{prefix}.x.GCA_B.mashmap.align', ALIGN_B)
+
+    alignment = make_container(location)
+    alignment.load_mashmap(prefix)
+    assert [ r.target for r in alignment.results['GCA_A'] ] == ['a1']
+    assert [ r.target for r in alignment.results['GCA_B'] ] == ['b1', 'b2']
+
+
+@utils.in_tempdir
+def test_load_mashmap_combined(location):
+    prefix = os.path.join(location, 'q.fa')
+    other = 'q1 20000 0 9999 + c1 9000 0 9999 99.0\n'
+    write_file(f'{prefix}.mashmap.align', ALIGN_B + other + ALIGN_A)
+
+    # split by target contig, w/the same results as pairwise.
+    alignment = make_container(location)
+    alignment.load_mashmap(prefix, combined=True)
+    assert len(alignment) == 3
+    assert [ r.target for r in alignment.results['GCA_A'] ] == ['a1']
+    assert [ r.target for r in alignment.results['GCA_B'] ] == ['b1', 'b2']
+    b1 = alignment.results['GCA_B'][0]
+    assert (b1.tstart, b1.tend) == (9.999, 0)             # reverse strand
+
+    # a known contig -> target mapping is used as is.
+    alignment = make_container(location)
+    alignment.load_mashmap(prefix, combined=True,
+                           contigs_to_acc={ 'a1': 'GCA_A', 'c1': 'GCA_B' })
+    assert [ r.target for r in alignment.results['GCA_B'] ] == ['c1']
@@ -0,0 +1,69 @@
+import os.path
+import csv
+from . import pytest_utils as utils
+
+from charcoal import benchmark_summary
+
+
+HEADER = 's\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n'
+
+
+def write_benchmark(filename, *records):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wt') as fp:
+        fp.write(HEADER)
+        for seconds, max_rss, cpu_time in records:
+            fp.write(f'{seconds}\t0:00:01\t{max_rss}\t-\t-\t-\t-\t-\t0.5\t{cpu_time}\n')
+
+
+@utils.in_tempdir
+def test_summarize(location):
+    bdir = os.path.join(location, 'benchmarks')
+    write_benchmark(f'{bdir}/prefetch/a.fa.gz.tsv', (2.0, 100.5, 1.5))
+    write_benchmark(f'{bdir}/prefetch/b.fa.gz.tsv', (4.0, 50.0, 3.0))
+    write_benchmark(f'{bdir}/mashmap/a.fa.gz.x.GCA_1.tsv', (10.0, '-', 9.0))
+    write_benchmark(f'{bdir}/combine_hit_list.tsv', (0.5, 20.0, 0.25),
+                    (1.5, 30.0, 0.75))
+    with open(f'{bdir}/summary.csv', 'wt') as fp:     # not a benchmark
+        fp.write('ignore me\n')
+
+    summary = benchmark_summary.summarize(bdir)
+    assert [ r['rule'] for r in summary ] == ['mashmap', 'prefetch',
+                                              'combine_hit_list']
+
+    mashmap, prefetch, combine = summary
+    assert mashmap['jobs'] == 1
+    assert mashmap['max_rss_mb'] is None
+    assert prefetch['jobs'] == 2
+    assert prefetch['total_s'] == 6.0
+    assert prefetch['mean_s'] == 3.0
+    assert prefetch['max_s'] == 4.0
+    assert prefetch['cpu_s'] == 4.5
+    assert prefetch['max_rss_mb'] == 100.5
+    assert prefetch['slowest'] == 'b.fa.gz'
+    assert combine['jobs'] == 2                       # one per repeat
+    assert combine['max_rss_mb'] == 30.0
+
+    lines = benchmark_summary.format_summary(summary)
+    assert lines[1].startswith('mashmap ')
+    assert lines[-1].split()[:3] == ['total', '5', '18.00']
+
+    args = utils.Args()
+    args.benchmark_dir = bdir
+    args.output = os.path.join(location, 'summary.csv')
+    assert benchmark_summary.main(args) == 0
+
+    with open(args.output, 'rt') as fp:
+        rows = list(csv.DictReader(fp))
+    assert [ r['rule'] for r in rows ] == ['mashmap', 'prefetch',
+                                           'combine_hit_list']
+    assert rows[1]['total_s'] == '6.00'
+    assert rows[1]['max_rss_mb'] == '100.5'
+
+
+@utils.in_tempdir
+def test_no_benchmarks(location):
+    args = utils.Args()
+    args.benchmark_dir = os.path.join(location, 'benchmarks')
+    args.output = None
+    assert benchmark_summary.main(args) == -1
@@ -0,0 +1,44 @@
+import os
+import os.path
+import struct
+from bisect import bisect_left
+from . import pytest_utils as utils
+
+from charcoal.binary_format import (pad, strings_table, write_sections,
+                                    SortedStrings)
+
+
+def test_1_pad():
+    assert pad(0) == 0
+    assert pad(1) == 8
+    assert pad(8) == 8
+    assert pad(9) == 16
+
+
+def test_2_strings_table():
+    # offsets & data round-trip through SortedStrings, and can be bisected.
+    strings = sorted(['a', 'bb', 'ccc', 'dé'], key=lambda x: x.encode('utf-8'))
+    offsets, data = strings_table(strings)
+    assert len(offsets) == 8 * (len(strings) + 1)
+
+    offsets = memoryview(offsets).cast('Q')
+    sorted_strings = SortedStrings(memoryview(data), offsets, len(strings))
+    assert len(sorted_strings) == len(strings)
+    assert [ str(x, 'utf-8') for x in
+             (sorted_strings[i] for i in range(len(strings))) ] == strings
+
+    assert bisect_left(sorted_strings, b'ccc') == 2
+    assert bisect_left(sorted_strings, b'c') == 2
+
+
+@utils.in_tempdir
+def test_3_write_sections(location):
+    # each section is padded to 8 bytes; no temp files are left behind.
+    filename = os.path.join(location, 'x.bin')
+    header = struct.pack('<8sQ', b'TESTMAGC', 2)
+    write_sections(filename, header, [b'abc', b'12345678'])
+
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    assert data == header + b'abc' + b'\0' * 5 + b'12345678'
+    assert os.listdir(location) == ['x.bin']
@@ -1,13 +1,21 @@
 import sys
 import io
 import os.path
+import shutil
 from . import pytest_utils as utils
 
-from charcoal import clean_genome
+from charcoal import clean_genome, csv_index
 
 loomba = 'LoombaR_2017__SID1050_bax__bin.11.fa.gz'
 
 
+def copy_hit_list(location, name='loomba-hit-list.csv'):
+    "Copy a hit list CSV into the temp directory 'location'."
+    dest = os.path.join(location, name)
+    shutil.copyfile(utils.relative_file(f"tests/test-data/{name}"), dest)
+    return dest
+
+
 def replace_in_hit_list(src, dest, match, replace):
     "Adjust the hit list CSV with a quick search/replace."
     with open(src, 'rt') as fp:
@@ -24,7 +32,7 @@ def test_1_loomba(location):
     # regression test/check for same results on Loomba
     args = utils.Args()
     args.genome = utils.relative_file(f"demo/genomes/{loomba}")
-    args.hit_list = utils.relative_file("tests/test-data/loomba-hit-list.csv")
+    args.hit_list = copy_hit_list(location)
     args.contigs_json = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
     args.do_nothing = True
 
@@ -45,7 +53,7 @@ def test_1_loomba_genus(location):
     # regression test/check for same results on Loomba
     args = utils.Args()
     args.genome = utils.relative_file(f"demo/genomes/{loomba}")
-    args.hit_list = utils.relative_file("tests/test-data/loomba-hit-list.csv")
+    args.hit_list = copy_hit_list(location)
     args.contigs_json = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
     args.do_nothing = True
 
@@ -268,7 +276,7 @@ def test_2_gca_empty(location):
     # regression test/check for same results on Loomba
     args = utils.Args()
     args.genome = utils.relative_file(f"demo/genomes/GCA_001593925.1_ASM159392v1_genomic.fna.gz")
-    args.hit_list = utils.relative_file("tests/test-data/GCA_001593925_hit-list.csv")
+    args.hit_list = copy_hit_list(location, 'GCA_001593925_hit-list.csv')
 
     # create and use empty JSON file
     empty_json = os.path.join(location, 'empty.json')
@@ -288,3 +296,158 @@ def test_2_gca_empty(location):
     assert status == 0
     assert os.path.exists(clean_out)
     assert os.path.exists(dirty_out)
+
+
+@utils.in_tempdir
+def test_3_batch(location):
+    # clean a list of genomes in one go, w/the hit list loaded once.
+    input_dir = os.path.join(location, 'stage1')
+    os.mkdir(input_dir)
+    shutil.copyfile(utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json"),
+                    os.path.join(input_dir, f'{loomba}.contigs-tax.json'))
+
+    genome_list = os.path.join(location, 'genome-list.txt')
+    with open(genome_list, 'wt') as fp:
+        fp.write(f'{loomba}\n')
+
+    args = utils.Args()
+    args.genome_list = genome_list
+    args.genome_dir = utils.relative_file("demo/genomes")
+    args.input_directory = input_dir
+    args.output_directory = location
+    args.hit_list = copy_hit_list(location)
+    args.do_nothing = False
+
+    # index the hit list, as the combine_hit_list checkpoint does.
+    csv_index.load_csv_index(args.hit_list, 'genome')
+    index_mtime = os.stat(args.hit_list + csv_index.INDEX_SUFFIX).st_mtime_ns
+
+    status = clean_genome.main(args)
+
+    assert status == 0
+    assert os.stat(args.hit_list + csv_index.INDEX_SUFFIX).st_mtime_ns == index_mtime
+    assert os.path.exists(os.path.join(location, f'{loomba}.clean.fa.gz'))
+    assert os.path.exists(os.path.join(location, f'{loomba}.dirty.fa.gz'))
+
+
+@utils.in_tempdir
+def test_4_loomba_binary(location):
+    # cleaning with binary contigs taxonomy gives the same results.
+    from charcoal.contigs_tax import load_contigs_tax, save_contigs_tax
+
+    json_file = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    bin_file = os.path.join(location, 'contigs-tax.bin')
+    save_contigs_tax(load_contigs_tax(json_file), bin_file)
+
+    outputs = []
+    for contigs_file in (json_file, bin_file):
+        args = utils.Args()
+        args.genome = utils.relative_file(f"demo/genomes/{loomba}")
+        args.hit_list = copy_hit_list(location)
+        args.contigs_json = contigs_file
+        args.do_nothing = False
+        args.clean = os.path.join(location, 'clean.fa')
+        args.dirty = os.path.join(location, 'dirty.fa')
+
+        status = clean_genome.main(args)
+        assert status == 0
+
+        with open(args.clean, 'rt') as fp:
+            clean = fp.read()
+        with open(args.dirty, 'rt') as fp:
+            dirty = fp.read()
+        outputs.append((clean, dirty))
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0][1]                  # some dirty contigs
+
+
+@utils.in_tempdir
+def test_5_loomba_bgzf_index(location):
+    # clean & dirty contigs are BGZF w/.fai & .gzi indices.
+    import screed
+
+    args = utils.Args()
+    args.genome = utils.relative_file(f"demo/genomes/{loomba}")
+    args.hit_list = copy_hit_list(location)
+    args.contigs_json = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    args.do_nothing = False
+    args.threads = 2
+    args.compress_level = 1
+    args.clean = os.path.join(location, 'clean.fa.gz')
+    args.dirty = os.path.join(location, 'dirty.fa.gz')
+
+    status = clean_genome.main(args)
+    assert status == 0
+
+    n_records = 0
+    for filename in (args.clean, args.dirty):
+        assert os.path.exists(filename + '.gzi')
+        with open(filename + '.fai', 'rt') as fp:
+            fai = [ line.split('\t') for line in fp ]
+        records = list(screed.open(filename))
+        assert [ x[0] for x in fai ] == [ r.name.split()[0] for r in records ]
+        n_records += len(records)
+
+    assert n_records == len(list(screed.open(args.genome)))
+
+
+@utils.in_tempdir
+def test_6_loomba_raw_copy(location):
+    # copying contigs w/o parsing them gives the same contigs.
+    import screed
+
+    args = utils.Args()
+    args.genome = utils.relative_file(f"demo/genomes/{loomba}")
+    args.hit_list = copy_hit_list(location)
+    args.contigs_json = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    args.do_nothing = False
+
+    outputs = []
+    for raw_copy in (False, True):
+        args.raw_copy = raw_copy
+        args.clean = os.path.join(location, f'clean.{raw_copy}.fa')
+        args.dirty = os.path.join(location, f'dirty.{raw_copy}.fa.gz')
+
+        status = clean_genome.main(args)
+        assert status == 0
+
+        outputs.append([ [ (r.name, r.sequence) for r in screed.open(f) ]
+                         for f in (args.clean, args.dirty) ])
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0][1]                  # some dirty contigs
+
+
+@utils.in_tempdir
+def test_7_loomba_results_db(location):
+    # look up the hit list in a results store rather than the CSV.
+    import screed
+    from charcoal.results_db import ResultsDB
+
+    hit_list_csv = copy_hit_list(location)
+    results_db = os.path.join(location, 'results.sqlite')
+    with ResultsDB(results_db) as db:
+        db.upsert('stage1_hitlist', hit_list_csv)
+
+    args = utils.Args()
+    args.genome = utils.relative_file(f"demo/genomes/{loomba}")
+    args.contigs_json = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    args.do_nothing = False
+
+    outputs = []
+    for hit_list, db in ((hit_list_csv, None),
+                         ('/nosuchfile.csv', results_db)):
+        args.hit_list = hit_list
+        args.results_db = db
+        args.clean = os.path.join(location, 'clean.fa')
+        args.dirty = os.path.join(location, 'dirty.fa')
+
+        status = clean_genome.main(args)
+        assert status == 0
+
+        outputs.append([ [ r.name for r in screed.open(f) ]
+                         for f in (args.clean, args.dirty) ])
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0][1]                  # some dirty contigs
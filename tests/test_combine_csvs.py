@@ -0,0 +1,134 @@
+import os.path
+import sys
+import io
+import csv
+import contextlib
+from . import pytest_utils as utils
+
+from charcoal import combine_csvs
+
+
+FIELDNAMES = ['genome', 'bad_bp', 'lineage']
+
+
+def make_csvs(location, n_files=20, rows_per_file=7):
+    "Make CSVs with repeated numeric values, to check sort stability."
+    filenames = []
+    for i in range(n_files):
+        filename = os.path.join(location, f'{i}.csv')
+        with open(filename, 'wt') as fp:
+            w = csv.writer(fp)
+            w.writerow(FIELDNAMES)
+            for j in range(rows_per_file):
+                w.writerow([f'g{i}_{j}', (i * 7 + j * 13) % 10 * 100,
+                            f'lin{(i + j) % 4}'])
+        filenames.append(filename)
+
+    return filenames
+
+
+def make_args(csvs=(), **kw):
+    args = utils.Args()
+    args.csvs = list(csvs)
+    args.sort_by = None
+    args.reverse = False
+    args.file_list = None
+    args.max_rows = combine_csvs.DEFAULT_MAX_ROWS
+    args.tmpdir = None
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+
+def run(args):
+    "Run combine_csvs; return (status, output rows)."
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), \
+         contextlib.redirect_stderr(io.StringIO()):
+        status = combine_csvs.main(args)
+
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    return status, rows
+
+
+def expected_rows(filenames, key_fn, reverse):
+    rows = []
+    for filename in filenames:
+        with open(filename, 'rt') as fp:
+            rows.extend(csv.DictReader(fp))
+    rows.sort(key=key_fn, reverse=reverse)
+    return rows
+
+
+@utils.in_tempdir
+def test_1_sort_numeric(location):
+    # numeric fields sort numerically; reverse sorts are stable.
+    filenames = make_csvs(location)
+    expected = expected_rows(filenames, lambda x: float(x['bad_bp']), True)
+
+    args = make_args(filenames, sort_by='bad_bp', reverse=True)
+    status, rows = run(args)
+    assert status == 0
+    assert rows == expected
+
+
+@utils.in_tempdir
+def test_2_merge_runs(location):
+    # merging small sorted runs gives the same output as one sort.
+    filenames = make_csvs(location)
+
+    for sort_by, reverse in (('bad_bp', True), ('bad_bp', False),
+                             ('lineage', False), (None, False)):
+        key = sort_by or 'genome'
+        if key == 'bad_bp':
+            key_fn = lambda x: float(x[key])
+        else:
+            key_fn = lambda x: x[key]
+        expected = expected_rows(filenames, key_fn, reverse)
+
+        for max_rows in (1, 3, 50, 1000):
+            args = make_args(filenames, sort_by=sort_by, reverse=reverse,
+                             max_rows=max_rows, tmpdir=location)
+            status, rows = run(args)
+            assert status == 0
+            assert rows == expected, (sort_by, reverse, max_rows)
+
+    # temporary runs are cleaned up.
+    assert sorted(os.listdir(location)) == \
+        sorted([ os.path.basename(f) for f in filenames ])
+
+
+@utils.in_tempdir
+def test_3_file_list(location):
+    # read the CSV filenames from a list file, or stdin.
+    filenames = make_csvs(location)
+    _, expected = run(make_args(filenames, sort_by='bad_bp'))
+
+    file_list = os.path.join(location, 'inputs.txt')
+    with open(file_list, 'wt') as fp:
+        fp.write('\n'.join(filenames[5:]) + '\n\n')
+
+    args = make_args(filenames[:5], sort_by='bad_bp', file_list=file_list)
+    status, rows = run(args)
+    assert status == 0
+    assert rows == expected
+
+    old_stdin = sys.stdin
+    sys.stdin = io.StringIO('\n'.join(filenames))
+    try:
+        status, rows = run(make_args(sort_by='bad_bp', file_list='-'))
+    finally:
+        sys.stdin = old_stdin
+
+    assert status == 0
+    assert rows == expected
+
+
+@utils.in_tempdir
+def test_4_no_inputs(location):
+    file_list = os.path.join(location, 'inputs.txt')
+    with open(file_list, 'wt') as fp:
+        pass
+
+    status, rows = run(make_args(file_list=file_list))
+    assert status == -1
@@ -68,3 +68,55 @@ def test_basic(location):
     #    save_contamination_summary(actual_contam, fp)
 
     assert saved_contam == actual_contam
+
+
+def test_summarize_genome_all_ranks():
+    # the single-pass summary should match checking each rank separately.
+    from charcoal import utils as charcoal_utils
+    from charcoal.taxonomy_cache import load_taxonomy
+    from charcoal.taxonomy_index import build_taxonomy_index
+    from sourmash.lca import LineagePair
+
+    contigs_d = charcoal_utils.load_contigs_gather_json(utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.contigs-tax.json"))
+    tax_assign, _ = load_taxonomy(utils.relative_file("tests/test-data/test-match-lineages.csv"))
+    taxonomy = build_taxonomy_index(tax_assign)
+    n_lineages = len(taxonomy)
+
+    lineages = set()
+    for gather_info in contigs_d.values():
+        for lin, count in gather_info.gather_tax:
+            lineages.add(lin)
+    lineages = sorted(lineages)
+
+    # ...including a genome lineage that is not in the taxonomy.
+    unknown = lineages[0][:2] + (LineagePair('class', 'c__Unknown'),)
+    genome_lineages = [ lineages[0], lineages[-1], lineages[0][:2], (),
+                        unknown ]
+
+    for genome_lineage in genome_lineages:
+        vals, contam = compare_taxonomy.summarize_genome('loomba', contigs_d,
+                                                         genome_lineage, '',
+                                                         False, 1.0, 1.0,
+                                                         'genus', taxonomy)
+
+        for rank in ('superkingdom', 'phylum', 'class', 'order', 'family',
+                     'genus'):
+            good, bad = compare_taxonomy.calculate_contam(genome_lineage,
+                                                          contigs_d, rank)
+            assert vals[f'bad_{rank}_n'] == len(bad)
+            assert vals[f'bad_{rank}_bp'] == sum([ x.length for x in bad.values() ])
+            assert vals[f'good_{rank}_n'] == len(good)
+            assert vals[f'good_{rank}_bp'] == sum([ x.length for x in good.values() ])
+
+        # contamination is tracked at genus.
+        expected = []
+        for contig_name in bad:
+            for hit, count in contigs_d[contig_name].gather_tax:
+                if not charcoal_utils.is_lineage_match(genome_lineage, hit, 'genus'):
+                    expected.append((charcoal_utils.pop_to_rank(genome_lineage, 'genus'),
+                                     charcoal_utils.pop_to_rank(hit, 'genus'),
+                                     count))
+        assert contam == expected
+
+    # looking up lineages never adds them to the index.
+    assert len(taxonomy) == n_lineages
@@ -0,0 +1,95 @@
+import os.path
+from . import pytest_utils as utils
+
+import screed
+import sourmash
+
+from charcoal import contig_sketches
+from charcoal.contig_sketches import (ContigSketches, make_template_minhash,
+                                      load_contigs, contig_minhash)
+
+
+LOOMBA = "demo/genomes/LoombaR_2017__SID1050_bax__bin.11.fa.gz"
+LOOMBA_SIG = "tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.sig"
+
+
+@utils.in_tempdir
+def test_1_round_trip(location):
+    # saving and loading should give the same names, lengths and hashes.
+    genome = utils.relative_file(LOOMBA)
+    template_mh = make_template_minhash(31, 1000, 'DNA')
+    sketches = ContigSketches.from_fasta(genome, template_mh)
+
+    filename = os.path.join(location, 'contigs.sketch')
+    sketches.save(filename)
+    loaded = ContigSketches.load(filename)
+
+    assert loaded.names == sketches.names
+    assert list(loaded.lengths) == list(sketches.lengths)
+    assert list(loaded.hash_offsets) == list(sketches.hash_offsets)
+    assert list(loaded.hashes) == list(sketches.hashes)
+    assert loaded.template_mh.ksize == 31
+    assert loaded.scaled == 1000
+
+    records = list(screed.open(genome))
+    assert len(loaded) == len(records)
+    for record, contig in zip(records, loaded.contigs()):
+        mh = template_mh.copy_and_clear()
+        mh.add_sequence(record.sequence, force=True)
+        assert contig.name == record.name
+        assert contig.length == len(record.sequence)
+        assert set(contig.hashes) == set(mh.hashes)
+
+
+@utils.in_tempdir
+def test_2_genome_sig(location):
+    # the union of the contig sketches is the genome signature.
+    args = utils.Args()
+    args.genome = utils.relative_file(LOOMBA)
+    args.output = os.path.join(location, 'contigs.sketch')
+    args.sig_out = os.path.join(location, 'genome.sig')
+    args.ksize = 31
+    args.scaled = 1000
+    args.moltype = 'DNA'
+
+    status = contig_sketches.main(args)
+    assert status == 0
+
+    sig = sourmash.load_one_signature(args.sig_out)
+    saved_sig = sourmash.load_one_signature(utils.relative_file(LOOMBA_SIG))
+    assert sig.minhash == saved_sig.minhash
+    assert sig.md5sum() == saved_sig.md5sum()
+
+
+def test_3_downsample():
+    # sketches at a finer scaled can be used at a coarser one.
+    genome = utils.relative_file(LOOMBA)
+    sketches = ContigSketches.from_fasta(genome,
+                                         make_template_minhash(31, 1000, 'DNA'))
+
+    empty_mh = make_template_minhash(31, 10000, 'DNA')
+    assert sketches.is_compatible(empty_mh)
+    assert not sketches.is_compatible(make_template_minhash(31, 100, 'DNA'))
+    assert not sketches.is_compatible(make_template_minhash(21, 1000, 'DNA'))
+
+    for record, contig in zip(screed.open(genome), sketches.contigs()):
+        mh = empty_mh.copy_and_clear()
+        mh.add_sequence(record.sequence, force=True)
+        assert contig_minhash(contig, empty_mh) == mh
+
+
+@utils.in_tempdir
+def test_4_incompatible_fallback(location):
+    # incompatible sketches are ignored, and the FASTA is read instead.
+    genome = utils.relative_file(LOOMBA)
+    filename = os.path.join(location, 'contigs.sketch')
+    sketches = ContigSketches.from_fasta(genome,
+                                         make_template_minhash(21, 1000, 'DNA'))
+    sketches.save(filename)
+
+    empty_mh = make_template_minhash(31, 1000, 'DNA')
+    contigs = list(load_contigs(genome, empty_mh, filename))
+    assert len(contigs) == len(sketches)
+    for contig in contigs:
+        assert contig.hashes is None
+        assert len(contig.sequence) == contig.length
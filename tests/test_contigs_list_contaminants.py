@@ -1,10 +1,19 @@
 import os.path
+import shutil
 from . import pytest_utils as utils
 import json
 
 from charcoal import contigs_list_contaminants
 
 
+def copy_hit_list(location):
+    "Copy the hit list CSV into the temp directory 'location'."
+    dest = os.path.join(location, 'loomba-hit-list.csv')
+    shutil.copyfile(utils.relative_file("tests/test-data/loomba-hit-list.csv"),
+                    dest)
+    return dest
+
+
 @utils.in_tempdir
 def test_1_loomba(location):
     # regression test/check for same results on Loomba
@@ -14,7 +23,7 @@ def test_1_loomba(location):
     args.matches_csv = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.csv")
     args.databases = [utils.relative_file('tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.zip')]
     args.lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
-    args.hitlist = utils.relative_file("tests/test-data/loomba-hit-list.csv")
+    args.hitlist = copy_hit_list(location)
     args.json_out = os.path.join(location, 'tax.json')
     args.match_rank = 'genus'
 
@@ -37,7 +46,7 @@ def test_1_loomba_abund(location):
     args.matches_csv = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.csv")
     args.databases = [utils.relative_file('tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.abund.zip')]
     args.lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
-    args.hitlist = utils.relative_file("tests/test-data/loomba-hit-list.csv")
+    args.hitlist = copy_hit_list(location)
     args.json_out = os.path.join(location, 'tax.json')
     args.match_rank = 'genus'
 
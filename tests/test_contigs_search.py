@@ -1,6 +1,7 @@
 import os.path
 from . import pytest_utils as utils
 import json
+import screed
 
 from charcoal import contigs_search_taxonomy
 
@@ -77,3 +78,67 @@ def test_3_loomba(location):
     with open(args.json_out, 'rt') as fp:
         results = json.load(fp)
         assert results != {}
+
+
+@utils.in_tempdir
+def test_4_loomba_threads(location):
+    # same results on Loomba when classifying contigs in parallel,
+    # in the same (file) order.
+    args = utils.Args()
+    args.genome = utils.relative_file("demo/genomes/LoombaR_2017__SID1050_bax__bin.11.fa.gz")
+    args.genome_sig = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.sig")
+    args.matches_csv = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.csv")
+    args.databases = [ utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.zip") ]
+    args.lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    args.json_out = os.path.join(location, 'tax.json')
+    args.match_rank = 'genus'
+    args.threads = 4
+
+    status = contigs_search_taxonomy.main(args)
+
+    assert status == 0
+
+    with open(args.json_out, 'rt') as fp:
+        this_results = json.load(fp)
+
+    saved_results_file = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.contigs-tax.json")
+    with open(saved_results_file, 'rt') as fp:
+        saved_results = json.load(fp)
+
+    assert this_results == saved_results
+
+    names = [ record.name for record in screed.open(args.genome) ]
+    assert list(this_results) == names
+
+
+@utils.in_tempdir
+def test_5_loomba_contig_sketches(location):
+    # same results on Loomba when using precomputed contig sketches.
+    from charcoal.contig_sketches import ContigSketches, make_template_minhash
+
+    args = utils.Args()
+    args.genome = utils.relative_file("demo/genomes/LoombaR_2017__SID1050_bax__bin.11.fa.gz")
+    args.genome_sig = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.sig")
+    args.matches_csv = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.csv")
+    args.databases = [ utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.matches.zip") ]
+    args.lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    args.json_out = os.path.join(location, 'tax.json')
+    args.match_rank = 'genus'
+    args.contig_sketches = os.path.join(location, 'contigs.sketch')
+
+    template_mh = make_template_minhash(31, 1000, 'DNA')
+    sketches = ContigSketches.from_fasta(args.genome, template_mh)
+    sketches.save(args.contig_sketches)
+
+    status = contigs_search_taxonomy.main(args)
+
+    assert status == 0
+
+    with open(args.json_out, 'rt') as fp:
+        this_results = json.load(fp)
+
+    saved_results_file = utils.relative_file("tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.contigs-tax.json")
+    with open(saved_results_file, 'rt') as fp:
+        saved_results = json.load(fp)
+
+    assert this_results == saved_results
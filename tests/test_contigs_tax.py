@@ -0,0 +1,80 @@
+import os.path
+from . import pytest_utils as utils
+import json
+
+from charcoal import contigs_tax
+from charcoal.contigs_tax import (ContigsTax, load_contigs_tax,
+                                  load_contigs_tax_json, save_contigs_tax,
+                                  find_contigs_tax, is_binary_contigs_tax)
+
+
+LOOMBA_JSON = "tests/test-data/loomba/LoombaR_2017__SID1050_bax__bin.11.fa.gz.contigs-tax.json"
+
+
+@utils.in_tempdir
+def test_1_round_trip(location):
+    # the binary format should load the same contents as the JSON.
+    json_d = load_contigs_tax_json(utils.relative_file(LOOMBA_JSON))
+
+    filename = os.path.join(location, 'x.contigs-tax.bin')
+    save_contigs_tax(json_d, filename)
+    assert is_binary_contigs_tax(filename)
+
+    bin_d = load_contigs_tax(filename)
+    assert isinstance(bin_d, ContigsTax)
+    assert len(bin_d) == len(json_d)
+    assert list(bin_d) == list(json_d)
+    assert dict(bin_d.items()) == json_d
+    for name in json_d:
+        assert bin_d[name] == json_d[name]
+
+    # lineages are interned.
+    assert len(bin_d.lineages) == len(set(bin_d.lineages))
+
+    # and the binary file is smaller.
+    assert os.path.getsize(filename) < \
+        os.path.getsize(utils.relative_file(LOOMBA_JSON))
+
+
+@utils.in_tempdir
+def test_2_export_json(location):
+    # converting to binary & back to JSON gives the same JSON.
+    args = utils.Args()
+    args.input = utils.relative_file(LOOMBA_JSON)
+    args.output = os.path.join(location, 'x.contigs-tax.bin')
+    assert contigs_tax.main(args) == 0
+
+    args.input = args.output
+    args.output = os.path.join(location, 'x.contigs-tax.json')
+    assert contigs_tax.main(args) == 0
+
+    with open(args.output, 'rt') as fp:
+        exported = json.load(fp)
+    with open(utils.relative_file(LOOMBA_JSON), 'rt') as fp:
+        saved = json.load(fp)
+
+    assert exported == saved
+
+
+@utils.in_tempdir
+def test_3_empty(location):
+    # no contigs, e.g. when there are no non-identical matches.
+    filename = os.path.join(location, 'x.contigs-tax.bin')
+    save_contigs_tax({}, filename)
+
+    d = load_contigs_tax(filename)
+    assert len(d) == 0
+    assert dict(d.items()) == {}
+
+
+@utils.in_tempdir
+def test_4_find(location):
+    # binary is preferred over JSON; JSON is the fallback.
+    json_file = os.path.join(location, 'g.contigs-tax.json')
+    bin_file = os.path.join(location, 'g.contigs-tax.bin')
+
+    assert find_contigs_tax(location, 'g') == json_file
+    save_contigs_tax({}, json_file)
+    assert find_contigs_tax(location, 'g') == json_file
+    save_contigs_tax({}, bin_file)
+    assert find_contigs_tax(location, 'g') == bin_file
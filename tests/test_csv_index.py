@@ -0,0 +1,126 @@
+import os
+import csv
+from . import pytest_utils as utils
+
+from charcoal import csv_index
+from charcoal.utils import CSV_DictHelper, IndexedCSV_DictHelper
+
+
+FIELDNAMES = ['genome', 'filter_at', 'lineage', 'comment']
+
+
+def make_csv(filename, n_rows=50):
+    "Write a CSV w/commas, quotes, and newlines in some fields."
+    with open(filename, 'wt', newline='') as fp:
+        w = csv.writer(fp)
+        w.writerow(FIELDNAMES)
+        for i in range(n_rows):
+            comment = ''
+            if i % 3 == 0:
+                comment = f'a comment, with "quotes"\nand a newline {i}'
+            w.writerow([f'genome{i}.fa.gz', 'genus' if i % 2 else 'none',
+                        f'd__Bacteria;p__phylum{i % 5}', comment])
+
+
+def index_csv(filename, key='genome'):
+    "Build the index, as the Snakefile does."
+    args = utils.Args()
+    args.csv = filename
+    args.key = key
+    args.output = None
+    assert csv_index.main(args) == 0
+
+
+@utils.in_tempdir
+def test_1_lookup(location):
+    # indexed lookups give the same rows as CSV_DictHelper.
+    filename = os.path.join(location, 'hitlist.csv')
+    make_csv(filename)
+    index_csv(filename)
+    assert os.path.exists(filename + csv_index.INDEX_SUFFIX)
+
+    expected = CSV_DictHelper(filename, 'genome')
+    indexed = IndexedCSV_DictHelper(filename, 'genome')
+
+    assert len(indexed) == len(expected) == 50
+    assert list(indexed) == list(expected)
+    for genome in expected:
+        assert indexed[genome] == expected[genome]
+        assert genome in indexed
+
+    assert indexed['genome3.fa.gz'].comment.endswith('and a newline 3')
+    assert 'nosuchgenome' not in indexed
+    try:
+        indexed['nosuchgenome']
+        assert 0, "should raise KeyError"
+    except KeyError:
+        pass
+
+    assert isinstance(indexed.index, csv_index.CSVIndex)
+
+
+@utils.in_tempdir
+def test_2_stale_index(location):
+    # the index is rebuilt when the CSV changes, but not when touched.
+    filename = os.path.join(location, 'hitlist.csv')
+    index_filename = filename + csv_index.INDEX_SUFFIX
+    make_csv(filename)
+
+    index = csv_index.load_csv_index(filename, 'genome')
+    assert index.get('genome7.fa.gz')['filter_at'] == 'genus'
+
+    # touch the CSV
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    before = os.stat(index_filename).st_ino
+    index = csv_index.load_csv_index(filename, 'genome')
+    assert os.stat(index_filename).st_ino == before        # not rebuilt
+    assert index.csv_mtime == os.stat(filename).st_mtime_ns
+
+    # change the CSV
+    make_csv(filename, n_rows=10)
+    index = csv_index.load_csv_index(filename, 'genome')
+    assert len(index) == 10
+    assert index.get('genome7.fa.gz')['filter_at'] == 'genus'
+    assert index.get('genome17.fa.gz') is None
+
+
+@utils.in_tempdir
+def test_3_duplicate_keys(location):
+    filename = os.path.join(location, 'hitlist.csv')
+    make_csv(filename)
+
+    try:
+        csv_index.load_csv_index(filename, 'filter_at')
+        assert 0, "should raise ValueError"
+    except ValueError as exc:
+        assert 'duplicate key value' in str(exc)
+
+
+@utils.in_tempdir
+def test_4_readers_never_write(location):
+    # with no index, or a stale one, readers load the CSV instead of
+    # (re)building the index.
+    filename = os.path.join(location, 'hitlist.csv')
+    index_filename = filename + csv_index.INDEX_SUFFIX
+    make_csv(filename)
+
+    assert csv_index.open_csv_index(filename, 'genome') is None
+    indexed = IndexedCSV_DictHelper(filename, 'genome')
+    assert len(indexed) == 50
+    assert indexed['genome7.fa.gz'].filter_at == 'genus'
+    assert not os.path.exists(index_filename)
+
+    index_csv(filename)
+    st = os.stat(index_filename)
+    assert csv_index.open_csv_index(filename, 'genome') is not None
+    assert csv_index.open_csv_index(filename, 'filter_at') is None
+
+    # change the CSV
+    make_csv(filename, n_rows=10)
+    assert csv_index.open_csv_index(filename, 'genome') is None
+    indexed = IndexedCSV_DictHelper(filename, 'genome')
+    assert len(indexed) == 10
+    assert 'genome17.fa.gz' not in indexed
+    assert os.stat(index_filename).st_mtime_ns == st.st_mtime_ns
+    assert os.stat(index_filename).st_ino == st.st_ino
@@ -7,6 +7,7 @@ import screed
 
 from charcoal import just_taxonomy, utils
 from charcoal.lineage_db import LineageDB
+from charcoal.taxonomy_index import build_taxonomy_index
 from charcoal.just_taxonomy import ContigInfo
 
 import sourmash
@@ -57,7 +58,6 @@ def make_lca_and_lineages(match_files, lineages_csv, scaled, ksize,
                           start_column=3):
     "Build an LCA_Database and LineageDB."
     lca_db = LCA_Database(ksize=ksize, scaled=scaled)
-    lin_db = LineageDB()
 
     # load matches into a list
     siglist = []
@@ -67,6 +67,7 @@ def make_lca_and_lineages(match_files, lineages_csv, scaled, ksize,
     # pull in taxonomic assignments
     tax_assign, _ = load_taxonomy_assignments(lineages_csv,
                                               start_column=start_column)
+    lin_db = LineageDB(build_taxonomy_index(tax_assign))
 
     # build database of matches & lineages!
     for ss in siglist:
@@ -0,0 +1,227 @@
+"Tests for download_genomes, against a local HTTP server."
+import os.path
+import csv
+import gzip
+import hashlib
+import random
+import threading
+import http.server
+from contextlib import contextmanager
+from . import pytest_utils as utils
+
+from charcoal import download_genomes
+
+
+def make_genome(name, size=100000):
+    "A gzipped random 'genome'."
+    rng = random.Random(name)
+    seq = ''.join(rng.choice('ACGT') for i in range(size))
+    return gzip.compress(f'>{name}\n{seq}\n'.encode('utf-8'))
+
+
+@contextmanager
+def genome_server(files, md5sums, truncate=()):
+    """
+    Serve 'files' (path -> content) w/Range support, plus an
+    md5checksums.txt per directory. Paths in 'truncate' are cut short on
+    their first request, as if the connection dropped.
+    """
+    stats = dict(requests=[], ranges=[])
+    truncate = set(truncate)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            stats['requests'].append(self.path)
+            if self.path.endswith('/md5checksums.txt'):
+                dirname = self.path.rsplit('/', 1)[0]
+                content = ''.join(f'{md5}  ./{path.rsplit("/", 1)[1]}\n'
+                                  for path, md5 in md5sums.items()
+                                  if path.startswith(dirname + '/'))
+                content = content.encode('utf-8')
+            else:
+                content = files.get(self.path)
+            if content is None:
+                self.send_error(404)
+                return
+
+            start = 0
+            rng = self.headers.get('Range')
+            if rng:
+                stats['ranges'].append(rng)
+                start = int(rng.split('=')[1].split('-')[0])
+                if start >= len(content):
+                    self.send_response(416)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range',
+                                 f'bytes {start}-{len(content) - 1}/{len(content)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(content) - start))
+            self.end_headers()
+
+            if self.path in truncate:
+                truncate.remove(self.path)
+                self.wfile.write(content[start:start + len(content) // 3])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(content[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}', stats
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_fixtures(names):
+    files = {}
+    md5sums = {}
+    for name in names:
+        path = f'/genomes/all/{name}/{name}_genomic.fna.gz'
+        files[path] = make_genome(name)
+        md5sums[path] = hashlib.md5(files[path]).hexdigest()
+    return files, md5sums
+
+
+def write_info_csv(filename, acc, url):
+    with open(filename, 'wt', newline='') as fp:
+        w = csv.DictWriter(fp, fieldnames=['acc', 'genome_url',
+                                           'assembly_report_url',
+                                           'ncbi_tax_name'])
+        w.writeheader()
+        w.writerow(dict(acc=acc, genome_url=url, assembly_report_url='',
+                        ncbi_tax_name=f'{acc} name'))
+
+
+def make_args(**kw):
+    args = utils.Args()
+    args.info_csvs = []
+    args.info_list = None
+    args.output = None
+    args.output_dir = None
+    args.jobs = 2
+    args.retries = 3
+    args.genome_cache = None
+    args.cache_max_gb = None
+    args.__dict__.update(kw)
+    return args
+
+
+def test_parse_md5checksums():
+    content = b'ABC123  ./GCA_1.1_x_genomic.fna.gz\nbad line here\nd41d8  ./md5checksums.txt\n'
+    assert download_genomes.parse_md5checksums(content) == {
+        'GCA_1.1_x_genomic.fna.gz': 'abc123', 'md5checksums.txt': 'd41d8' }
+
+
+@utils.in_tempdir
+def test_download_several(location):
+    names = ['GCA_000000001.1_A', 'GCA_000000002.1_B', 'GCA_000000003.1_C']
+    files, md5sums = make_fixtures(names)
+
+    # the first download of one genome is cut short, & then resumed.
+    cut = f'/genomes/all/{names[1]}/{names[1]}_genomic.fna.gz'
+    with genome_server(files, md5sums, truncate=[cut]) as (url, stats):
+        info_list = os.path.join(location, 'infos.txt')
+        with open(info_list, 'wt') as fp:
+            for name in names:
+                acc = name.rsplit('_', 1)[0]
+                info_csv = os.path.join(location, f'{acc}.info.csv')
+                write_info_csv(info_csv, acc,
+                               f'{url}/genomes/all/{name}/{name}_genomic.fna.gz')
+                fp.write(info_csv + '\n')
+
+        outdir = os.path.join(location, 'genomes')
+        os.mkdir(outdir)
+        args = make_args(info_list=info_list, output_dir=outdir)
+        assert download_genomes.main(args) == 0
+
+        for name in names:
+            acc = name.rsplit('_', 1)[0]
+            filename = os.path.join(outdir, f'{acc}_genomic.fna.gz')
+            with open(filename, 'rb') as fp:
+                assert fp.read() == files[f'/genomes/all/{name}/{name}_genomic.fna.gz']
+        assert not [ f for f in os.listdir(outdir) if f.endswith('.part') ]
+
+        # resumed where it was cut off.
+        assert stats['ranges'] == [f'bytes={len(files[cut]) // 3}-']
+
+        # existing genomes are not downloaded again.
+        n_requests = len(stats['requests'])
+        assert download_genomes.main(args) == 0
+        assert len(stats['requests']) == n_requests
+
+
+@utils.in_tempdir
+def test_resume_part_file(location):
+    name = 'GCA_000000001.1_A'
+    files, md5sums = make_fixtures([name])
+    path = f'/genomes/all/{name}/{name}_genomic.fna.gz'
+    content = files[path]
+
+    with genome_server(files, md5sums) as (url, stats):
+        info_csv = os.path.join(location, 'x.info.csv')
+        write_info_csv(info_csv, 'GCA_000000001.1', url + path)
+        output = os.path.join(location, 'genome.fna.gz')
+
+        # a partial file left by a killed job is resumed...
+        with open(output + '.part', 'wb') as fp:
+            fp.write(content[:1000])
+        args = make_args(info_csvs=[info_csv], output=output)
+        assert download_genomes.main(args) == 0
+        assert stats['ranges'] == ['bytes=1000-']
+        with open(output, 'rb') as fp:
+            assert fp.read() == content
+
+        # ...as is a complete one that wasn't renamed yet.
+        os.rename(output, output + '.part')
+        assert download_genomes.main(args) == 0
+        assert stats['ranges'][-1] == f'bytes={len(content)}-'
+        with open(output, 'rb') as fp:
+            assert fp.read() == content
+
+
+@utils.in_tempdir
+def test_checksum_mismatch(location):
+    name = 'GCA_000000001.1_A'
+    files, md5sums = make_fixtures([name])
+    path = f'/genomes/all/{name}/{name}_genomic.fna.gz'
+    md5sums[path] = hashlib.md5(b'something else').hexdigest()
+
+    with genome_server(files, md5sums) as (url, stats):
+        info_csv = os.path.join(location, 'x.info.csv')
+        write_info_csv(info_csv, 'GCA_000000001.1', url + path)
+        output = os.path.join(location, 'genome.fna.gz')
+
+        args = make_args(info_csvs=[info_csv], output=output, retries=2)
+        assert download_genomes.main(args) == -1
+        assert not os.path.exists(output)
+        assert not os.path.exists(output + '.part')
+        assert stats['requests'].count(path) == 2         # retried
+
+
+@utils.in_tempdir
+def test_missing_genome(location):
+    files, md5sums = make_fixtures([])
+    with genome_server(files, md5sums) as (url, stats):
+        info_csv = os.path.join(location, 'x.info.csv')
+        write_info_csv(info_csv, 'GCA_000000009.1',
+                       url + '/genomes/all/nope/nope_genomic.fna.gz')
+        output = os.path.join(location, 'genome.fna.gz')
+
+        args = make_args(info_csvs=[info_csv], output=output)
+        assert download_genomes.main(args) == -1
+        assert not os.path.exists(output)
+        # not found isn't retried.
+        assert stats['requests'].count('/genomes/all/nope/nope_genomic.fna.gz') == 1
@@ -0,0 +1,131 @@
+import os.path
+import gzip
+import io
+from . import pytest_utils as utils
+
+import screed
+
+from charcoal.fasta_index import (iter_fasta_records, load_or_build_offsets,
+                                  RawFasta, OFFSETS_SUFFIX)
+from charcoal.fasta_writer import FastaWriter
+
+
+LOOMBA = "demo/genomes/LoombaR_2017__SID1050_bax__bin.11.fa.gz"
+
+# CRLF, blank lines, empty sequences, descriptions, no final newline.
+ODD_FASTA = b'>a desc\r\nACGT\r\nAC\r\n>b\nAAAA\nCC\n\n>c\n>d x\nA'
+
+
+def test_iter_fasta_records():
+    # same names & lengths as screed, for any chunk size; the raw bytes
+    # add up to the whole file.
+    records = [ (r.name, len(r.sequence)) for r in
+                screed.fasta.fasta_iter(io.StringIO(ODD_FASTA.decode())) ]
+
+    for chunk_size in (1, 2, 3, 7, 1024):
+        x = list(iter_fasta_records(io.BytesIO(ODD_FASTA),
+                                    chunk_size=chunk_size))
+        assert [ (o.name, o.length) for o, _ in x ] == records
+        assert b''.join([ data for _, data in x ]) == ODD_FASTA
+
+    offsets = [ o for o, _ in iter_fasta_records(io.BytesIO(ODD_FASTA)) ]
+    assert offsets[0].linebases == 4 and offsets[0].linewidth == 6
+    assert offsets[1].linebases == 4 and offsets[1].linewidth == 5
+    assert offsets[1].start == offsets[0].end
+
+
+def test_iter_fasta_leading_blank_lines():
+    # blank lines before the first record are skipped.
+    for chunk_size in (1, 3, 1024):
+        x = list(iter_fasta_records(io.BytesIO(b'\n \r\n' + ODD_FASTA),
+                                    chunk_size=chunk_size))
+        assert [ o.name for o, _ in x ] == ['a desc', 'b', 'c', 'd x']
+        assert x[0][0].start == 4
+        assert b''.join([ data for _, data in x ]) == ODD_FASTA
+
+    assert list(iter_fasta_records(io.BytesIO(b'\n\n'))) == []
+
+
+@utils.in_tempdir
+def test_offsets_file(location):
+    # offsets are saved to the given file, and rebuilt if stale.
+    genome = os.path.join(location, 'genome.fa')
+    with gzip.open(utils.relative_file(LOOMBA), 'rb') as fp:
+        data = fp.read()
+    with open(genome, 'wb') as fp:
+        fp.write(data)
+
+    # ...nothing is written next to the genome by default.
+    offsets = load_or_build_offsets(genome)
+    assert os.listdir(location) == ['genome.fa']
+    assert [ x.name for x in offsets ] == \
+        [ r.name for r in screed.open(genome) ]
+
+    offsets_file = os.path.join(location, 'out', 'genome.fa' + OFFSETS_SUFFIX)
+    os.mkdir(os.path.dirname(offsets_file))
+    assert load_or_build_offsets(genome, offsets_file) == offsets
+    assert os.path.exists(offsets_file)
+    assert load_or_build_offsets(genome, offsets_file) == offsets
+
+    # ...& if they can't be saved, they're used from memory.
+    unwritable = os.path.join(location, 'nosuchdir', 'genome.fa.offsets')
+    assert load_or_build_offsets(genome, unwritable) == offsets
+
+    for x in offsets:
+        assert data[x.start:x.start + 1] == b'>'
+        seq = data[x.seq_start:x.end].replace(b'\n', b'')
+        assert len(seq) == x.length
+
+    # change the file => new offsets.
+    with open(genome, 'wb') as fp:
+        fp.write(b'>new\nACGT\n')
+    offsets = load_or_build_offsets(genome, offsets_file)
+    assert [ (x.name, x.length) for x in offsets ] == [('new', 4)]
+
+
+@utils.in_tempdir
+def test_raw_fasta_copy(location):
+    # copying all records gives back the input, compressed or not.
+    with gzip.open(utils.relative_file(LOOMBA), 'rb') as fp:
+        data = fp.read()
+    plain = os.path.join(location, 'genome.fa')
+    with open(plain, 'wb') as fp:
+        fp.write(data)
+
+    for genome in (utils.relative_file(LOOMBA), plain):
+        for out in ('out.fa', 'out.fa.gz'):
+            out = os.path.join(location, out)
+            with RawFasta(genome) as fasta, FastaWriter(out) as w:
+                for record in fasta:
+                    fasta.copy_record(record, w)
+
+            xopen = gzip.open if out.endswith('.gz') else open
+            with xopen(out, 'rb') as fp:
+                assert fp.read() == data
+
+            # .fai is valid for the copied line lengths.
+            with open(out + '.fai', 'rt') as fp:
+                for line, record in zip(fp, screed.open(genome)):
+                    name, *values = line.split('\t')
+                    length, offset, linebases, linewidth = map(int, values)
+                    assert name == record.name.split()[0]
+                    assert length == len(record.sequence)
+                    first_line = data[offset:offset + linewidth]
+                    assert first_line[:linebases] == \
+                        record.sequence[:linebases].encode()
+
+
+@utils.in_tempdir
+def test_raw_fasta_no_final_newline(location):
+    # a missing newline at the end of the input is added.
+    genome = os.path.join(location, 'genome.fa')
+    with open(genome, 'wb') as fp:
+        fp.write(ODD_FASTA)
+
+    out = os.path.join(location, 'out.fa')
+    with RawFasta(genome) as fasta, FastaWriter(out) as w:
+        for record in fasta:
+            fasta.copy_record(record, w)
+
+    with open(out, 'rb') as fp:
+        assert fp.read() == ODD_FASTA + b'\n'
@@ -0,0 +1,140 @@
+import os.path
+import gzip
+import struct
+from . import pytest_utils as utils
+
+import pytest
+import screed
+
+from charcoal.fasta_writer import (FastaWriter, codec_for_filename,
+                                   BGZF_BLOCK_SIZE, BGZF_EOF)
+
+
+LOOMBA = "demo/genomes/LoombaR_2017__SID1050_bax__bin.11.fa.gz"
+
+
+def load_records():
+    return [ (r.name, r.sequence) for r in
+             screed.open(utils.relative_file(LOOMBA)) ]
+
+
+def write_records(filename, records, **kw):
+    with FastaWriter(filename, **kw) as w:
+        for name, sequence in records:
+            w.write_record(name, sequence)
+
+
+def check_fai(fai_filename, data, records):
+    "Check that the .fai index points at each sequence in 'data'."
+    with open(fai_filename, 'rt') as fp:
+        lines = fp.readlines()
+    assert len(lines) == len(records)
+
+    for line, (name, sequence) in zip(lines, records):
+        fai_name, length, offset, linebases, linewidth = line.split('\t')
+        length, offset = int(length), int(offset)
+        assert fai_name == name.split()[0]
+        assert length == len(sequence) == int(linebases)
+        assert int(linewidth) == length + 1
+        assert data[offset:offset + length] == sequence.encode('ascii')
+
+
+def test_codec_for_filename():
+    assert codec_for_filename('x.fa.gz') == 'bgzf'
+    assert codec_for_filename('x.fa.zst') == 'zstd'
+    assert codec_for_filename('x.fa') == 'none'
+
+
+@utils.in_tempdir
+def test_1_bgzf(location):
+    # BGZF output is valid gzip, w/valid blocks and indices.
+    records = load_records()
+    filename = os.path.join(location, 'out.fa.gz')
+    write_records(filename, records)
+
+    with gzip.open(filename, 'rb') as fp:
+        data = fp.read()
+    expected = ''.join([ f'>{n}\n{s}\n' for n, s in records ])
+    assert data == expected.encode('ascii')
+
+    # screed can read it, too.
+    names = [ r.name for r in screed.open(filename) ]
+    assert names == [ n for n, s in records ]
+
+    check_fai(filename + '.fai', data, records)
+
+    # each .gzi entry points to the start of a block, which decompresses
+    # to the right piece of the file.
+    with open(filename, 'rb') as fp:
+        raw = fp.read()
+    assert raw.endswith(BGZF_EOF)
+
+    with open(filename + '.gzi', 'rb') as fp:
+        gzi = fp.read()
+    n_blocks, = struct.unpack_from('<Q', gzi)
+    assert n_blocks == (len(data) + BGZF_BLOCK_SIZE - 1) // BGZF_BLOCK_SIZE
+
+    offsets = [(0, 0)] + [ struct.unpack_from('<QQ', gzi, 8 + 16*i)
+                           for i in range(n_blocks) ]
+    for (c_start, u_start), (c_end, u_end) in zip(offsets, offsets[1:]):
+        assert raw[c_start:c_start + 4] == b'\x1f\x8b\x08\x04'
+        bsize, = struct.unpack_from('<H', raw, c_start + 16)
+        assert c_end - c_start == bsize + 1
+        assert gzip.decompress(raw[c_start:c_end]) == data[u_start:u_end]
+
+
+@utils.in_tempdir
+def test_2_bgzf_threads(location):
+    # compressing on multiple threads gives the same output.
+    records = load_records()
+    one = os.path.join(location, 'one.fa.gz')
+    four = os.path.join(location, 'four.fa.gz')
+    write_records(one, records, threads=1, level=1)
+    write_records(four, records, threads=4, level=1)
+
+    for suffix in ('', '.fai', '.gzi'):
+        with open(one + suffix, 'rb') as fp1, open(four + suffix, 'rb') as fp2:
+            assert fp1.read() == fp2.read()
+
+
+@utils.in_tempdir
+def test_3_uncompressed(location):
+    # other filenames are written uncompressed, w/a .fai index.
+    records = load_records()
+    filename = os.path.join(location, 'out.fa')
+    write_records(filename, records)
+
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    check_fai(filename + '.fai', data, records)
+    assert not os.path.exists(filename + '.gzi')
+
+
+@utils.in_tempdir
+def test_4_zstd(location):
+    # zstd output, if the zstandard module is installed.
+    zstandard = pytest.importorskip('zstandard')
+
+    records = load_records()
+    filename = os.path.join(location, 'out.fa.zst')
+    write_records(filename, records, threads=2)
+
+    with open(filename, 'rb') as fp:
+        data = zstandard.ZstdDecompressor().stream_reader(fp).read()
+    expected = ''.join([ f'>{n}\n{s}\n' for n, s in records ])
+    assert data == expected.encode('ascii')
+    assert not os.path.exists(filename + '.fai')
+
+
+@utils.in_tempdir
+def test_5_empty(location):
+    # no records => just the EOF block.
+    filename = os.path.join(location, 'out.fa.gz')
+    write_records(filename, [])
+
+    with open(filename, 'rb') as fp:
+        assert fp.read() == BGZF_EOF
+    with gzip.open(filename, 'rb') as fp:
+        assert fp.read() == b''
+    with open(filename + '.gzi', 'rb') as fp:
+        assert fp.read() == struct.pack('<Q', 0)
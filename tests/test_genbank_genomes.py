@@ -0,0 +1,156 @@
+"Tests for genbank_genomes, against a local stand-in for NCBI."
+import os.path
+import csv
+import threading
+import http.server
+from contextlib import contextmanager
+from . import pytest_utils as utils
+
+from charcoal import genbank_genomes
+
+
+GENOMES = '/genomes/all'
+
+# accession -> (directory, assembly name, taxid, tax name)
+ASSEMBLIES = {
+    'GCA_001593925.1': ('GCA/001/593/925', 'GCA_001593925.1_ASM159392v1',
+                        '1313', 'Candidatus Dactylopiibacterium carminicum'),
+    'GCA_000005845.2': ('GCA/000/005/845', 'GCA_000005845.2_ASM584v2',
+                        '511145', 'Escherichia coli str. K-12 substr. MG1655'),
+}
+
+
+def make_pages():
+    "URL path -> content, for the fixture assemblies."
+    pages = {}
+    for i, (dirname, name, taxid, tax_name) in enumerate(ASSEMBLIES.values()):
+        if i == 0:                        # HTML listing, as from https://
+            listing = f'<html><body><a href="../">Parent Directory</a>\n<a href="{name}/">{name}/</a>\n</body></html>\n'
+        else:                             # FTP-style listing
+            listing = f'dr-xr-xr-x   2 ftp      anonymous     4096 Mar 10  2021 {name}\n'
+        pages[f'{GENOMES}/{dirname}/'] = listing
+        pages[f'{GENOMES}/{dirname}/{name}/{name}_assembly_report.txt'] = \
+            f'# Assembly name:  {name}\n# Taxid:          {taxid}\n'
+        pages[f'/taxonomy/?term={taxid}&report=taxon&format=text'] = \
+            f'<pre>\n{tax_name}\n</pre>'
+    return { k: v.encode('utf-8') for k, v in pages.items() }
+
+
+@contextmanager
+def ncbi_server(pages):
+    "Serve 'pages' over HTTP/1.1 (keep-alive) in a thread."
+    stats = dict(requests=[], connections=0)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            stats['connections'] += 1
+
+        def do_GET(self):
+            stats['requests'].append(self.path)
+            if self.path.startswith('/taxonomy-old/'):
+                self.send_response(301)
+                self.send_header('Location', self.path.replace('-old', ''))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            content = pages.get(self.path)
+            if content is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}', stats
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_args(location, url, accessions, **kw):
+    args = utils.Args()
+    args.accessions = accessions
+    args.accession_list = None
+    args.output = os.path.join(location, 'info.csv')
+    args.accession_index = None
+    args.jobs = 2
+    args.cache_dir = os.path.join(location, 'cache')
+    args.cache_max_age = 30
+    args.genomes_url = url + GENOMES
+    args.taxonomy_url = url + '/taxonomy/'
+    args.genome_cache = None
+    args.__dict__.update(kw)
+    return args
+
+
+def load_info(filename):
+    with open(filename, 'rt') as fp:
+        return { row['acc']: row for row in csv.DictReader(fp) }
+
+
+def test_parse_directory_listing():
+    html = b'<a href="../">up</a> <A HREF="GCA_1.1_x/">GCA_1.1_x/</A>'
+    assert genbank_genomes.parse_directory_listing(html) == ['..', 'GCA_1.1_x']
+    ftp = b'dr-xr-xr-x 2 ftp anonymous 4096 Mar 10 2021 GCA_1.1_x\r\n\r\n'
+    assert genbank_genomes.parse_directory_listing(ftp) == ['GCA_1.1_x']
+
+
+@utils.in_tempdir
+def test_resolve_many(location):
+    with ncbi_server(make_pages()) as (url, stats):
+        args = make_args(location, url, ['GCA_001593925', 'GCA_000005845.2'])
+        assert genbank_genomes.main(args) == 0
+
+        # three requests per accession, on at most one connection per job.
+        assert len(stats['requests']) == 6
+        assert stats['connections'] <= 2
+
+        info = load_info(args.output)
+        assert list(info) == ['GCA_001593925', 'GCA_000005845.2']
+        row = info['GCA_001593925']
+        assert row['genome_url'] == f'{url}{GENOMES}/GCA/001/593/925/GCA_001593925.1_ASM159392v1/GCA_001593925.1_ASM159392v1_genomic.fna.gz'
+        assert row['assembly_report_url'].endswith('/GCA_001593925.1_ASM159392v1_assembly_report.txt')
+        assert row['ncbi_tax_name'] == 'Candidatus Dactylopiibacterium carminicum'
+        assert info['GCA_000005845.2']['ncbi_tax_name'] == 'Escherichia coli str. K-12 substr. MG1655'
+
+        # again, from the cache: no more requests.
+        os.unlink(args.output)
+        assert genbank_genomes.main(args) == 0
+        assert len(stats['requests']) == 6
+        assert load_info(args.output) == info
+
+        # expired cache entries are fetched again.
+        args.cache_max_age = 0
+        assert genbank_genomes.main(args) == 0
+        assert len(stats['requests']) == 12
+
+
+@utils.in_tempdir
+def test_resolve_list_and_errors(location):
+    acc_list = os.path.join(location, 'accs.txt')
+    with open(acc_list, 'wt') as fp:
+        fp.write('GCA_000005845.2\nGCA_999999999.1\n\nGCA_000005845.2\n')
+
+    with ncbi_server(make_pages()) as (url, stats):
+        # one accession can't be found; the rest are still resolved.
+        args = make_args(location, url, [], accession_list=acc_list,
+                         cache_dir=None, taxonomy_url=url + '/taxonomy-old/')
+        assert genbank_genomes.main(args) == -1
+
+        info = load_info(args.output)
+        assert list(info) == ['GCA_000005845.2']
+        assert info['GCA_000005845.2']['ncbi_tax_name'] == 'Escherichia coli str. K-12 substr. MG1655'
+        # followed the taxonomy redirect.
+        assert '/taxonomy-old/?term=511145&report=taxon&format=text' in stats['requests']
@@ -0,0 +1,128 @@
+"Tests for the shared genome cache."
+import os.path
+import pytest
+from . import pytest_utils as utils
+
+from charcoal import genome_cache, download_genomes
+from charcoal.genome_cache import GenomeCache
+
+from .test_download_genomes import (genome_server, make_fixtures,
+                                    write_info_csv, make_args)
+
+
+def write_file(filename, content):
+    with open(filename, 'wb') as fp:
+        fp.write(content)
+    return filename
+
+
+def set_last_used(cache, acc, when):
+    os.utime(cache._ref_path(acc), (when, when))
+
+
+@utils.in_tempdir
+def test_add_and_get(location):
+    cache = GenomeCache(os.path.join(location, 'cache'))
+    assert cache.get('GCA_000000001.1') is None
+
+    genome = write_file(os.path.join(location, 'a.fna.gz'), b'AAAA')
+    path = cache.add('GCA_000000001.1', genome)
+    assert not os.path.exists(genome)                 # moved into the cache
+    assert path == cache.get('GCA_000000001.1')
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'AAAA'
+
+    # w/o a version.
+    assert cache.get('GCA_000000001') == path
+    assert cache.get('GCA_000000002') is None
+
+    # identical genomes are stored once.
+    genome = write_file(os.path.join(location, 'b.fna.gz'), b'AAAA')
+    assert cache.add('GCA_000000002.1', genome) == path
+    assert len(cache.entries()) == 2
+    assert cache.total_size() == 4
+
+
+@utils.in_tempdir
+def test_lru_eviction(location):
+    cache = GenomeCache(os.path.join(location, 'cache'))
+    for i, acc in enumerate(['GCA_1.1', 'GCA_2.1', 'GCA_3.1']):
+        genome = write_file(os.path.join(location, 'g'), acc.encode() * 100)
+        cache.add(acc, genome)
+        set_last_used(cache, acc, 1000 + i)
+
+    # using a genome makes it the most recently used.
+    path1 = cache.get('GCA_1.1')
+    set_last_used(cache, 'GCA_1.1', 2000)
+    set_last_used(cache, 'GCA_3.1', 1500)
+
+    assert cache.evict(1500) == ['GCA_2.1']
+    assert cache.get('GCA_2.1') is None
+    assert cache.get('GCA_1.1') == path1
+    set_last_used(cache, 'GCA_1.1', 2000)
+    assert cache.total_size() == 1400
+
+    # recently used genomes are kept, over the cap.
+    genome = write_file(os.path.join(location, 'g'), b'X' * 1000)
+    cache.add('GCA_4.1', genome)
+    assert cache.evict(0) == ['GCA_3.1', 'GCA_1.1']
+    assert cache.get('GCA_4.1') is not None
+
+
+@utils.in_tempdir
+def test_find_genome(location):
+    genome_dir = os.path.join(location, 'genbank_genomes')
+    os.mkdir(genome_dir)
+    local = write_file(os.path.join(genome_dir, 'GCA_1.1_genomic.fna.gz'), b'A')
+
+    cache = GenomeCache(os.path.join(location, 'cache'))
+    cached = cache.add('GCA_2.1', write_file(os.path.join(location, 'g'), b'C'))
+
+    assert genome_cache.find_genome('GCA_1.1', genome_dir) == local
+    assert genome_cache.find_genome('GCA_2.1', genome_dir, cache.dirname) == cached
+    with pytest.raises(FileNotFoundError):
+        genome_cache.find_genome('GCA_2.1', genome_dir)
+
+    # a link to an evicted genome is skipped.
+    genome_cache.link_genome(os.path.join(location, 'gone'),
+                             os.path.join(genome_dir, 'GCA_3.1_genomic.fna.gz'))
+    with pytest.raises(FileNotFoundError):
+        genome_cache.find_genome('GCA_3.1', genome_dir, cache)
+
+
+@utils.in_tempdir
+def test_info(location):
+    cache = GenomeCache(os.path.join(location, 'cache'))
+    assert cache.get_info('GCA_1.1') is None
+    cache.add_info('GCA_1.1', b'acc\nGCA_1.1\n')
+    with open(cache.get_info('GCA_1.1'), 'rb') as fp:
+        assert fp.read() == b'acc\nGCA_1.1\n'
+
+
+@utils.in_tempdir
+def test_download_shared(location):
+    name = 'GCA_000000001.1_A'
+    files, md5sums = make_fixtures([name])
+    path = f'/genomes/all/{name}/{name}_genomic.fna.gz'
+    cache_dir = os.path.join(location, 'cache')
+
+    with genome_server(files, md5sums) as (url, stats):
+        info_csv = os.path.join(location, 'x.info.csv')
+        write_info_csv(info_csv, 'GCA_000000001.1', url + path)
+
+        # two projects; the genome is downloaded once.
+        outputs = []
+        for project in ('p1', 'p2'):
+            output = os.path.join(location, project, 'genome.fna.gz')
+            os.makedirs(os.path.dirname(output))
+            args = make_args(info_csvs=[info_csv], output=output,
+                             genome_cache=cache_dir, cache_max_gb=1)
+            assert download_genomes.main(args) == 0
+            outputs.append(output)
+
+        assert stats['requests'].count(path) == 1
+        for output in outputs:
+            assert os.path.islink(output)
+            with open(output, 'rb') as fp:
+                assert fp.read() == files[path]
+        assert not os.listdir(os.path.join(cache_dir, 'tmp'))
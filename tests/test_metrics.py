@@ -0,0 +1,110 @@
+import os.path
+import json
+from . import pytest_utils as utils
+
+from charcoal import metrics, stage1, perf_report
+from .test_stage1 import make_args, loomba
+
+
+def test_1_no_recording():
+    # w/o a Metrics being recorded, everything is a no-op.
+    assert metrics.current() is None
+    with metrics.genome('g'):
+        with metrics.phase('x'):
+            metrics.count('contigs', 5)
+    assert list(metrics.timed_iter('y', range(3))) == [0, 1, 2]
+
+
+@utils.in_tempdir
+def test_2_record(location):
+    filename = os.path.join(location, 'out.metrics.json')
+
+    recording = []
+
+    @metrics.record('test', output='output')
+    def main(args):
+        recording.append(metrics.current() is not None)
+        for name in ('a', 'b'):
+            with metrics.genome(name):
+                with metrics.phase('outer'):
+                    for x in metrics.timed_iter('read', range(3)):
+                        with metrics.phase('inner'):
+                            metrics.count('contigs')
+        return 0
+
+    args = utils.Args()
+    args.output = os.path.join(location, 'out')
+    args.metrics_json = None
+
+    assert main(args) == 0
+    assert recording == [True]
+    assert metrics.current() is None
+
+    with open(filename, 'rt') as fp:
+        d = json.load(fp)
+
+    assert d['program'] == 'test'
+    assert d['status'] == 0
+    assert d['counts'] == { 'contigs': 6 }
+    assert d['phases']['outer']['calls'] == 2
+    assert d['phases']['inner']['calls'] == 6
+    assert d['phases']['inner']['counts'] == { 'contigs': 6 }
+    assert 'contigs_per_s' in d['phases']['inner']['rates']
+    assert d['phases']['read']['calls'] == 8     # incl. the end of each
+    assert d['phases']['outer']['wall_s'] >= d['phases']['inner']['wall_s']
+    assert set(d['genomes']) == { 'a', 'b' }
+    assert d['genomes']['a']['counts'] == { 'contigs': 3 }
+    assert d['wall_s'] >= d['genomes']['a']['wall_s']
+
+    # w/o metrics_json in args, nothing is saved.
+    os.unlink(filename)
+    del args.metrics_json
+    assert main(args) == 0
+    assert recording == [True, False]
+    assert not os.path.exists(filename)
+
+
+@utils.in_tempdir
+def test_3_stage1_perf_report(location):
+    # run stage 1 w/metrics, and summarize them.
+    args = make_args(location,
+                     utils.relative_file(f"demo/genomes/{loomba}"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.sig"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.metrics_json = None
+
+    status = stage1.main(args)
+    assert status == 0
+
+    filename = args.hit_list + metrics.METRICS_SUFFIX
+    with open(filename, 'rt') as fp:
+        d = json.load(fp)
+
+    assert d['program'] == 'stage1'
+    assert d['peak_rss_mb'] > 0
+    for phase in ('load_taxonomy', 'load_databases', 'load_matches',
+                  'select_matches', 'build_lca', 'gather_contigs',
+                  'write_outputs'):
+        assert phase in d['phases'], phase
+
+    g = d['genomes'][loomba]
+    assert g['counts']['contigs'] == 60
+    assert g['counts']['matches'] > 0
+    assert g['phases']['gather_contigs']['counts']['contigs'] == 60
+
+    pargs = utils.Args()
+    pargs.paths = [location]
+    pargs.top = 5
+    pargs.json = os.path.join(location, 'perf.json')
+    assert perf_report.main(pargs) == 0
+
+    with open(pargs.json, 'rt') as fp:
+        summary = json.load(fp)
+    assert summary['n_files'] == 1
+    assert summary['programs']['stage1']['runs'] == 1
+    assert summary['genomes'][loomba]['counts']['contigs'] == 60
+
+    report = '\n'.join(perf_report.format_report(summary))
+    assert 'stage1:gather_contigs' in report
+    assert loomba in report
@@ -0,0 +1,124 @@
+import os.path
+import shutil
+from . import pytest_utils as utils
+
+import sourmash
+
+from charcoal import utils as charcoal_utils
+from charcoal import prepared_matches
+from charcoal.prepared_matches import (load_prepared_matches,
+                                       prepared_matches_filename)
+from charcoal.taxonomy_cache import load_taxonomy
+from charcoal.taxonomy_index import build_taxonomy_index
+
+
+loomba = 'LoombaR_2017__SID1050_bax__bin.11.fa.gz'
+
+
+def load_inputs(location):
+    "Copy the Loomba matches CSV to 'location'; load everything else."
+    matches_csv = os.path.join(location, 'matches.csv')
+    shutil.copyfile(utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                    matches_csv)
+
+    genome_sig = utils.relative_file(f"tests/test-data/loomba/{loomba}.sig")
+    genome_mh = sourmash.load_one_signature(genome_sig).minhash
+    databases = charcoal_utils.load_databases([
+        utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    tax_assign, _ = load_taxonomy(utils.relative_file("tests/test-data/test-match-lineages.csv"))
+    taxonomy = build_taxonomy_index(tax_assign)
+
+    return databases, matches_csv, genome_mh, tax_assign, taxonomy
+
+
+def summarize(prepared):
+    "The contents of a PreparedMatches, for comparison."
+    lca_db = prepared.lca_db
+    return (prepared.n_loaded,
+            [ ss.md5sum() for ss in prepared.exact_siglist ],
+            prepared.empty_mh.ksize, prepared.empty_mh.scaled,
+            dict(lca_db._ident_to_idx),
+            { k: set(v) for k, v in lca_db._hashval_to_idx.items() },
+            dict(prepared.lin_db.ident_to_lineage))
+
+
+@utils.in_tempdir
+def test_1_cache_hit(location):
+    # a cached set of matches is the same as loading from the databases.
+    databases, matches_csv, genome_mh, tax_assign, taxonomy = \
+        load_inputs(location)
+
+    picklist = charcoal_utils.load_prefetch_picklist(matches_csv)
+    fresh = charcoal_utils.load_matches_into_lca_database(databases,
+                                                          picklist,
+                                                          genome_mh,
+                                                          tax_assign,
+                                                          taxonomy)
+
+    cache = prepared_matches_filename(location, loomba)
+    first = load_prepared_matches(databases, matches_csv, genome_mh,
+                                  tax_assign, taxonomy, cache)
+    assert os.path.exists(cache)
+    assert summarize(first) == summarize(fresh)
+
+    # now load from the cache, w/o searching the databases.
+    def fail(*args):
+        assert 0, "databases should not be searched"
+
+    iter_matching_signatures = charcoal_utils.iter_matching_signatures
+    charcoal_utils.iter_matching_signatures = fail
+    try:
+        cached = load_prepared_matches(databases, matches_csv, genome_mh,
+                                       tax_assign, taxonomy, cache)
+    finally:
+        charcoal_utils.iter_matching_signatures = iter_matching_signatures
+
+    assert summarize(cached) == summarize(fresh)
+
+
+@utils.in_tempdir
+def test_2_cache_invalidated(location):
+    # changing an input invalidates the cache.
+    databases, matches_csv, genome_mh, tax_assign, taxonomy = \
+        load_inputs(location)
+
+    cache = os.path.join(location, 'prepared.gz')
+    key = prepared_matches.prepared_matches_key(databases, matches_csv,
+                                                genome_mh, tax_assign)
+    load_prepared_matches(databases, matches_csv, genome_mh, tax_assign,
+                          taxonomy, cache)
+    assert prepared_matches._read_header(cache)['key'] == key
+
+    # drop the last match from the matches CSV.
+    with open(matches_csv, 'rt') as fp:
+        lines = fp.readlines()
+    with open(matches_csv, 'wt') as fp:
+        fp.writelines(lines[:-1])
+
+    new_key = prepared_matches.prepared_matches_key(databases, matches_csv,
+                                                    genome_mh, tax_assign)
+    assert new_key != key
+
+    prepared = load_prepared_matches(databases, matches_csv, genome_mh,
+                                     tax_assign, taxonomy, cache)
+    assert prepared.n_loaded == len(lines) - 2      # header, dropped match
+    assert prepared_matches._read_header(cache)['key'] == new_key
+
+    # a different genome sketch changes the key, too.
+    other_mh = genome_mh.copy_and_clear()
+    other_mh.add_many(list(genome_mh.hashes)[:100])
+    assert prepared_matches.prepared_matches_key(databases, matches_csv,
+                                                 other_mh, tax_assign) != new_key
+
+
+@utils.in_tempdir
+def test_3_no_cache_without_taxonomy_hash(location):
+    # a plain dictionary of tax assignments can't be identified; no cache.
+    databases, matches_csv, genome_mh, tax_assign, taxonomy = \
+        load_inputs(location)
+
+    cache = os.path.join(location, 'prepared.gz')
+    prepared = load_prepared_matches(databases, matches_csv, genome_mh,
+                                     dict(tax_assign), taxonomy, cache)
+    assert prepared.lca_db is not None
+    assert not os.path.exists(cache)
@@ -0,0 +1,216 @@
+import os
+import io
+import csv
+import shutil
+import contextlib
+import sqlite3
+from . import pytest_utils as utils
+
+from charcoal import combine_csvs, utils as charcoal_utils
+from charcoal.results_db import ResultsDB, ResultsTable, load_hit_list
+
+
+loomba = 'LoombaR_2017__SID1050_bax__bin.11.fa.gz'
+
+HIT_LISTS = ["tests/test-data/loomba-hit-list.csv",
+             "tests/test-data/GCA_001593925_hit-list.csv"]
+
+
+def copy_hit_lists(location):
+    "Copy the test hit lists to 'location'."
+    filenames = []
+    for filename in HIT_LISTS:
+        dest = os.path.join(location, os.path.basename(filename))
+        shutil.copyfile(utils.relative_file(filename), dest)
+        filenames.append(dest)
+    return filenames
+
+
+def combine(filenames, sort_by, reverse):
+    "Run combine_csvs on 'filenames' and return its output."
+    args = utils.Args()
+    args.csvs = filenames
+    args.sort_by = sort_by
+    args.reverse = reverse
+    args.file_list = None
+    args.max_rows = combine_csvs.DEFAULT_MAX_ROWS
+    args.tmpdir = None
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), \
+         contextlib.redirect_stderr(io.StringIO()):
+        assert combine_csvs.main(args) == 0
+    return out.getvalue()
+
+
+@utils.in_tempdir
+def test_1_export_same_as_combine(location):
+    # exporting the hit list gives the same CSV as combine_csvs.
+    filenames = copy_hit_lists(location)
+    expected = combine(filenames, 'genus_bad_bp', True)
+
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        assert db.update('stage1_hitlist', filenames) == 2
+
+        out = io.StringIO()
+        db.export_csv('stage1_hitlist', out, 'genus_bad_bp', True)
+        assert out.getvalue() == expected
+
+        out = io.StringIO()
+        db.export_csv('stage1_hitlist', out)
+        assert out.getvalue() == combine(filenames, None, False)
+
+
+@utils.in_tempdir
+def test_2_lookup(location):
+    # look up a genome, as w/CSV_DictHelper.
+    filenames = copy_hit_lists(location)
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        db.update('stage1_hitlist', filenames)
+
+    from_csv = charcoal_utils.CSV_DictHelper(filenames[0], 'genome')
+    hit_list = load_hit_list(None, db_file)
+    assert isinstance(hit_list, ResultsTable)
+
+    assert hit_list[loomba] == from_csv[loomba]
+    assert hit_list[loomba].filter_at == 'genus'
+    assert loomba in hit_list
+    assert 'nosuchgenome' not in hit_list
+    assert len(hit_list) == 2
+    assert set(hit_list) == { loomba,
+                              'GCA_001593925.1_ASM159392v1_genomic.fna.gz' }
+
+    try:
+        hit_list['nosuchgenome']
+        assert 0, "should raise KeyError"
+    except KeyError:
+        pass
+
+    # closing the hit list closes the store.
+    with hit_list:
+        pass
+    try:
+        len(hit_list)
+        assert 0, "should raise ProgrammingError"
+    except sqlite3.ProgrammingError:
+        pass
+
+
+@utils.in_tempdir
+def test_3_incremental_update(location):
+    # only changed files are reloaded; unlisted files are removed.
+    filenames = copy_hit_lists(location)
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        assert db.update('stage1_hitlist', filenames) == 2
+        assert db.update('stage1_hitlist', filenames) == 0
+
+        # touching a file doesn't reload it, either.
+        st = os.stat(filenames[0])
+        os.utime(filenames[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert db.update('stage1_hitlist', filenames) == 0
+
+        # change the Loomba row
+        with open(filenames[0], 'rt') as fp:
+            data = fp.read()
+        with open(filenames[0], 'wt') as fp:
+            fp.write(data.replace(',genus,,', ',family,,'))
+
+        assert db.update('stage1_hitlist', filenames) == 1
+        assert db.get('stage1_hitlist', loomba)['filter_at'] == 'family'
+
+        # upserting a file directly replaces its rows, too.
+        with open(filenames[0], 'wt') as fp:
+            fp.write(data)
+        db.upsert('stage1_hitlist', filenames[0])
+        assert db.get('stage1_hitlist', loomba)['filter_at'] == 'genus'
+        assert len(list(db.iter_rows('stage1_hitlist'))) == 2
+
+        # drop a file
+        assert db.update('stage1_hitlist', filenames[1:]) == 0
+        assert db.get('stage1_hitlist', loomba) is None
+        assert len(list(db.iter_rows('stage1_hitlist'))) == 1
+
+
+@utils.in_tempdir
+def test_4_contam_pairs(location):
+    # contamination summaries round trip through the store.
+    contam_json = utils.relative_file("tests/test-data/loomba/contam.json")
+    with open(contam_json, 'rt') as fp:
+        expected = charcoal_utils.load_contamination_summary(fp)
+
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        db.upsert('contam_pairs', contam_json)
+
+        for genome, pairs in expected.items():
+            assert pairs
+            assert db.contam_summary(genome) == pairs
+        assert db.contam_summary('nosuchgenome') == []
+
+
+@utils.in_tempdir
+def test_5_mismatched_fieldnames(location):
+    filenames = copy_hit_lists(location)
+    with open(filenames[1], 'wt') as fp:
+        fp.write('genome,foo\nxyz,1\n')
+
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        try:
+            db.update('stage1_hitlist', filenames)
+            assert 0, "should raise ValueError"
+        except ValueError as exc:
+            assert 'disjoint fieldnames' in str(exc)
+
+        # nothing was loaded.
+        assert db.fieldnames('stage1_hitlist') is None
+
+
+@utils.in_tempdir
+def test_6_journal_mode(location):
+    # rollback journal by default, for shared filesystems; WAL on request.
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        mode = db.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'delete'
+
+    wal_file = os.path.join(location, 'results-wal.sqlite')
+    with ResultsDB(wal_file, wal=True) as db:
+        mode = db.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'wal'
+
+
+@utils.in_tempdir
+def test_7_readonly_lookup(location):
+    # lookups open the store read-only: they don't wait for a writer
+    # holding the write lock, and can't write.
+    filenames = copy_hit_lists(location)
+    db_file = os.path.join(location, 'results.sqlite')
+    with ResultsDB(db_file) as db:
+        db.update('stage1_hitlist', filenames)
+
+    writer = sqlite3.connect(db_file, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        with load_hit_list(None, db_file) as hit_list:
+            assert hit_list[loomba].filter_at == 'genus'
+            try:
+                hit_list.db.upsert('stage1_hitlist', filenames[0])
+                assert 0, "should raise OperationalError"
+            except sqlite3.OperationalError as exc:
+                assert 'readonly' in str(exc)
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+
+    # a missing store is not created.
+    missing = os.path.join(location, 'nosuchfile.sqlite')
+    try:
+        load_hit_list(None, missing)
+        assert 0, "should raise ValueError"
+    except ValueError as exc:
+        assert 'no results store' in str(exc)
+    assert not os.path.exists(missing)
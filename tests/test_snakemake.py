@@ -125,3 +125,32 @@ def test_make_output_prot(request):
 
     assert status == 0
     assert os.path.exists(os.path.join(_tempdir, target))
+
+
+def test_detect_resources():
+    from charcoal.__main__ import detect_cores, detect_mem_mb
+
+    cores = detect_cores()
+    assert 1 <= cores <= (os.cpu_count() or 1)
+
+    mem_mb = detect_mem_mb()
+    assert mem_mb is None or mem_mb >= 1
+
+
+def test_run_snakemake_resources(monkeypatch):
+    # cores & memory are passed to snakemake; user args come later.
+    import subprocess
+    cmds = []
+    monkeypatch.setattr(subprocess, 'check_call', cmds.append)
+
+    conf = utils.relative_file('demo/demo.conf')
+    status = run_snakemake(conf, no_use_conda=True, cores=3, mem_mb=1000,
+                           extra_args=['-j', '2', 'stage1'])
+    assert status == 0
+
+    cmd = cmds[0]
+    assert cmd[cmd.index('--resources') + 1] == 'mem_mb=1000'
+    assert cmd.index('--resources') < cmd.index('-j')
+    assert cmd[cmd.index('-j') + 1] == '3'
+    assert cmd[cmd.index('-j', cmd.index('-j') + 1) + 1] == '2'
+    assert 'stage1' in cmd
@@ -0,0 +1,299 @@
+import os.path
+import shutil
+import json
+from . import pytest_utils as utils
+
+from charcoal import stage1
+from charcoal.utils import load_contamination_summary
+
+loomba = 'LoombaR_2017__SID1050_bax__bin.11.fa.gz'
+
+
+def make_args(location, genome, genome_sig, matches_csv, databases):
+    args = utils.Args()
+    args.genome = genome
+    args.genome_sig = genome_sig
+    args.matches_csv = matches_csv
+    args.databases = databases
+    args.lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    args.provided_lineages = None
+    args.min_f_ident = stage1.F_IDENT_THRESHOLD
+    args.min_f_major = stage1.F_MAJOR_THRESHOLD
+    args.match_rank = 'genus'
+
+    args.json_out = os.path.join(location, 'tax.json')
+    args.hit_list = os.path.join(location, 'hitlist.csv')
+    args.genome_summary = os.path.join(location, 'summary.csv')
+    args.contam_summary_json = os.path.join(location, 'contam.json')
+    args.matches_json = os.path.join(location, 'matches.json')
+
+    return args
+
+
+@utils.in_tempdir
+def test_1_empty(location):
+    # test an empty set of matches (once self is removed)
+    args = make_args(location,
+                     utils.relative_file("tests/test-data/genomes/2.fa.gz"),
+                     utils.relative_file("tests/test-data/genomes/2.fa.gz.sig"),
+                     utils.relative_file("tests/test-data/2.fa.gz.gather-matches.csv"),
+                     [ utils.relative_file("tests/test-data/2.fa.gz.gather-matches.zip") ])
+
+    status = stage1.main(args)
+
+    assert status == 0
+
+    with open(args.json_out, 'rt') as fp:
+        results = json.load(fp)
+        assert results == {}
+
+    with open(args.hit_list, 'rt') as fp:
+        hitlist_csv = fp.read()
+
+    assert '2.fa.gz,none,' in hitlist_csv
+
+    with open(args.matches_json, 'rt') as fp:
+        matches = json.load(fp)
+        assert matches['matches'] == {}
+
+
+@utils.in_tempdir
+def test_2_loomba(location):
+    # regression test/check for same results on Loomba as the separate
+    # contigs_search_taxonomy, compare_taxonomy & contigs_list_contaminants
+    args = make_args(location,
+                     utils.relative_file(f"demo/genomes/{loomba}"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.sig"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+
+    status = stage1.main(args)
+
+    assert status == 0
+
+    # contigs taxonomy
+    with open(args.json_out, 'rt') as fp:
+        this_results = json.load(fp)
+
+    saved_results_file = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    with open(saved_results_file, 'rt') as fp:
+        saved_results = json.load(fp)
+
+    assert this_results == saved_results
+
+    # hit list
+    with open(args.hit_list, 'rt') as fp:
+        hitlist_csv = fp.read()
+
+    assert f'{loomba},genus,,12351,0,0,0,7286,9347,12351,0.959,0.764,d__Bacteria;p__Firmicutes_A;c__Clostridia;o__Oscillospirales;f__Acutalibacteraceae;g__Anaeromassilibacillus,' in hitlist_csv
+
+    # contamination summary
+    with open(utils.relative_file("tests/test-data/loomba/contam.json"), 'rt') as fp:
+        saved_contam = load_contamination_summary(fp)
+
+    with open(args.contam_summary_json, 'rt') as fp:
+        actual_contam = load_contamination_summary(fp)
+
+    assert saved_contam['loomba'] == actual_contam[loomba]
+
+    # contaminant matches
+    with open(args.matches_json, 'rt') as fp:
+        matches = json.load(fp)
+
+    assert matches['query_info']['genome'] == loomba
+    assert matches['query_info']['genome_lineage'] == 'd__Bacteria;p__Firmicutes_A;c__Clostridia;o__Oscillospirales;f__Acutalibacteraceae;g__Anaeromassilibacillus'
+    match_types = set([ x['match_type'] for x in matches['matches'].values() ])
+    assert match_types == { 'clean', 'dirty' }
+
+
+@utils.in_tempdir
+def test_3_batch(location):
+    # run on two genomes in batch mode, w/taxonomy & databases loaded once.
+    input_dir = os.path.join(location, 'stage1')
+    os.mkdir(input_dir)
+
+    shutil.copyfile(utils.relative_file("tests/test-data/genomes/2.fa.gz.sig"),
+                    os.path.join(input_dir, '2.fa.gz.sig'))
+    shutil.copyfile(utils.relative_file("tests/test-data/2.fa.gz.gather-matches.csv"),
+                    os.path.join(input_dir, '2.fa.gz.matches.csv'))
+    for ext in ('sig', 'matches.csv'):
+        shutil.copyfile(utils.relative_file(f"tests/test-data/loomba/{loomba}.{ext}"),
+                        os.path.join(input_dir, f'{loomba}.{ext}'))
+
+    genome_list = os.path.join(location, 'genome-list.txt')
+    with open(genome_list, 'wt') as fp:
+        fp.write(f'2.fa.gz\n\n{loomba}\n')
+
+    genome_dir = os.path.join(location, 'genomes')
+    os.mkdir(genome_dir)
+    shutil.copyfile(utils.relative_file("tests/test-data/genomes/2.fa.gz"),
+                    os.path.join(genome_dir, '2.fa.gz'))
+    shutil.copyfile(utils.relative_file(f"demo/genomes/{loomba}"),
+                    os.path.join(genome_dir, loomba))
+
+    args = make_args(location, None, None, None,
+                     [ utils.relative_file("tests/test-data/2.fa.gz.gather-matches.zip"),
+                       utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.genome_list = genome_list
+    args.genome_dir = genome_dir
+    args.input_directory = input_dir
+    args.output_directory = None
+
+    status = stage1.main(args)
+
+    assert status == 0
+
+    with open(os.path.join(input_dir, '2.fa.gz.contigs-tax.json'), 'rt') as fp:
+        assert json.load(fp) == {}
+
+    with open(os.path.join(input_dir, '2.fa.gz.hitlist_for_filtering.csv'), 'rt') as fp:
+        assert '2.fa.gz,none,' in fp.read()
+
+    with open(os.path.join(input_dir, f'{loomba}.contigs-tax.json'), 'rt') as fp:
+        this_results = json.load(fp)
+
+    saved_results_file = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    with open(saved_results_file, 'rt') as fp:
+        saved_results = json.load(fp)
+
+    assert this_results == saved_results
+
+
+@utils.in_tempdir
+def test_3_batch_shard(location):
+    # run one shard of a genome list, building sketches & prefetch
+    # matches in-process.
+    import csv
+
+    genome_dir = os.path.join(location, 'genomes')
+    input_dir = os.path.join(location, 'stage1')
+    os.mkdir(genome_dir)
+    os.mkdir(input_dir)
+
+    genome_list = os.path.join(location, 'genome-list.txt')
+    with open(genome_list, 'wt') as fp:
+        fp.write(f'2.fa.gz\n{loomba}\n')
+
+    shutil.copyfile(utils.relative_file(f"demo/genomes/{loomba}"),
+                    os.path.join(genome_dir, loomba))
+
+    args = make_args(location, None, None, None,
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.genome_list = genome_list
+    args.genome_dir = genome_dir
+    args.input_directory = input_dir
+    args.output_directory = None
+    args.shard = 1
+    args.shard_size = 1
+    args.sketch = True
+    args.ksize = 31
+    args.scaled = 1000
+    args.moltype = 'DNA'
+    args.prefetch = True
+    args.prefetch_scaled = 1000
+    args.threshold_bp = 3000
+
+    status = stage1.main(args)
+    assert status == 0
+
+    # only the second genome was run.
+    assert not os.path.exists(os.path.join(input_dir, '2.fa.gz.sig'))
+    for suffix in ('.sig', '.contigs.sketch', '.matches.txt'):
+        assert os.path.exists(os.path.join(input_dir, loomba + suffix))
+
+    # same matches as 'sourmash prefetch' found.
+    def load_match_md5s(filename):
+        with open(filename, 'rt') as fp:
+            return set(row['match_md5'] for row in csv.DictReader(fp))
+
+    saved_matches = utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv")
+    assert load_match_md5s(os.path.join(input_dir, f'{loomba}.matches.csv')) == \
+        load_match_md5s(saved_matches)
+
+    with open(os.path.join(input_dir, f'{loomba}.contigs-tax.json'), 'rt') as fp:
+        this_results = json.load(fp)
+
+    saved_results_file = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    with open(saved_results_file, 'rt') as fp:
+        saved_results = json.load(fp)
+
+    assert this_results == saved_results
+
+
+@utils.in_tempdir
+def test_4_loomba_threads(location):
+    # contig-parallel classification should give the same outputs.
+    args = make_args(location,
+                     utils.relative_file(f"demo/genomes/{loomba}"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.sig"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.threads = 1
+
+    status = stage1.main(args)
+    assert status == 0
+
+    serial = {}
+    for filename in args.json_out, args.hit_list, args.matches_json:
+        with open(filename, 'rt') as fp:
+            serial[filename] = fp.read()
+
+    args.threads = 4
+    status = stage1.main(args)
+    assert status == 0
+
+    for filename in args.json_out, args.hit_list, args.matches_json:
+        with open(filename, 'rt') as fp:
+            assert fp.read() == serial[filename]
+
+
+@utils.in_tempdir
+def test_5_loomba_binary(location):
+    # binary contigs taxonomy output has the same contents.
+    from charcoal.contigs_tax import ContigsTax, load_contigs_tax
+
+    args = make_args(location,
+                     utils.relative_file(f"demo/genomes/{loomba}"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.sig"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.json_out = os.path.join(location, 'tax.bin')
+
+    status = stage1.main(args)
+    assert status == 0
+
+    this_results = load_contigs_tax(args.json_out)
+    assert isinstance(this_results, ContigsTax)
+
+    saved_results_file = utils.relative_file(f"tests/test-data/loomba/{loomba}.contigs-tax.json")
+    saved_results = load_contigs_tax(saved_results_file)
+
+    assert dict(this_results.items()) == saved_results
+
+
+@utils.in_tempdir
+def test_6_loomba_prepared_matches(location):
+    # rerunning with cached prepared matches gives the same outputs.
+    args = make_args(location,
+                     utils.relative_file(f"demo/genomes/{loomba}"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.sig"),
+                     utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv"),
+                     [ utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip") ])
+    args.prepared_matches_dir = location
+
+    status = stage1.main(args)
+    assert status == 0
+    assert os.path.exists(os.path.join(location,
+                                       f'{loomba}.prepared-matches.gz'))
+
+    first = {}
+    for filename in args.json_out, args.hit_list, args.matches_json:
+        with open(filename, 'rt') as fp:
+            first[filename] = fp.read()
+
+    status = stage1.main(args)
+    assert status == 0
+
+    for filename in args.json_out, args.hit_list, args.matches_json:
+        with open(filename, 'rt') as fp:
+            assert fp.read() == first[filename]
@@ -0,0 +1,101 @@
+import os
+import os.path
+import shutil
+from . import pytest_utils as utils
+
+from sourmash.lca.command_index import load_taxonomy_assignments
+
+from charcoal import taxonomy_cache
+from charcoal.taxonomy_cache import load_taxonomy, TaxonomyCache
+
+
+def copy_lineages(location):
+    src = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    dest = os.path.join(location, 'lineages.csv')
+    shutil.copyfile(src, dest)
+    return dest
+
+
+@utils.in_tempdir
+def test_1_same_as_csv(location):
+    # the cache should have exactly the same contents as the CSV.
+    lineages_csv = copy_lineages(location)
+
+    tax_assign, num_rows = load_taxonomy(lineages_csv)
+    assert isinstance(tax_assign, TaxonomyCache)
+    assert os.path.exists(lineages_csv + '.taxcache')
+
+    csv_assign, csv_num_rows = load_taxonomy_assignments(lineages_csv,
+                                                         start_column=2)
+
+    assert num_rows == csv_num_rows
+    assert len(tax_assign) == len(csv_assign)
+    assert dict(tax_assign) == csv_assign
+
+    for ident in csv_assign:
+        assert ident in tax_assign
+        assert tax_assign[ident] == csv_assign[ident]
+
+    assert 'nosuchident' not in tax_assign
+    assert tax_assign.get('nosuchident') is None
+
+
+@utils.in_tempdir
+def test_2_reuse_cache(location):
+    # a second load should use the existing cache, not rebuild it.
+    lineages_csv = copy_lineages(location)
+    cache_filename = os.path.join(location, 'lineages.cache')
+
+    load_taxonomy(lineages_csv, cache_filename)
+    mtime = os.stat(cache_filename).st_mtime_ns
+
+    tax_assign, _ = load_taxonomy(lineages_csv, cache_filename)
+    assert os.stat(cache_filename).st_mtime_ns == mtime
+    assert tax_assign.filename == cache_filename
+
+
+@utils.in_tempdir
+def test_3_touched_csv(location):
+    # a CSV with a new mtime but the same contents is validated by hash.
+    lineages_csv = copy_lineages(location)
+
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    st = os.stat(lineages_csv)
+    os.utime(lineages_csv, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert tax_assign.is_valid_for(lineages_csv)
+
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    assert tax_assign.csv_mtime == st.st_mtime_ns + 10**9
+
+
+@utils.in_tempdir
+def test_4_changed_csv(location):
+    # changing the CSV should invalidate & rebuild the cache.
+    lineages_csv = copy_lineages(location)
+
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    n = len(tax_assign)
+
+    with open(lineages_csv, 'rt') as fp:
+        lines = fp.readlines()
+    with open(lineages_csv, 'wt') as fp:
+        fp.writelines(lines[:-1])
+
+    assert not tax_assign.is_valid_for(lineages_csv)
+
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    assert len(tax_assign) == n - 1
+    assert tax_assign.is_valid_for(lineages_csv)
+
+
+@utils.in_tempdir
+def test_5_bad_cache(location):
+    # a corrupt cache file is replaced.
+    lineages_csv = copy_lineages(location)
+    with open(lineages_csv + '.taxcache', 'wb') as fp:
+        fp.write(b'not a cache')
+
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    assert isinstance(tax_assign, TaxonomyCache)
+    assert len(tax_assign)
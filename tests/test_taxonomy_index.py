@@ -0,0 +1,183 @@
+import itertools
+import os.path
+import random
+from . import pytest_utils as utils
+
+import sourmash
+from sourmash.lca import LineagePair, taxlist
+from sourmash.lca import lca_utils
+from sourmash.lca.command_index import load_taxonomy_assignments
+
+from charcoal import utils as charcoal_utils
+from charcoal.lineage_db import LineageDB
+from charcoal.taxonomy_cache import load_taxonomy
+from charcoal.taxonomy_index import TaxonomyIndex, build_taxonomy_index
+
+
+def load_test_lineages():
+    "All lineages in the test lineages CSV, and all their ancestors."
+    filename = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    assignments, _ = load_taxonomy_assignments(filename, start_column=2)
+
+    lineages = set([()])
+    for lineage in assignments.values():
+        for i in range(1, len(lineage) + 1):
+            lineages.add(tuple(lineage[:i]))
+
+    # add some with empty names, too.
+    some = sorted(lineages)[:20]
+    for lineage in some:
+        if len(lineage) >= 3:
+            lineage = list(lineage)
+            lineage[1] = LineagePair(lineage[1].rank, '')
+            lineages.add(tuple(lineage))
+
+    return sorted(lineages)
+
+
+def test_1_root():
+    index = TaxonomyIndex()
+    assert index.lineage_id(()) == 0
+    assert index.lineage_id([]) == 0
+    assert index.lineage(0) == ()
+
+
+def test_2_ids_are_stable():
+    index = TaxonomyIndex()
+    lineages = load_test_lineages()
+    lids = [ index.add(lin) for lin in lineages ]
+    assert len(set(lids)) == len(lineages)
+    assert [ index.lineage_id(lin) for lin in lineages ] == lids
+    assert [ index.lineage_id(list(lin)) for lin in lineages ] == lids
+    for lid, lin in zip(lids, lineages):
+        assert index.lineage(lid) == lin
+
+
+def test_3_pop_to_rank_and_match():
+    # same results as sourmash pop_to_rank & is_lineage_match.
+    index = TaxonomyIndex()
+    lineages = load_test_lineages()
+    for lin in lineages:
+        index.add(lin)
+
+    rng = random.Random(1)
+    pairs = [ (rng.choice(lineages), rng.choice(lineages))
+              for i in range(2000) ]
+    pairs += [ (lin, lin) for lin in lineages ]
+
+    for rank in taxlist():
+        for lin in lineages:
+            lid = index.lineage_id(lin)
+            assert index.lineage(index.rank_id(lid, rank)) == \
+                lca_utils.pop_to_rank(lin, rank)
+
+        for lin_a, lin_b in pairs:
+            a, b = index.lineage_id(lin_a), index.lineage_id(lin_b)
+            assert bool(index.is_match(a, b, rank)) == \
+                bool(lca_utils.is_lineage_match(lin_a, lin_b, rank)), \
+                (lin_a, lin_b, rank)
+
+
+def test_4_disagree_rank():
+    index = TaxonomyIndex()
+    lineages = load_test_lineages()
+    for lin in lineages:
+        index.add(lin)
+
+    def find_disagree_rank(lin_a, lin_b):
+        for a, b in zip(lin_a, lin_b):
+            if a.name != b.name:
+                return a.rank
+        return None
+
+    rng = random.Random(2)
+    for i in range(2000):
+        lin_a, lin_b = rng.choice(lineages), rng.choice(lineages)
+        a, b = index.lineage_id(lin_a), index.lineage_id(lin_b)
+        assert index.disagree_rank(a, b) == find_disagree_rank(lin_a, lin_b)
+
+
+def test_5_lca():
+    # same results as sourmash build_tree & find_lca.
+    index = TaxonomyIndex()
+    lineages = load_test_lineages()
+    for lin in lineages:
+        index.add(lin)
+
+    rng = random.Random(3)
+    for i in range(2000):
+        lins = rng.sample(lineages, rng.randint(1, 4))
+        if rng.random() < 0.3:            # make some share an ancestor
+            lins = [ lins[0][:rng.randint(0, len(lins[0]))] for x in lins ] + lins[:1]
+
+        expected = lca_utils.find_lca(lca_utils.build_tree(lins))
+        lid, reason = index.lca([ index.lineage_id(x) for x in lins ])
+        assert (index.lineage(lid), reason) == expected, lins
+
+
+def test_6_lineage_db_lids():
+    # LineageDB exposes lineage ids in its taxonomy index.
+    lineages = [ lin for lin in load_test_lineages() if len(lin) == 8 ][:10]
+
+    index = TaxonomyIndex()
+    for lin in lineages:
+        index.add(lin)
+    lin_db = LineageDB(index)
+    for n, lin in enumerate(lineages):
+        lin_db.insert(f'ident{n}', lin)
+
+    for n, lin in enumerate(lineages):
+        lid = lin_db.ident_to_lid[f'ident{n}']
+        assert lin_db.taxonomy.lineage(lid) == lin
+        assert charcoal_utils.pop_to_rank(lin, 'genus') == \
+            lin_db.taxonomy.lineage(lin_db.taxonomy.rank_id(lid, 'genus'))
+
+
+def test_7_build_from_taxonomy():
+    # the index is built once from the taxonomy, cached or not.
+    filename = utils.relative_file("tests/test-data/test-match-lineages.csv")
+    assignments, _ = load_taxonomy_assignments(filename, start_column=2)
+
+    with utils.TempDirectory() as location:
+        tax_assign, _ = load_taxonomy(filename,
+                                      os.path.join(location, 'x.taxcache'))
+        index = build_taxonomy_index(tax_assign)
+
+    from_dict = build_taxonomy_index(assignments)
+    assert sorted(index.lineage_to_lid) == sorted(from_dict.lineage_to_lid)
+    for lineage in assignments.values():
+        for i in range(len(lineage) + 1):
+            assert index.lineage_id(lineage[:i]) is not None
+
+
+def test_8_unknown_lineages():
+    # unknown lineages are not added, but can be matched against.
+    lineages = load_test_lineages()
+    known = [ lin for lin in lineages if len(lin) <= 4 ]
+    index = TaxonomyIndex()
+    for lin in known:
+        index.add(lin)
+    n_lineages = len(index)
+
+    unknown = [ lin for lin in lineages if len(lin) > 4 ]
+    unknown += [ lin[:2] + (LineagePair('class', 'c__Unknown'),)
+                 for lin in known if len(lin) >= 2 ][:10]
+    unknown.append((LineagePair('superkingdom', 'd__Unknown'),))
+
+    for lin in unknown:
+        assert index.lineage_id(lin) is None
+        lid = index.match_id(lin)
+        for other in known:
+            other_lid = index.lineage_id(other)
+            for rank in taxlist():
+                assert bool(index.is_match(lid, other_lid, rank)) == \
+                    bool(lca_utils.is_lineage_match(lin, other, rank)), \
+                    (lin, other, rank)
+
+        # the utils functions fall back to sourmash for these.
+        assert charcoal_utils.pop_to_rank(lin, 'genus', index) == \
+            lca_utils.pop_to_rank(lin, 'genus')
+        assert charcoal_utils.is_lineage_match(lin, lin, 'superkingdom',
+                                               index)
+
+    assert len(index) == n_lineages
@@ -0,0 +1,116 @@
+from . import pytest_utils as utils
+
+import screed
+import sourmash
+
+from charcoal import utils as charcoal_utils
+from charcoal.taxonomy_cache import load_taxonomy
+from charcoal.taxonomy_index import build_taxonomy_index
+
+loomba = 'LoombaR_2017__SID1050_bax__bin.11.fa.gz'
+
+
+def test_load_matches_into_lca_database_exact():
+    # 2.fa.gz has only one match - itself.
+    genome_sig = utils.relative_file("tests/test-data/genomes/2.fa.gz.sig")
+    matches_csv = utils.relative_file("tests/test-data/2.fa.gz.gather-matches.csv")
+    db = utils.relative_file("tests/test-data/2.fa.gz.gather-matches.zip")
+    lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+
+    genome_mh = sourmash.load_one_signature(genome_sig).minhash
+    picklist = charcoal_utils.load_prefetch_picklist(matches_csv)
+    databases = charcoal_utils.load_databases([db])
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    taxonomy = build_taxonomy_index(tax_assign)
+
+    prepared = charcoal_utils.load_matches_into_lca_database(databases,
+                                                             picklist,
+                                                             genome_mh,
+                                                             tax_assign,
+                                                             taxonomy)
+
+    assert prepared.lca_db is None
+    assert prepared.lin_db is None
+    assert prepared.n_loaded == 1
+    assert len(prepared.exact_siglist) == 1
+
+
+def test_load_matches_into_lca_database_dedupe():
+    # loading the same database twice should not insert any duplicates.
+    genome_sig = utils.relative_file(f"tests/test-data/loomba/{loomba}.sig")
+    matches_csv = utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv")
+    db = utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip")
+    lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+
+    genome_mh = sourmash.load_one_signature(genome_sig).minhash
+    picklist = charcoal_utils.load_prefetch_picklist(matches_csv)
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    taxonomy = build_taxonomy_index(tax_assign)
+
+    databases = charcoal_utils.load_databases([db])
+    once = charcoal_utils.load_matches_into_lca_database(databases, picklist,
+                                                         genome_mh,
+                                                         tax_assign,
+                                                         taxonomy)
+
+    databases = charcoal_utils.load_databases([db, db])
+    twice = charcoal_utils.load_matches_into_lca_database(databases, picklist,
+                                                          genome_mh,
+                                                          tax_assign,
+                                                          taxonomy)
+
+    assert twice.n_loaded == 2 * once.n_loaded
+    assert not once.exact_siglist
+    assert once.empty_mh.scaled == genome_mh.scaled
+    assert len(once.empty_mh) == 0
+    assert set(once.lin_db.ident_to_lineage) == \
+        set(twice.lin_db.ident_to_lineage)
+    assert once.lca_db._hashval_to_idx.keys() == \
+        twice.lca_db._hashval_to_idx.keys()
+
+
+def test_gather_matches_same_as_best_containment():
+    # incremental gather should give exactly the same results as
+    # repeatedly calling best_containment, for the genome & each contig.
+    genome = utils.relative_file(f"demo/genomes/{loomba}")
+    genome_sig = utils.relative_file(f"tests/test-data/loomba/{loomba}.sig")
+    matches_csv = utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.csv")
+    db = utils.relative_file(f"tests/test-data/loomba/{loomba}.matches.zip")
+    lineages_csv = utils.relative_file("tests/test-data/test-match-lineages.csv")
+
+    genome_mh = sourmash.load_one_signature(genome_sig).minhash
+    picklist = charcoal_utils.load_prefetch_picklist(matches_csv)
+    databases = charcoal_utils.load_databases([db])
+    tax_assign, _ = load_taxonomy(lineages_csv)
+    taxonomy = build_taxonomy_index(tax_assign)
+
+    prepared = charcoal_utils.load_matches_into_lca_database(databases,
+                                                             picklist,
+                                                             genome_mh,
+                                                             tax_assign,
+                                                             taxonomy)
+    lca_db, lin_db = prepared.lca_db, prepared.lin_db
+
+    mhs = [genome_mh]
+    for record in screed.open(genome):
+        mh = prepared.empty_mh.copy_and_clear()
+        mh.add_sequence(record.sequence, force=True)
+        mhs.append(mh)
+
+    n_matches = 0
+    for mh in mhs:
+        expected = list(charcoal_utils.gather_matches_by_best_containment(mh, lca_db, lin_db))
+        actual = list(charcoal_utils.gather_matches(mh, lca_db, lin_db))
+        assert actual == expected
+        n_matches += len(actual)
+
+    assert n_matches > len(mhs)
+
+    # an LCA_Database w/o the expected internals gets the slower gather.
+    class PublicOnly:
+        scaled = lca_db.scaled
+        best_containment = lca_db.best_containment
+
+    for mh in mhs:
+        expected = list(charcoal_utils.gather_matches_by_best_containment(mh, lca_db, lin_db))
+        assert list(charcoal_utils.gather_matches(mh, PublicOnly(), lin_db)) == expected